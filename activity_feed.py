@@ -0,0 +1,108 @@
+"""Newest-first activity feed merged lazily from time-ordered collections.
+
+sales.json and expenses.json are appended in createdAt order, so each is
+already a sorted stream. A page is produced by walking each stream
+backwards from the cursor and merging them with heapq.merge, stopping after
+`limit` items: O(limit * log streams) per request instead of building and
+sorting every activity. Each stream is kept in memory and, when its file
+has only grown, extended with just the appended records, so a new sale
+does not mean re-reading the whole collection.
+"""
+import heapq
+import json
+import threading
+from itertools import islice
+
+from filestore import file_version, iter_records_after, tail_intact
+
+
+def _sort_key(record):
+    return (record.get('createdAt', ''), record.get('id', 0))
+
+
+def encode_cursor(activity):
+    return f"{activity['timestamp']}|{activity['type']}|{activity['_id']}"
+
+
+def decode_cursor(cursor):
+    timestamp, kind, record_id = cursor.rsplit('|', 2)
+    return timestamp, kind, int(record_id)
+
+
+def _position_before(records, key):
+    """Index of the first record whose sort key is >= key (records ascending)."""
+    low, high = 0, len(records)
+    while low < high:
+        middle = (low + high) // 2
+        if _sort_key(records[middle]) < key:
+            low = middle + 1
+        else:
+            high = middle
+    return low
+
+
+class ActivityFeed:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._sources = []
+        self._snapshots = {}
+
+    def add_source(self, kind, path, build):
+        """Register a collection; build(record) -> activity dict without type/_id."""
+        self._sources.append((kind, path, build))
+
+    def _records(self, path):
+        version = file_version(path)
+        with self._lock:
+            snapshot = self._snapshots.get(path)
+            if snapshot and snapshot[0] == version:
+                return snapshot[1]
+        # Records are only appended or deleted; read just the appended ones if that is all
+        if snapshot and tail_intact(path, snapshot[2]):
+            records, tail = snapshot[1], snapshot[2]
+        else:
+            records, tail = [], None
+        added, last = [], None
+        for record, end in iter_records_after(path, tail[0] if tail else 0):
+            added.append(record)
+            last = (end, record)
+        if last:
+            tail = (last[0], json.dumps(last[1]))
+        fresh = records[-1:] + added
+        if any(_sort_key(a) > _sort_key(b) for a, b in zip(fresh, fresh[1:])):
+            # Edited timestamps or imported data; sort once per file version
+            records = sorted(records + added, key=_sort_key)
+        else:
+            records = records + added
+        with self._lock:
+            self._snapshots[path] = (version, records, tail)
+        return records
+
+    def _stream(self, kind, path, build, cursor):
+        records = self._records(path)
+        end = len(records)
+        if cursor:
+            timestamp, cursor_kind, record_id = cursor
+            # Same timestamp: the merge orders streams by type name as the tie-break
+            if kind < cursor_kind:
+                end = _position_before(records, (timestamp, float('inf')))
+            elif kind == cursor_kind:
+                end = _position_before(records, (timestamp, record_id))
+            else:
+                end = _position_before(records, (timestamp, float('-inf')))
+        for index in range(end - 1, -1, -1):
+            record = records[index]
+            activity = build(record)
+            activity.update({'type': kind, '_id': record.get('id', 0)})
+            yield activity
+
+    def page(self, limit=100, cursor=None):
+        """(activities, next_cursor) newest first, continuing after `cursor`."""
+        position = decode_cursor(cursor) if cursor else None
+        streams = [self._stream(kind, path, build, position) for kind, path, build in self._sources]
+        merged = heapq.merge(*streams, key=lambda a: (a['timestamp'], a['type'], a['_id']), reverse=True)
+        activities = list(islice(merged, limit))
+        next_cursor = encode_cursor(activities[-1]) if len(activities) == limit else None
+        for activity in activities:
+            del activity['_id']
+        return activities, next_cursor
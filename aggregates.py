@@ -0,0 +1,159 @@
+"""Running totals behind /api/stats and /api/main-admin/stats.
+
+Counters are kept globally and per account in data/aggregates.json and are
+adjusted by every write/delete path, so the stats endpoints never sum the
+full sales or expenses history. Run `python aggregates.py --verify` to
+compare the stored counters with a full recount (add --fix to rewrite them).
+"""
+import json
+import os
+import sys
+
+from filestore import FileLock, file_version, write_json_atomic
+
+COUNTERS = ('totalSales', 'salesCount', 'itemsCount', 'totalExpenses', 'expensesCount',
+            'productsCount', 'usersCount', 'activeUsers', 'lockedUsers')
+MONEY = ('totalSales', 'totalExpenses')
+
+
+def empty_counters():
+    return {name: 0 for name in COUNTERS}
+
+
+def user_counters(user, sign=1):
+    return {
+        'usersCount': sign,
+        'activeUsers': sign if user.get('active', True) else 0,
+        'lockedUsers': sign if user.get('locked', False) else 0,
+    }
+
+
+def sale_counters(sale, sign=1):
+    return {
+        'totalSales': sign * float(sale.get('total', 0) or 0),
+        'salesCount': sign,
+        'itemsCount': sign * len(sale.get('items', [])),
+    }
+
+
+def expense_counters(expense, sign=1):
+    return {'totalExpenses': sign * float(expense.get('amount', 0) or 0), 'expensesCount': sign}
+
+
+def recount(users, products, sales, expenses):
+    """Full O(history) recount, used to seed and verify the stored counters."""
+    state = {'global': empty_counters(), 'accounts': {}}
+    for records, counters in ((users, user_counters), (sales, sale_counters), (expenses, expense_counters)):
+        for record in records:
+            _add(state, record.get('accountId'), counters(record))
+    for product in products:
+        _add(state, product.get('accountId'), {'productsCount': 1})
+    return state
+
+
+def _add(state, account_id, deltas):
+    targets = [state['global']]
+    if account_id is not None:
+        targets.append(state['accounts'].setdefault(str(account_id), empty_counters()))
+    for counters in targets:
+        for name, delta in deltas.items():
+            value = counters.get(name, 0) + delta
+            counters[name] = round(value, 2) if name in MONEY else value
+
+
+class Aggregates:
+    def __init__(self, aggregates_file):
+        self.aggregates_file = aggregates_file
+        # Held by every gunicorn worker for the whole read-modify-write
+        self._lock = FileLock(aggregates_file + '.lock')
+        self._version = object()
+        self._state = None
+
+    def _read(self):
+        version = file_version(self.aggregates_file)
+        if version != self._version:
+            with open(self.aggregates_file, 'r') as f:
+                self._state = json.load(f)
+            self._version = version
+        return self._state
+
+    def _read_locked(self):
+        # Another worker may have written since our cached copy; go to disk
+        self._version = object()
+        return self._read()
+
+    def _write(self, state):
+        write_json_atomic(self.aggregates_file, state)
+        self._state = state
+        self._version = file_version(self.aggregates_file)
+
+    def ensure(self, rebuild):
+        """Seed the counters with rebuild() if they were never persisted."""
+        if os.path.exists(self.aggregates_file):
+            return
+        with self._lock:
+            if not os.path.exists(self.aggregates_file):
+                self._write(rebuild())
+
+    def replace(self, state):
+        with self._lock:
+            self._write(state)
+
+    def apply(self, account_id, deltas):
+        with self._lock:
+            state = self._read_locked()
+            _add(state, account_id, deltas)
+            self._write(state)
+
+    def apply_many(self, changes):
+        """changes: iterable of (account_id, deltas), persisted in one write."""
+        with self._lock:
+            state = self._read_locked()
+            for account_id, deltas in changes:
+                _add(state, account_id, deltas)
+            self._write(state)
+
+    def global_counters(self):
+        return dict(self._read()['global'])
+
+    def account_counters(self, account_id):
+        return dict(self._read()['accounts'].get(str(account_id), empty_counters()))
+
+
+def _load(path):
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return []
+
+
+def main(argv):
+    data_dir = os.environ.get('DATA_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data'))
+    expected = recount(*(_load(f'{data_dir}/{name}.json') for name in ('users', 'products', 'sales', 'expenses')))
+    aggregates = Aggregates(f'{data_dir}/aggregates.json')
+    try:
+        stored = aggregates._read()
+    except (OSError, ValueError):
+        stored = None
+
+    if stored == expected:
+        print("✅ Aggregates match a full recount")
+        return 0
+
+    print("❌ Aggregates differ from a full recount")
+    if stored:
+        for scope, counters in [('global', expected['global'])] + sorted(expected['accounts'].items()):
+            current = stored['global'] if scope == 'global' else stored['accounts'].get(scope, {})
+            for name, value in counters.items():
+                if current.get(name) != value:
+                    print(f"   {scope}.{name}: stored={current.get(name)} expected={value}")
+    if '--fix' in argv:
+        aggregates.replace(expected)
+        print("✅ Aggregates rebuilt")
+        return 0
+    return 1
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -1,12 +1,32 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response, stream_with_context, g
 from flask_cors import CORS
 import jwt
 import json
+import math
 import os
 import time
 from datetime import datetime, timedelta
 from functools import wraps
 from flask_sock import Sock
+from pricing import TAX_TYPES, PricingEngine
+from inventory import StockLedger
+from batches import BatchIndex
+import aggregates
+from rollups import SalesRollups, GRANULARITIES, GROUPS
+from reports import SalesReports, METRICS
+from activity_feed import ActivityFeed
+import profit
+import export
+from precompute import ViewScheduler
+import timetracking
+import subscriptions
+from outbox import EmailOutbox
+from trials import TrialSweeper, trial_email
+from token_cache import TokenCache
+from credentials import CredentialService, CredentialsBusy, hash_password
+from ratelimit import RateLimiter
+from revocation import RevocationSet, is_locked
+from filestore import FileLock
 
 app = Flask(__name__)
 
@@ -61,6 +81,15 @@ REMINDERS_FILE = f'{DATA_DIR}/reminders.json'
 RECIPES_FILE = f'{DATA_DIR}/recipes.json'
 NOTES_FILE = f'{DATA_DIR}/cashier_notes.json'
 TIME_ENTRIES_FILE = f'{DATA_DIR}/time_entries.json'
+OPEN_SHIFTS_FILE = f'{DATA_DIR}/open_shifts.json'
+EMAILS_FILE = f'{DATA_DIR}/emails.json'
+RATE_LIMIT_FILE = f'{DATA_DIR}/ratelimit.bin'
+REVOKED_TOKENS_FILE = f'{DATA_DIR}/revoked_tokens.json'
+REVOCATION_GENERATION_FILE = f'{DATA_DIR}/revocation.gen'
+STOCK_LEDGER_FILE = f'{DATA_DIR}/stock_movements.jsonl'
+STOCK_CHECKPOINTS_FILE = f'{DATA_DIR}/stock_checkpoints.json'
+AGGREGATES_FILE = f'{DATA_DIR}/aggregates.json'
+ROLLUPS_DIR = f'{DATA_DIR}/rollups'
 
 # Ensure data directory exists and initialize empty JSON files
 os.makedirs(DATA_DIR, exist_ok=True)
@@ -97,13 +126,19 @@ def get_next_id(data):
 # Initialize all data files on startup
 for filepath in [USERS_FILE, PRODUCTS_FILE, SALES_FILE, EXPENSES_FILE, 
                  BATCHES_FILE, DISCOUNTS_FILE, CREDIT_REQUESTS_FILE, 
-                 SETTINGS_FILE, REMINDERS_FILE, TIME_ENTRIES_FILE]:
+                 SETTINGS_FILE, REMINDERS_FILE, TIME_ENTRIES_FILE,
+                 STOCK_CHECKPOINTS_FILE, EMAILS_FILE, REVOKED_TOKENS_FILE]:
     init_json_file(filepath)
 
 print(f"✅ Using file storage at: {DATA_DIR}")
 print(f"✅ Data directory exists: {os.path.exists(DATA_DIR)}")
 print(f"✅ Data files initialized")
 
+# Running totals for the stats endpoints, seeded from a full recount on first start
+stats_aggregates = aggregates.Aggregates(AGGREGATES_FILE)
+stats_aggregates.ensure(lambda: aggregates.recount(
+    load_data(USERS_FILE), load_data(PRODUCTS_FILE), load_data(SALES_FILE), load_data(EXPENSES_FILE)))
+
 # Initialize main admin user if not exists
 def init_main_admin():
     users = load_data(USERS_FILE)
@@ -117,7 +152,7 @@ def init_main_admin():
     main_admin_user = {
         'id': get_next_id(users),
         'email': admin_email,
-        'password': 'mabruk2004',
+        'password': hash_password('mabruk2004'),
         'name': 'Ian Mabruk',
         'role': 'owner',
         'plan': 'ultra',
@@ -135,10 +170,142 @@ def init_main_admin():
     
     users.append(main_admin_user)
     save_data(USERS_FILE, users)
+    stats_aggregates.apply(main_admin_user['accountId'], aggregates.user_counters(main_admin_user))
     print(f"✅ Main admin user created: {admin_email}")
 
 init_main_admin()
 
+# Server-side pricing (price tables, discount rules and tax cached per file version)
+pricing_engine = PricingEngine(PRODUCTS_FILE, DISCOUNTS_FILE, SETTINGS_FILE, load_data)
+
+# Hourly/daily sales rollups for dashboard charts, built from sales.json on first start
+sales_rollups = SalesRollups(ROLLUPS_DIR)
+sales_rollups.ensure(SALES_FILE)
+
+# Top-N product and category reports, cached until sales/products change
+sales_reports = SalesReports(SALES_FILE, PRODUCTS_FILE, load_data)
+
+# Gross margin reports over columnar sales lines and batch costs
+profit_reports = profit.ProfitReports(SALES_FILE, BATCHES_FILE, PRODUCTS_FILE, load_data)
+
+# Owner activity feed, merged newest-first from the sales and expense streams
+activity_feed = ActivityFeed()
+activity_feed.add_source('sale', SALES_FILE, lambda sale: {
+    'description': f"Sale of {len(sale.get('items', []))} items",
+    'amount': sale.get('total', 0),
+    'timestamp': sale.get('createdAt', ''),
+    'user': sale.get('soldBy', 'Unknown'),
+    'accountId': sale.get('accountId', 'main'),
+    'sale': sale
+})
+activity_feed.add_source('expense', EXPENSES_FILE, lambda expense: {
+    'description': expense.get('description', 'Expense'),
+    'amount': expense.get('amount', 0),
+    'timestamp': expense.get('createdAt', ''),
+    'user': expense.get('addedBy', 'Unknown'),
+    'accountId': expense.get('accountId', 'main'),
+    'expense': expense
+})
+
+# Append-only stock movement ledger; product['quantity'] is the materialized on-hand
+stock_ledger = StockLedger(STOCK_LEDGER_FILE, STOCK_CHECKPOINTS_FILE, load_data, save_data)
+
+# Open batches per product in expiry order, consumed first-expired-first-out
+batch_index = BatchIndex(BATCHES_FILE, load_data, save_data)
+
+# Clock in/out shifts indexed by time, for attendance and payroll queries
+time_index = timetracking.TimeIndex(TIME_ENTRIES_FILE, load_data)
+
+# Trial/subscription status per user, cached per users.json version and day
+subscription_status = subscriptions.SubscriptionStatus(USERS_FILE, load_data)
+
+# Outgoing email is queued in emails.json and sent in batches by a worker;
+# the sweeper queues trial reminder/upgrade emails as trials run out
+email_outbox = EmailOutbox(EMAILS_FILE, load_data, save_data)
+trial_sweeper = TrialSweeper(USERS_FILE, load_data, email_outbox)
+
+@app.before_request
+def start_background_jobs():
+    # Threads don't survive gunicorn's preload fork; both calls are a pid check once running
+    email_outbox.start()
+    trial_sweeper.start()
+
+# cashierId -> open shift, so clock in/out and "who is on shift" need no scan
+open_shifts = timetracking.OpenShifts(OPEN_SHIFTS_FILE, TIME_ENTRIES_FILE, load_data, save_data)
+# Held across read, check and save of time_entries.json, so two workers cannot
+# both clock the same cashier in; taken before open_shifts' own lock
+time_entries_lock = FileLock(TIME_ENTRIES_FILE + '.lock')
+# Held across read and save of settings.json (one record per account)
+settings_lock = FileLock(SETTINGS_FILE + '.lock')
+
+# Decoded claims per token, so repeat requests skip the HMAC check
+token_cache = TokenCache()
+
+# Locked users and revoked tokens, reloaded only when another request changes them
+revocations = RevocationSet(USERS_FILE, REVOKED_TOKENS_FILE, REVOCATION_GENERATION_FILE, load_data, save_data)
+
+def bearer_token():
+    return request.headers.get('Authorization', '').replace('Bearer ', '')
+
+# scrypt password hashing on a bounded pool; overflow is answered with 503
+credential_service = CredentialService()
+
+def credentials_busy():
+    response = jsonify({'error': 'Server busy, please retry shortly'})
+    response.headers['Retry-After'] = '1'
+    return response, 503
+
+# Token buckets per account and per IP, shared by all workers through an mmap'd file
+rate_limiter = RateLimiter(RATE_LIMIT_FILE)
+AUTH_PATHS = ('/api/auth/login', '/api/auth/signup', '/api/auth/pin-login', '/api/main-admin/auth/login')
+# Proxies in front of gunicorn; 0 trusts no X-Forwarded-For, since clients can forge it
+PROXY_HOPS = int(os.environ.get('RATE_LIMIT_PROXY_HOPS', 0))
+
+def client_ip():
+    """Client address as seen by our nearest proxy (its X-Forwarded-For entry can't be spoofed)"""
+    forwarded = [a.strip() for a in request.headers.get('X-Forwarded-For', '').split(',') if a.strip()]
+    if PROXY_HOPS and len(forwarded) >= PROXY_HOPS:
+        return forwarded[-PROXY_HOPS]
+    return request.remote_addr
+
+@app.before_request
+def enforce_rate_limits():
+    if request.method == 'OPTIONS' or not request.path.startswith('/api/'):
+        return None
+    if request.path in AUTH_PATHS:
+        group = 'auth'
+    elif request.method in ('POST', 'PUT', 'PATCH', 'DELETE'):
+        group = 'write'
+    else:
+        return None
+    
+    identities = [('ip', client_ip())]
+    if group == 'auth':
+        email = (request.get_json(silent=True) or {}).get('email')
+        if isinstance(email, str) and email:
+            identities.append(('login', email.lower()))
+    else:
+        token = bearer_token()
+        try:
+            identities.append(('account', token_cache.decode(token, app.config['SECRET_KEY']).get('accountId')))
+        except Exception:
+            pass  # token_required rejects it
+    
+    allowed, remaining, retry_after = rate_limiter.hit(group, identities)
+    g.rate_limit = (int(rate_limiter.limits[group][0]), remaining)
+    if not allowed:
+        response = jsonify({'error': 'Too many requests', 'retryAfter': math.ceil(retry_after)})
+        response.headers['Retry-After'] = str(math.ceil(retry_after))
+        return response, 429
+    return None
+
+@app.after_request
+def add_rate_limit_headers(response):
+    if 'rate_limit' in g:
+        response.headers['X-RateLimit-Limit'] = str(g.rate_limit[0])
+        response.headers['X-RateLimit-Remaining'] = str(g.rate_limit[1])
+    return response
+
 def token_required(f):
     @wraps(f)
     def decorated(*args, **kwargs):
@@ -146,14 +313,20 @@ def token_required(f):
         if request.method == 'OPTIONS':
             return '', 200
         
-        token = request.headers.get('Authorization', '').replace('Bearer ', '')
+        token = bearer_token()
         if not token:
             return jsonify({'error': 'Token missing'}), 401
         try:
-            data = jwt.decode(token, app.config['SECRET_KEY'], algorithms=['HS256'])
+            data = token_cache.decode(token, app.config['SECRET_KEY'])
             request.user = data
         except:
             return jsonify({'error': 'Invalid token'}), 401
+        
+        blocked = revocations.check(token, data)
+        if blocked == 'locked':
+            return jsonify({'error': 'Account locked'}), 403
+        if blocked == 'revoked':
+            return jsonify({'error': 'Token revoked'}), 401
         return f(*args, **kwargs)
     return decorated
 
@@ -183,7 +356,8 @@ def products_ws(ws):
         return
 
     try:
-        jwt.decode(token, app.config['SECRET_KEY'], algorithms=['HS256'])
+        if revocations.check(token, token_cache.decode(token, app.config['SECRET_KEY'])):
+            raise jwt.InvalidTokenError('locked or revoked')
     except Exception:
         try:
             ws.send(json.dumps({'error': 'Invalid token'}))
@@ -247,7 +421,7 @@ def signup():
         user = {
             'id': get_next_id(users),
             'email': data['email'],
-            'password': data['password'],
+            'password': credential_service.hash(data['password']),
             'name': data['name'],
             'role': 'admin' if plan_type in ['1600', 'ultra', 'paid'] else 'cashier',
             'plan': plan_type,
@@ -264,6 +438,7 @@ def signup():
         
         users.append(user)
         save_data(USERS_FILE, users)
+        stats_aggregates.apply(user['accountId'], aggregates.user_counters(user))
         
         token = jwt.encode({'id': user['id'], 'email': user['email'], 'role': user['role'], 'accountId': user['accountId']}, 
                           app.config['SECRET_KEY'], algorithm='HS256')
@@ -272,6 +447,8 @@ def signup():
             'token': token,
             'user': {k: v for k, v in user.items() if k != 'password'}
         })
+    except CredentialsBusy:
+        return credentials_busy()
     except Exception as e:
         import traceback
         error_msg = f"{str(e)} | {traceback.format_exc()}"
@@ -296,9 +473,20 @@ def login():
         
         users = load_data(USERS_FILE)
         
-        user = next((u for u in users if u.get('email') == data['email'] and u.get('password') == data['password']), None)
-        if not user:
+        user = next((u for u in users if u.get('email') == data['email']), None)
+        matches, needs_rehash = credential_service.verify(data['password'], user.get('password') if user else None)
+        if not user or not matches:
             return jsonify({'error': 'Invalid credentials'}), 401
+        if is_locked(user):
+            return jsonify({'error': 'Account locked'}), 403
+        
+        # Upgrade legacy plaintext (or weaker-cost) passwords on a successful login
+        if needs_rehash:
+            try:
+                user['password'] = credential_service.hash(data['password'])
+                save_data(USERS_FILE, users)
+            except CredentialsBusy:
+                pass  # Try again on the next login
         
         token = jwt.encode({'id': user['id'], 'email': user['email'], 'role': user['role'], 'accountId': user['accountId']}, 
                           app.config['SECRET_KEY'], algorithm='HS256')
@@ -307,12 +495,24 @@ def login():
             'token': token,
             'user': {k: v for k, v in user.items() if k != 'password'}
         })
+    except CredentialsBusy:
+        return credentials_busy()
     except Exception as e:
         import traceback
         error_msg = f"{str(e)} | {traceback.format_exc()}"
         print(f"Login error: {error_msg}")
         return jsonify({'error': 'Login failed', 'message': str(e), 'details': error_msg}), 500
 
+@app.route('/api/auth/logout', methods=['POST', 'OPTIONS'])
+@token_required
+def logout():
+    """Revoke the presented token"""
+    if request.method == 'OPTIONS':
+        return '', 200
+    
+    revocations.revoke(bearer_token(), request.user)
+    return jsonify({'success': True})
+
 @app.route('/api/auth/pin-login', methods=['POST', 'OPTIONS'])
 def pin_login():
     """Login using PIN instead of password"""
@@ -341,6 +541,8 @@ def pin_login():
         # Simple PIN validation - in production, use bcrypt or similar
         if str(data['pin']) != str(user.get('pin', data['pin'])):
             return jsonify({'error': 'Invalid PIN'}), 401
+        if is_locked(user):
+            return jsonify({'error': 'Account locked'}), 403
         
         token = jwt.encode({'id': user['id'], 'email': user['email'], 'role': user['role'], 'accountId': user['accountId']}, 
                           app.config['SECRET_KEY'], algorithm='HS256')
@@ -460,19 +662,8 @@ def main_admin_get_all_sales():
         if not current_user or current_user.get('role') != 'owner':
             return jsonify({'error': 'Access denied. Owner access required'}), 403
         
-        # Load all sales
-        sales = load_data(SALES_FILE)
-        
-        # Aggregate statistics
-        total_sales = sum(s.get('total', 0) for s in sales)
-        total_items = sum(len(s.get('items', [])) for s in sales)
-        
-        return jsonify({
-            'sales': sales,
-            'total': total_sales,
-            'count': len(sales),
-            'itemsCount': total_items
-        })
+        # Precomputed in the background; see compute_all_sales()
+        return view_response('sales-all')
     except Exception as e:
         print(f"Get all sales error: {str(e)}")
         return jsonify({'error': str(e)}), 500
@@ -484,35 +675,23 @@ def main_admin_get_stats():
     if request.method == 'OPTIONS':
         return '', 200
     try:
-        # Verify owner access from token
-        users = load_data(USERS_FILE)
-        current_user_id = request.user.get('id')
-        current_user = next((u for u in users if u.get('id') == current_user_id), None)
-        
-        if not current_user or current_user.get('role') != 'owner':
+        # Verify owner access from the signed token claims (no users.json scan)
+        if request.user.get('role') != 'owner':
             return jsonify({'error': 'Access denied. Owner access required'}), 403
         
-        # Load all data
-        sales = load_data(SALES_FILE)
-        expenses = load_data(EXPENSES_FILE)
-        products = load_data(PRODUCTS_FILE)
-        all_users = load_data(USERS_FILE)
-        
-        # Calculate totals
-        total_sales = sum(s.get('total', 0) for s in sales)
-        total_expenses = sum(e.get('amount', 0) for e in expenses)
-        profit = total_sales - total_expenses
+        # Running totals, maintained on every write
+        counters = stats_aggregates.global_counters()
         
         return jsonify({
-            'totalSales': total_sales,
-            'totalExpenses': total_expenses,
-            'profit': profit,
-            'salesCount': len(sales),
-            'expensesCount': len(expenses),
-            'productsCount': len(products),
-            'usersCount': len(all_users),
-            'activeUsers': len([u for u in all_users if u.get('active', True)]),
-            'lockedUsers': len([u for u in all_users if u.get('locked', False)])
+            'totalSales': counters['totalSales'],
+            'totalExpenses': counters['totalExpenses'],
+            'profit': round(counters['totalSales'] - counters['totalExpenses'], 2),
+            'salesCount': counters['salesCount'],
+            'expensesCount': counters['expensesCount'],
+            'productsCount': counters['productsCount'],
+            'usersCount': counters['usersCount'],
+            'activeUsers': counters['activeUsers'],
+            'lockedUsers': counters['lockedUsers']
         })
     except Exception as e:
         print(f"Get stats error: {str(e)}")
@@ -521,7 +700,7 @@ def main_admin_get_stats():
 @app.route('/api/main-admin/activities', methods=['GET'])
 @token_required
 def main_admin_get_activities():
-    """Get ALL activities/events from ALL users"""
+    """Get ALL activities/events from ALL users, newest first (?limit=&cursor= for older pages)"""
     try:
         # Verify owner access
         current_user_id = request.headers.get('X-User-Id')
@@ -531,38 +710,16 @@ def main_admin_get_activities():
         if not current_user or current_user.get('role') != 'owner':
             return jsonify({'error': 'Access denied. Owner access required'}), 403
         
-        # Get all sales as activities (each sale is an activity)
-        sales = load_data(SALES_FILE)
-        activities = []
-        
-        for sale in sales:
-            activities.append({
-                'type': 'sale',
-                'description': f"Sale of {len(sale.get('items', []))} items",
-                'amount': sale.get('total', 0),
-                'timestamp': sale.get('createdAt', ''),
-                'user': sale.get('soldBy', 'Unknown'),
-                'accountId': sale.get('accountId', 'main'),
-                'sale': sale
-            })
-        
-        # Add expense activities
-        expenses = load_data(EXPENSES_FILE)
-        for expense in expenses:
-            activities.append({
-                'type': 'expense',
-                'description': expense.get('description', 'Expense'),
-                'amount': expense.get('amount', 0),
-                'timestamp': expense.get('createdAt', ''),
-                'user': expense.get('addedBy', 'Unknown'),
-                'accountId': expense.get('accountId', 'main'),
-                'expense': expense
-            })
-        
-        # Sort by timestamp (most recent first)
-        activities.sort(key=lambda x: x.get('timestamp', ''), reverse=True)
+        limit = max(1, min(request.args.get('limit', 100, type=int), 500))
+        try:
+            activities, next_cursor = activity_feed.page(limit, request.args.get('cursor'))
+        except ValueError:
+            return jsonify({'error': 'Invalid cursor'}), 400
         
-        return jsonify(activities[:100])  # Return last 100 activities
+        response = jsonify(activities)
+        if next_cursor:
+            response.headers['X-Next-Cursor'] = next_cursor
+        return response
     except Exception as e:
         print(f"Get activities error: {str(e)}")
         return jsonify({'error': str(e)}), 500
@@ -580,22 +737,8 @@ def main_admin_get_all_time_entries():
         if not current_user or current_user.get('role') != 'owner':
             return jsonify({'error': 'Access denied. Owner access required'}), 403
         
-        # Load all time entries
-        time_entries = load_data(TIME_ENTRIES_FILE) if os.path.exists(TIME_ENTRIES_FILE) else []
-        
-        # Group by user
-        entries_by_user = {}
-        for entry in time_entries:
-            user_id = entry.get('userId')
-            if user_id not in entries_by_user:
-                entries_by_user[user_id] = []
-            entries_by_user[user_id].append(entry)
-        
-        return jsonify({
-            'timeEntries': time_entries,
-            'entriesByUser': entries_by_user,
-            'totalEntries': len(time_entries)
-        })
+        # Precomputed in the background; see compute_all_time_entries()
+        return view_response('time-entries-all')
     except Exception as e:
         print(f"Get time entries error: {str(e)}")
         return jsonify({'error': str(e)}), 500
@@ -623,7 +766,7 @@ def handle_products():
         'id': get_next_id(products),
         'name': data['name'],
         'price': float(data['price']),
-        'quantity': float(data.get('quantity', 0)),  # Changed to float for weight support
+        'quantity': 0.0,  # Opening stock is recorded through the ledger below
         'unit': data.get('unit', 'pcs'),  # 'pcs', 'kg', 'liters', 'grams', etc.
         'unitPrice': float(data.get('unitPrice', data['price'])),  # Price per unit/kg
         'category': data.get('category', 'general'),
@@ -635,7 +778,14 @@ def handle_products():
     }
     
     products.append(product)
+    stock_ledger.record(products, [{
+        'productId': product['id'],
+        'delta': float(data.get('quantity', 0)),  # Float for weight support
+        'type': 'adjustment',
+        'ref': 'opening'
+    }])
     save_data(PRODUCTS_FILE, products)
+    stats_aggregates.apply(product['accountId'], {'productsCount': 1})
     
     # Broadcast product creation to all connected clients
     broadcast_update('product_created', {
@@ -659,7 +809,16 @@ def handle_product(product_id):
     
     if request.method == 'PUT':
         data = request.get_json()
+        # Quantity edits go through the ledger so they keep a history
+        new_quantity = data.pop('quantity', None)
         product.update(data)
+        if new_quantity is not None:
+            stock_ledger.record(products, [{
+                'productId': product_id,
+                'delta': float(new_quantity) - float(product.get('quantity', 0)),
+                'type': 'adjustment',
+                'ref': 'product_edit'
+            }])
         save_data(PRODUCTS_FILE, products)
         
         # Broadcast product update to all connected clients
@@ -673,6 +832,7 @@ def handle_product(product_id):
     if request.method == 'DELETE':
         products = [p for p in products if p['id'] != product_id]
         save_data(PRODUCTS_FILE, products)
+        stats_aggregates.apply(product.get('accountId'), {'productsCount': -1})
         
         # Broadcast product deletion to all connected clients
         broadcast_update('product_deleted', {
@@ -698,13 +858,22 @@ def update_stock(product_id):
     data = request.get_json()
     
     # Handle different stock update types
+    current = product.get('quantity', 0)
     if 'quantity' in data:
-        product['quantity'] = int(data['quantity'])
+        delta = int(data['quantity']) - current
     elif 'increment' in data:
-        product['quantity'] = product.get('quantity', 0) + int(data['increment'])
+        delta = int(data['increment'])
     elif 'decrement' in data:
-        product['quantity'] = max(0, product.get('quantity', 0) - int(data['decrement']))
-    
+        delta = max(0, current - int(data['decrement'])) - current
+    else:
+        delta = 0
+    
+    stock_ledger.record(products, [{
+        'productId': product_id,
+        'delta': delta,
+        'type': 'adjustment',
+        'ref': data.get('reason', 'stock_update')
+    }])
     save_data(PRODUCTS_FILE, products)
     
     # Broadcast stock update to all connected clients
@@ -809,10 +978,14 @@ def handle_users():
         return jsonify([{k: v for k, v in u.items() if k != 'password'} for u in users])
     
     data = request.get_json()
+    try:
+        password = credential_service.hash(data.get('password', 'changeme123'))
+    except CredentialsBusy:
+        return credentials_busy()
     user = {
         'id': get_next_id(users),
         'email': data['email'],
-        'password': data.get('password', 'changeme123'),
+        'password': password,
         'name': data['name'],
         'role': 'cashier',
         'plan': 'ultra',
@@ -824,6 +997,7 @@ def handle_users():
     
     users.append(user)
     save_data(USERS_FILE, users)
+    stats_aggregates.apply(user['accountId'], aggregates.user_counters(user))
     
     return jsonify({k: v for k, v in user.items() if k != 'password'})
 
@@ -848,6 +1022,8 @@ def delete_user(user_id):
         # Remove the user
         users = [u for u in users if u['id'] != user_id]
         save_data(USERS_FILE, users)
+        stats_aggregates.apply(user_to_delete.get('accountId'), aggregates.user_counters(user_to_delete, -1))
+        token_cache.forget_user(user_id)
         
         # Broadcast update
         broadcast_update('user_deleted', {'userId': user_id})
@@ -875,10 +1051,14 @@ def bulk_delete_users():
         original_count = len(users)
         
         # Filter out the users to delete (but keep owner)
+        deleted = [u for u in users if u['id'] in user_ids and u.get('role') != 'owner']
         users = [u for u in users if u['id'] not in user_ids or u.get('role') == 'owner']
         deleted_count = original_count - len(users)
         
         save_data(USERS_FILE, users)
+        stats_aggregates.apply_many((u.get('accountId'), aggregates.user_counters(u, -1)) for u in deleted)
+        for u in deleted:
+            token_cache.forget_user(u['id'])
         
         # Broadcast update
         broadcast_update('users_bulk_deleted', {'deletedCount': deleted_count, 'userIds': user_ids})
@@ -891,65 +1071,49 @@ def bulk_delete_users():
 @app.route('/api/main-admin/users-with-subscriptions', methods=['GET'])
 @token_required
 def get_users_with_subscriptions():
-    """Get all users enriched with subscription tracking data"""
-    users = load_data(USERS_FILE)
-    now = datetime.now()
-    
-    enriched_users = []
-    for u in users:
-        # Skip if no createdAt (shouldn't happen with new code)
-        if 'createdAt' not in u:
-            u['createdAt'] = datetime.now().isoformat()
-        
-        # Parse createdAt to datetime
-        try:
-            created_at = datetime.fromisoformat(u['createdAt'])
-        except:
-            created_at = datetime.now()
-        
-        # Calculate days active
-        days_active = (now - created_at).days
-        
-        # Determine if user is on free trial
-        is_free_trial = u.get('plan') in [None, 'free', '']
-        
-        # Check if reached 30-day limit
-        has_reached_trial_limit = days_active >= 30 and is_free_trial
-        
-        # Calculate days until expiry
-        days_until_expiry = max(0, 30 - days_active) if is_free_trial else 0
-        
-        # Determine subscription status
-        if is_free_trial:
-            if has_reached_trial_limit:
-                subscription_status = 'trial_expired'
-            else:
-                subscription_status = 'free_trial'
-        else:
-            subscription_status = 'paid'
-        
-        # Calculate trial expiry date
-        trial_expiry_date = None
-        if is_free_trial:
-            trial_expiry_date = (created_at + timedelta(days=30)).isoformat()
-        
-        # Enrich user object
-        enriched_user = {
-            k: v for k, v in u.items() if k != 'password'
-        }
-        enriched_user.update({
-            'daysActive': days_active,
-            'isFreeTrial': is_free_trial,
-            'hasReachedTrialLimit': has_reached_trial_limit,
-            'daysUntilExpiry': days_until_expiry,
-            'subscriptionStatus': subscription_status,
-            'trialExpireDate': trial_expiry_date,
-            'planPrice': 0 if is_free_trial else 99  # Default prices - adjust as needed
-        })
-        
-        enriched_users.append(enriched_user)
-    
-    return jsonify(enriched_users)
+    """Users enriched with subscription tracking data: ?status=&offset=&limit="""
+    status = request.args.get('status')
+    if status and status not in subscriptions.STATUSES:
+        return jsonify({'error': f'status must be one of {", ".join(subscriptions.STATUSES)}'}), 400
+    offset = max(0, request.args.get('offset', 0, type=int))
+    limit = request.args.get('limit', type=int)
+    
+    users, total = subscription_status.page(status, offset, max(1, limit) if limit else None)
+    response = jsonify(users)
+    response.headers['X-Total-Count'] = str(total)
+    return response
+
+def compute_all_sales():
+    """All sales with system-wide totals for the owner console"""
+    sales = load_data(SALES_FILE)
+    return {
+        'sales': sales,
+        'total': sum(s.get('total', 0) for s in sales),
+        'count': len(sales),
+        'itemsCount': sum(len(s.get('items', [])) for s in sales)
+    }
+
+def compute_all_time_entries():
+    """All clock in/out entries, also grouped by user"""
+    time_entries = load_data(TIME_ENTRIES_FILE)
+    entries_by_user = {}
+    for entry in time_entries:
+        entries_by_user.setdefault(entry.get('userId'), []).append(entry)
+    return {
+        'timeEntries': time_entries,
+        'entriesByUser': entries_by_user,
+        'totalEntries': len(time_entries)
+    }
+
+# Owner console views, refreshed off the request path with generation numbers
+owner_views = ViewScheduler()
+owner_views.register('sales-all', compute_all_sales, [SALES_FILE], interval=300)
+owner_views.register('time-entries-all', compute_all_time_entries, [TIME_ENTRIES_FILE], interval=300)
+
+def view_response(name):
+    """Serve a precomputed view with its generation, age and staleness headers"""
+    body, headers = owner_views.get(name)
+    return Response(body, mimetype='application/json', headers=headers)
 
 @app.route('/api/main-admin/send-email', methods=['POST'])
 @token_required
@@ -965,31 +1129,65 @@ def send_admin_email():
     if not user:
         return jsonify({'error': 'User not found'}), 404
     
-    # In production, integrate with email service (SendGrid, Mailgun, etc.)
-    # For now, just return success
-    if email_type == 'upgrade':
-        # Send upgrade email
-        subject = 'Your free trial has expired - Upgrade now!'
-        message = f"Hi {user.get('name', 'User')}, your 30-day free trial has ended. Please upgrade to continue using our service."
-    elif email_type == 'reminder':
-        # Send reminder email
-        days_left = data.get('daysLeft', 5)
-        subject = f'Your free trial expires in {days_left} days'
-        message = f"Hi {user.get('name', 'User')}, your free trial expires in {days_left} days. Upgrade now to avoid losing access."
-    else:
+    if email_type not in ('upgrade', 'reminder'):
         return jsonify({'error': 'Invalid email type'}), 400
+    subject, message = trial_email(user, email_type, data.get('daysLeft', 5))
     
-    # TODO: Implement actual email sending
-    # For now, just log and return success
-    print(f"[EMAIL] To: {user.get('email')}, Subject: {subject}")
+    # Queued in emails.json; the outbox worker sends it (SMTP_HOST) with retries
+    email = email_outbox.enqueue(user.get('email'), subject, message, user=user, kind=email_type)
     
     return jsonify({
         'success': True,
-        'message': f'Email sent to {user.get("email")}',
+        'message': f'Email queued for {user.get("email")}',
         'user_id': user_id,
-        'type': email_type
+        'type': email_type,
+        'emailId': email['id']
     })
 
+@app.route('/api/main-admin/auth-cache', methods=['GET', 'OPTIONS'])
+@token_required
+def get_auth_cache_stats():
+    """Token cache hit rate and size for this worker"""
+    if request.method == 'OPTIONS':
+        return '', 200
+    if request.user.get('role') != 'owner':
+        return jsonify({'error': 'Access denied. Owner access required'}), 403
+    
+    return jsonify(dict(token_cache.stats(), pid=os.getpid(), revocation=revocations.stats()))
+
+@app.route('/api/main-admin/credentials-pool', methods=['GET', 'OPTIONS'])
+@token_required
+def get_credentials_pool_stats():
+    """Password hashing pool counters for this worker"""
+    if request.method == 'OPTIONS':
+        return '', 200
+    if request.user.get('role') != 'owner':
+        return jsonify({'error': 'Access denied. Owner access required'}), 403
+    
+    return jsonify(dict(credential_service.stats(), pid=os.getpid()))
+
+@app.route('/api/main-admin/rate-limits', methods=['GET', 'OPTIONS'])
+@token_required
+def get_rate_limit_stats():
+    """Allowed/limited counts per route group, across all workers"""
+    if request.method == 'OPTIONS':
+        return '', 200
+    if request.user.get('role') != 'owner':
+        return jsonify({'error': 'Access denied. Owner access required'}), 403
+    
+    return jsonify(rate_limiter.stats())
+
+@app.route('/api/main-admin/email-outbox', methods=['GET', 'OPTIONS'])
+@token_required
+def get_email_outbox_stats():
+    """Outbox counts by status and worker counters"""
+    if request.method == 'OPTIONS':
+        return '', 200
+    if request.user.get('role') != 'owner':
+        return jsonify({'error': 'Access denied. Owner access required'}), 403
+    
+    return jsonify(email_outbox.stats())
+
 @app.route('/api/main-admin/users/<int:user_id>/lock', methods=['POST', 'OPTIONS'])
 @token_required
 def toggle_user_lock(user_id):
@@ -1007,8 +1205,16 @@ def toggle_user_lock(user_id):
         if not user:
             return jsonify({'error': 'User not found'}), 404
         
+        before = aggregates.user_counters(user, -1)
         user['active'] = not locked
+        user['locked'] = locked
         save_data(USERS_FILE, users)
+        # Existing tokens stop (or resume) working on every worker right away
+        revocations.users_changed()
+        if locked:
+            token_cache.forget_user(user_id)
+        stats_aggregates.apply_many([(user.get('accountId'), before),
+                                     (user.get('accountId'), aggregates.user_counters(user))])
         
         # Broadcast update
         broadcast_update('user_lock_toggled', {
@@ -1039,33 +1245,63 @@ def handle_sales():
         return jsonify(sales)
     
     data = request.get_json()
+    
+    # Price the cart server-side; client totals are not trusted
+    try:
+        quote = pricing_engine.quote(data or {}, request.user['accountId'])
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
     products = load_data(PRODUCTS_FILE)
+    products_by_id = {p['id']: p for p in products}
+    sale_id = get_next_id(sales)
     
     # Process sale items - deduct inventory and handle composite products
-    for item in data.get('items', []):
-        product = next((p for p in products if p['id'] == item['productId']), None)
+    movements = []
+    line_movements = []
+    for item in quote['items']:
+        product = products_by_id.get(item['productId'])
+        drawn = []
         if product:
             # Support both quantity and weight (quantity can be fractional for weight-based products)
             sold_amount = float(item.get('quantity', item.get('weight', 0)))
-            product['quantity'] = float(product.get('quantity', 0)) - sold_amount
+            drawn.append({'productId': product['id'], 'delta': -sold_amount, 'type': 'sale', 'ref': sale_id})
             
             # If composite product, deduct ingredients
             if product.get('isComposite'):
                 for ingredient in product.get('ingredients', []):
-                    ingredient_product = next((p for p in products if p['id'] == ingredient['productId']), None)
-                    if ingredient_product:
-                        ingredient_quantity = float(ingredient.get('quantity', 0))
-                        ingredient_product['quantity'] = float(ingredient_product.get('quantity', 0)) - (ingredient_quantity * sold_amount)
-    
+                    ingredient_quantity = float(ingredient.get('quantity', 0))
+                    drawn.append({
+                        'productId': ingredient['productId'],
+                        'delta': -(ingredient_quantity * sold_amount),
+                        'type': 'composite',
+                        'ref': sale_id
+                    })
+        movements.extend(drawn)
+        line_movements.append(drawn)
+    
+    stock_ledger.record(products, movements, request.user['accountId'])
     save_data(PRODUCTS_FILE, products)
     
+    # Draw the same quantities from batches, earliest expiry first, and cost the lines
+    allocations = iter(batch_index.consume([(m['productId'], -m['delta']) for m in movements]))
+    for item, drawn in zip(quote['items'], line_movements):
+        item['batches'] = []
+        for movement in drawn:
+            for allocation in next(allocations):
+                item['batches'].append(dict(allocation, productId=movement['productId']))
+        item['cost'] = round(sum(a['cost'] for a in item['batches']), 2)
+    
     sale = {
-        'id': get_next_id(sales),
-        'items': data['items'],
-        'total': float(data['total']),
-        'discount': float(data.get('discount', 0)),
-        'tax': float(data.get('tax', 0)),
-        'taxType': data.get('taxType', 'exclusive'),
+        'id': sale_id,
+        'items': quote['items'],
+        'subtotal': quote['subtotal'],
+        'total': quote['total'],
+        'discount': quote['discount'],
+        'discounts': quote['discounts'],
+        'tax': quote['tax'],
+        'taxRate': quote['taxRate'],
+        'taxType': quote['taxType'],
         'paymentMethod': data.get('paymentMethod', 'cash'),
         'accountId': request.user['accountId'],
         'cashierId': request.user['id'],
@@ -1075,6 +1311,8 @@ def handle_sales():
     
     sales.append(sale)
     save_data(SALES_FILE, sales)
+    stats_aggregates.apply(sale['accountId'], aggregates.sale_counters(sale))
+    sales_rollups.add_sale(sale)
     
     # Broadcast sale to all connected clients so admin sees it immediately
     broadcast_update('sale_created', {
@@ -1084,6 +1322,22 @@ def handle_sales():
     
     return jsonify(sale)
 
+@app.route('/api/cart/quote', methods=['POST', 'OPTIONS'])
+@token_required
+def cart_quote():
+    """Price a cart server-side without recording a sale"""
+    if request.method == 'OPTIONS':
+        return '', 200
+    
+    data = request.get_json()
+    if not data:
+        return jsonify({'error': 'Invalid request body', 'message': 'Request body must be JSON'}), 400
+    
+    try:
+        return jsonify(pricing_engine.quote(data, request.user['accountId']))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
 @app.route('/api/sales/<int:sale_id>', methods=['DELETE', 'OPTIONS'])
 @token_required
 def delete_sale(sale_id):
@@ -1101,6 +1355,8 @@ def delete_sale(sale_id):
         # Remove the sale
         sales = [s for s in sales if s['id'] != sale_id]
         save_data(SALES_FILE, sales)
+        stats_aggregates.apply(sale_to_delete.get('accountId'), aggregates.sale_counters(sale_to_delete, -1))
+        sales_rollups.remove_sales([sale_to_delete])
         
         # Broadcast update
         broadcast_update('sale_deleted', {'saleId': sale_id})
@@ -1128,10 +1384,13 @@ def bulk_delete_sales():
         original_count = len(sales)
         
         # Filter out the sales to delete
+        deleted = [s for s in sales if s['id'] in sale_ids]
         sales = [s for s in sales if s['id'] not in sale_ids]
         deleted_count = original_count - len(sales)
         
         save_data(SALES_FILE, sales)
+        stats_aggregates.apply_many((s.get('accountId'), aggregates.sale_counters(s, -1)) for s in deleted)
+        sales_rollups.remove_sales(deleted)
         
         # Broadcast update
         broadcast_update('sales_bulk_deleted', {'deletedCount': deleted_count, 'saleIds': sale_ids})
@@ -1147,18 +1406,190 @@ def stats():
     if request.method == 'OPTIONS':
         return '', 200
     
-    sales = load_data(SALES_FILE)
-    products = load_data(PRODUCTS_FILE)
+    counters = stats_aggregates.account_counters(request.user['accountId'])
     
-    total_sales = sum(s.get('total', 0) for s in sales)
+    return jsonify({
+        'totalSales': counters['totalSales'],
+        'totalExpenses': counters['totalExpenses'],
+        'profit': round(counters['totalSales'] - counters['totalExpenses'], 2),
+        'productCount': counters['productsCount']
+    })
+
+def report_range(default_days=30):
+    """(start, end) datetimes from ?from=&to=; bare dates and defaults cover whole days"""
+    to_arg = request.args.get('to', '')
+    end = datetime.fromisoformat(to_arg) if to_arg else datetime.now()
+    if len(to_arg) in (0, 10):
+        end = datetime.combine(end.date(), datetime.max.time())
+    if request.args.get('from'):
+        start = datetime.fromisoformat(request.args['from'])
+    else:
+        start = datetime.combine(end.date() - timedelta(days=default_days), datetime.min.time())
+    return start, end
+
+def report_account_id():
+    """Owner may report on any account via ?accountId=; everyone else sees their own"""
+    if request.user.get('role') == 'owner' and request.args.get('accountId'):
+        return request.args.get('accountId')
+    return request.user['accountId']
+
+def account_cashier_ids(account_id):
+    """Ids of an account's users; time entries only carry the cashierId"""
+    return {u['id'] for u in load_data(USERS_FILE) if str(u.get('accountId')) == str(account_id)}
+
+@app.route('/api/reports/timeseries', methods=['GET', 'OPTIONS'])
+@token_required
+def reports_timeseries():
+    """Sales per hour/day from the rollups: ?from=&to=&granularity=hour|day&groupBy=cashier|paymentMethod"""
+    if request.method == 'OPTIONS':
+        return '', 200
+    
+    granularity = request.args.get('granularity', 'day')
+    group_by = request.args.get('groupBy')
+    if granularity not in GRANULARITIES:
+        return jsonify({'error': f'granularity must be one of {", ".join(GRANULARITIES)}'}), 400
+    if group_by and group_by not in GROUPS:
+        return jsonify({'error': f'groupBy must be one of {", ".join(GROUPS)}'}), 400
+    
+    try:
+        start, end = report_range()
+    except ValueError:
+        return jsonify({'error': 'from/to must be ISO dates'}), 400
+    account_id = report_account_id()
+    
+    return jsonify({
+        'accountId': account_id,
+        'granularity': granularity,
+        'groupBy': group_by,
+        'from': start.isoformat(),
+        'to': end.isoformat(),
+        'rows': sales_rollups.series(account_id, start.isoformat(), end.isoformat(), granularity, group_by)
+    })
+
+@app.route('/api/reports/top-products', methods=['GET', 'OPTIONS'])
+@token_required
+def reports_top_products():
+    """Best sellers in a date range: ?from=&to=&limit=10&metric=revenue|quantity"""
+    if request.method == 'OPTIONS':
+        return '', 200
+    
+    metric = request.args.get('metric', 'revenue')
+    if metric not in METRICS:
+        return jsonify({'error': f'metric must be one of {", ".join(METRICS)}'}), 400
+    try:
+        start, end = report_range()
+    except ValueError:
+        return jsonify({'error': 'from/to must be ISO dates'}), 400
+    limit = max(1, min(request.args.get('limit', 10, type=int), 500))
+    
+    return jsonify({
+        'from': start.isoformat(),
+        'to': end.isoformat(),
+        'metric': metric,
+        'products': sales_reports.top_products(report_account_id(), start.isoformat(), end.isoformat(), limit, metric)
+    })
+
+@app.route('/api/reports/categories', methods=['GET', 'OPTIONS'])
+@token_required
+def reports_categories():
+    """Revenue and quantity per product category in a date range: ?from=&to=&limit="""
+    if request.method == 'OPTIONS':
+        return '', 200
+    
+    try:
+        start, end = report_range()
+    except ValueError:
+        return jsonify({'error': 'from/to must be ISO dates'}), 400
+    limit = request.args.get('limit', type=int)
+    
+    return jsonify({
+        'from': start.isoformat(),
+        'to': end.isoformat(),
+        'categories': sales_reports.categories(report_account_id(), start.isoformat(), end.isoformat(), limit)
+    })
+
+@app.route('/api/reports/profit', methods=['GET', 'OPTIONS'])
+@token_required
+def reports_profit():
+    """Revenue, COGS and gross margin: ?from=&to=&groupBy=product|day|account"""
+    if request.method == 'OPTIONS':
+        return '', 200
     
+    group_by = request.args.get('groupBy', 'product')
+    if group_by not in profit.GROUPS:
+        return jsonify({'error': f'groupBy must be one of {", ".join(profit.GROUPS)}'}), 400
+    try:
+        start, end = report_range()
+    except ValueError:
+        return jsonify({'error': 'from/to must be ISO dates'}), 400
+    
+    # Owner sees every account unless one is picked; everyone else sees their own
+    account_id = report_account_id()
+    if request.user.get('role') == 'owner' and not request.args.get('accountId'):
+        account_id = None
+    
+    rows = profit_reports.report(group_by, start.isoformat(), end.isoformat(), account_id)
+    revenue = round(sum(r['revenue'] for r in rows), 2)
+    cogs = round(sum(r['cogs'] for r in rows), 2)
     return jsonify({
-        'totalSales': total_sales,
-        'totalExpenses': 0,
-        'profit': total_sales,
-        'productCount': len(products)
+        'from': start.isoformat(),
+        'to': end.isoformat(),
+        'groupBy': group_by,
+        'revenue': revenue,
+        'cogs': cogs,
+        'grossMargin': round(revenue - cogs, 2),
+        'rows': rows
     })
 
+@app.route('/api/export/<collection>', methods=['GET', 'OPTIONS'])
+@token_required
+def export_collection(collection):
+    """Stream sales, expenses or time-entries as gzip CSV or Parquet: ?format=csv|parquet&from=&to="""
+    if request.method == 'OPTIONS':
+        return '', 200
+    
+    files = {'sales': SALES_FILE, 'expenses': EXPENSES_FILE, 'time-entries': TIME_ENTRIES_FILE}
+    if collection not in files:
+        return jsonify({'error': f'Unknown collection. Use one of {", ".join(files)}'}), 404
+    
+    export_format = request.args.get('format', 'csv')
+    if export_format not in ('csv', 'parquet'):
+        return jsonify({'error': 'format must be csv or parquet'}), 400
+    if export_format == 'parquet' and not export.parquet_available():
+        return jsonify({'error': 'Parquet export requires pyarrow on the server'}), 400
+    
+    start = request.args.get('from')
+    end = request.args.get('to')
+    if end and len(end) == 10:
+        end = f'{end}T23:59:59.999999'
+    
+    # Owner exports everything (or ?accountId=); everyone else their own account
+    if request.user.get('role') == 'owner' and not request.args.get('accountId'):
+        accept = None
+    else:
+        account_id = str(report_account_id())
+        if collection == 'time-entries':
+            cashier_ids = account_cashier_ids(account_id)
+            accept = lambda record: record.get('cashierId') in cashier_ids
+        else:
+            accept = lambda record: str(record.get('accountId')) == account_id
+    
+    columns = export.COLLECTIONS[collection]['columns']
+    rows = export.iter_rows(files[collection], collection, start, end, accept)
+    filename = f"{collection}-{datetime.now().strftime('%Y%m%d')}"
+    if export_format == 'parquet':
+        body = export.parquet_chunks(rows, columns)
+        mimetype, filename = 'application/vnd.apache.parquet', f'{filename}.parquet'
+    elif request.args.get('gzip', '1') == '0':
+        body = export.csv_chunks(rows, columns)
+        mimetype, filename = 'text/csv', f'{filename}.csv'
+    else:
+        body = export.gzip_chunks(export.csv_chunks(rows, columns))
+        mimetype, filename = 'application/gzip', f'{filename}.csv.gz'
+    
+    return Response(stream_with_context(body), mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename="{filename}"'})
+
 @app.route('/api/reminders/today', methods=['GET', 'OPTIONS'])
 @token_required
 def reminders_today():
@@ -1172,15 +1603,45 @@ def settings():
     if request.method == 'OPTIONS':
         return '', 200
     
+    account_id = request.user['accountId']
+    
     if request.method == 'GET':
-        return jsonify({
+        saved = next((s for s in load_data(SETTINGS_FILE) if s.get('accountId') == account_id), {})
+        tax_type, tax_rate = pricing_engine.tax(account_id)
+        settings_data = {
             'screenLockPassword': '2005',
             'businessName': 'My Business',
-            'timezone': 'UTC'
-        })
+            'timezone': 'UTC',
+            'taxType': tax_type,
+            'taxRate': tax_rate
+        }
+        settings_data.update((k, v) for k, v in saved.items() if k != 'accountId')
+        return jsonify(settings_data)
     
     data = request.get_json()
-    return jsonify(data)
+    if not isinstance(data, dict):
+        return jsonify({'error': 'Invalid request body', 'message': 'Request body must be a JSON object'}), 400
+    if 'taxType' in data and data['taxType'] not in TAX_TYPES:
+        return jsonify({'error': f"taxType must be one of {', '.join(TAX_TYPES)}"}), 400
+    if 'taxRate' in data:
+        try:
+            data['taxRate'] = float(data['taxRate'])
+        except (TypeError, ValueError):
+            return jsonify({'error': 'taxRate must be a non-negative number'}), 400
+        if data['taxRate'] < 0:
+            return jsonify({'error': 'taxRate must be a non-negative number'}), 400
+    
+    # Each account keeps one record; a POST updates the keys it sends
+    with settings_lock:
+        all_settings = load_data(SETTINGS_FILE)
+        saved = next((s for s in all_settings if s.get('accountId') == account_id), None)
+        if saved is None:
+            saved = {'accountId': account_id}
+            all_settings.append(saved)
+        saved.update((k, v) for k, v in data.items() if k != 'accountId')
+        save_data(SETTINGS_FILE, all_settings)
+    
+    return jsonify({k: v for k, v in saved.items() if k != 'accountId'})
 
 @app.route('/api/expenses', methods=['GET', 'POST', 'OPTIONS'])
 @token_required
@@ -1202,26 +1663,26 @@ def batches():
     
     # POST - Create new batch
     data = request.get_json()
-    batches_data = load_data(BATCHES_FILE)
-    
-    batch = {
-        'id': max([b.get('id', 0) for b in batches_data], default=0) + 1,
+    batch = batch_index.add({
         'productId': int(data.get('productId')),
         'quantity': int(data.get('quantity', 0)),
+        'remaining': int(data.get('quantity', 0)),  # Drawn down FEFO by sales
         'expiryDate': data.get('expiryDate', ''),
         'batchNumber': data.get('batchNumber', f'BATCH-{datetime.now().strftime("%Y%m%d%H%M%S")}'),
         'cost': float(data.get('cost', 0)),
         'createdAt': datetime.now().isoformat()
-    }
-    
-    batches_data.append(batch)
-    save_data(BATCHES_FILE, batches_data)
+    })
     
     # Also update product quantity in products.json
     products = load_data(PRODUCTS_FILE)
     product = next((p for p in products if p['id'] == batch['productId']), None)
     if product:
-        product['quantity'] = product.get('quantity', 0) + batch['quantity']
+        stock_ledger.record(products, [{
+            'productId': batch['productId'],
+            'delta': batch['quantity'],
+            'type': 'receipt',
+            'ref': batch['id']
+        }])
         save_data(PRODUCTS_FILE, products)
         
         # Broadcast stock update to all connected clients
@@ -1233,6 +1694,60 @@ def batches():
     
     return jsonify(batch), 201
 
+@app.route('/api/batches/expiring', methods=['GET', 'OPTIONS'])
+@token_required
+def expiring_batches():
+    """Open batches expiring within ?days= (default 7), soonest first"""
+    if request.method == 'OPTIONS':
+        return '', 200
+    
+    days = request.args.get('days', 7, type=int)
+    cutoff = datetime.combine((datetime.now() + timedelta(days=days)).date(), datetime.max.time()).isoformat()
+    product_id = request.args.get('productId', type=int)
+    # Batches belong to an account through their product
+    product_ids = {p['id'] for p in load_data(PRODUCTS_FILE) if p.get('accountId') == request.user['accountId']}
+    if product_id:
+        product_ids &= {product_id}
+    
+    return jsonify(batch_index.expiring_before(cutoff, product_ids))
+
+@app.route('/api/inventory/movements', methods=['GET', 'OPTIONS'])
+@token_required
+def inventory_movements():
+    """Most recent stock movements, newest first"""
+    if request.method == 'OPTIONS':
+        return '', 200
+    
+    product_id = request.args.get('productId', type=int)
+    limit = min(request.args.get('limit', 100, type=int), 1000)
+    return jsonify(stock_ledger.movements(product_id=product_id, account_id=request.user['accountId'], limit=limit))
+
+@app.route('/api/inventory/on-hand', methods=['GET', 'OPTIONS'])
+@token_required
+def inventory_on_hand():
+    """On-hand stock per product, now or as of ?at=<ISO timestamp>"""
+    if request.method == 'OPTIONS':
+        return '', 200
+    
+    account_id = request.user['accountId']
+    products = [p for p in load_data(PRODUCTS_FILE) if p.get('accountId') == account_id]
+    at = request.args.get('at')
+    
+    if at:
+        try:
+            at = datetime.fromisoformat(at).isoformat()
+        except ValueError:
+            return jsonify({'error': 'Invalid at timestamp'}), 400
+        on_hand = stock_ledger.on_hand_at(at)
+        quantities = {p['id']: on_hand.get(p['id'], 0) for p in products}
+    else:
+        quantities = {p['id']: p.get('quantity', 0) for p in products}
+    
+    return jsonify({
+        'at': at or datetime.now().isoformat(),
+        'onHand': [{'productId': pid, 'quantity': qty} for pid, qty in quantities.items()]
+    })
+
 @app.route('/api/credit-requests', methods=['GET', 'POST', 'OPTIONS'])
 @token_required
 def credit_requests():
@@ -1261,6 +1776,7 @@ def discounts_endpoint():
             'value': float(data.get('value', 0)),
             'description': data.get('description', ''),
             'active': data.get('active', True),
+            'accountId': request.user['accountId'],
             'createdAt': datetime.now().isoformat()
         }
         discounts.append(discount)
@@ -1425,22 +1941,31 @@ def handle_time_entries():
     cashier_name = request.user.get('name', 'Unknown')
     
     if action == 'clock_in':
-        # Create new time entry
-        entry = {
-            'id': get_next_id(time_entries),
-            'cashierId': cashier_id,
-            'cashierName': cashier_name,
-            'cashierEmail': request.user.get('email'),
-            'clockInTime': datetime.now().isoformat(),
-            'clockOutTime': None,
-            'duration': None,  # In minutes
-            'status': 'clocked_in',
-            'date': datetime.now().strftime('%Y-%m-%d'),
-            'createdAt': datetime.now().isoformat()
-        }
-        
-        time_entries.append(entry)
-        save_data(TIME_ENTRIES_FILE, time_entries)
+        with time_entries_lock:
+            # One open shift per cashier, checked against a fresh read
+            time_entries = load_data(TIME_ENTRIES_FILE)
+            current = open_shifts.get(cashier_id)
+            if current:
+                return jsonify({'error': 'Already clocked in', 'entryId': current['entryId'],
+                                'clockInTime': current['clockInTime']}), 409
+            
+            # Create new time entry
+            entry = {
+                'id': get_next_id(time_entries),
+                'cashierId': cashier_id,
+                'cashierName': cashier_name,
+                'cashierEmail': request.user.get('email'),
+                'clockInTime': datetime.now().isoformat(),
+                'clockOutTime': None,
+                'duration': None,  # In minutes
+                'status': 'clocked_in',
+                'date': datetime.now().strftime('%Y-%m-%d'),
+                'createdAt': datetime.now().isoformat()
+            }
+            
+            time_entries.append(entry)
+            save_data(TIME_ENTRIES_FILE, time_entries)
+            open_shifts.opened(entry)
         
         # Broadcast clock in to all connected clients
         broadcast_update('cashier_clocked_in', {
@@ -1451,25 +1976,26 @@ def handle_time_entries():
         return jsonify(entry), 201
     
     elif action == 'clock_out':
-        # Find the latest open time entry for this cashier
-        open_entry = next(
-            (e for e in reversed(time_entries) if e.get('cashierId') == cashier_id and e.get('status') == 'clocked_in'),
-            None
-        )
-        
-        if not open_entry:
-            return jsonify({'error': 'No active clock in found'}), 404
-        
-        # Calculate duration
-        clock_in = datetime.fromisoformat(open_entry['clockInTime'])
-        clock_out = datetime.now()
-        duration = int((clock_out - clock_in).total_seconds() / 60)  # Duration in minutes
-        
-        open_entry['clockOutTime'] = clock_out.isoformat()
-        open_entry['duration'] = duration
-        open_entry['status'] = 'clocked_out'
-        
-        save_data(TIME_ENTRIES_FILE, time_entries)
+        with time_entries_lock:
+            # Find this cashier's open time entry via the open-shift index
+            time_entries = load_data(TIME_ENTRIES_FILE)
+            current = open_shifts.get(cashier_id)
+            open_entry = timetracking.find_entry(time_entries, current['entryId']) if current else None
+            
+            if not open_entry or open_entry.get('status') != 'clocked_in':
+                return jsonify({'error': 'No active clock in found'}), 404
+            
+            # Calculate duration
+            clock_in = datetime.fromisoformat(open_entry['clockInTime'])
+            clock_out = datetime.now()
+            duration = int((clock_out - clock_in).total_seconds() / 60)  # Duration in minutes
+            
+            open_entry['clockOutTime'] = clock_out.isoformat()
+            open_entry['duration'] = duration
+            open_entry['status'] = 'clocked_out'
+            
+            save_data(TIME_ENTRIES_FILE, time_entries)
+            open_shifts.closed(cashier_id)
         
         # Broadcast clock out to all connected clients
         broadcast_update('cashier_clocked_out', {
@@ -1500,8 +2026,15 @@ def handle_time_entry(entry_id):
     
     if request.method == 'PUT':
         data = request.get_json()
-        entry.update(data)
-        save_data(TIME_ENTRIES_FILE, time_entries)
+        with time_entries_lock:
+            time_entries = load_data(TIME_ENTRIES_FILE)
+            entry = next((e for e in time_entries if e['id'] == entry_id), None)
+            if not entry:
+                return jsonify({'error': 'Time entry not found'}), 404
+            entry.update(data)
+            save_data(TIME_ENTRIES_FILE, time_entries)
+            # Edits may open, close or reassign a shift
+            open_shifts.rebuild(time_entries)
         
         # Broadcast time entry update
         broadcast_update('time_entry_updated', {
@@ -1512,8 +2045,15 @@ def handle_time_entry(entry_id):
         return jsonify(entry)
     
     if request.method == 'DELETE':
-        time_entries = [e for e in time_entries if e['id'] != entry_id]
-        save_data(TIME_ENTRIES_FILE, time_entries)
+        with time_entries_lock:
+            time_entries = load_data(TIME_ENTRIES_FILE)
+            entry = next((e for e in time_entries if e['id'] == entry_id), None)
+            if not entry:
+                return jsonify({'error': 'Time entry not found'}), 404
+            time_entries = [e for e in time_entries if e['id'] != entry_id]
+            save_data(TIME_ENTRIES_FILE, time_entries)
+            if entry.get('status') == 'clocked_in':
+                open_shifts.closed(entry.get('cashierId'))
         
         # Broadcast time entry deletion
         broadcast_update('time_entry_deleted', {
@@ -1535,6 +2075,16 @@ def get_cashier_time_entries(cashier_id):
     
     return jsonify(cashier_entries)
 
+@app.route('/api/time-entries/on-shift', methods=['GET', 'OPTIONS'])
+@token_required
+def get_on_shift():
+    """The caller's account's staff currently clocked in, from the open-shift index"""
+    if request.method == 'OPTIONS':
+        return '', 200
+    
+    cashier_ids = account_cashier_ids(request.user['accountId'])
+    return jsonify([shift for shift in open_shifts.on_shift() if shift.get('cashierId') in cashier_ids])
+
 @app.route('/api/time-entries/today', methods=['GET', 'OPTIONS'])
 @token_required
 def get_today_time_entries():
@@ -1542,12 +2092,44 @@ def get_today_time_entries():
     if request.method == 'OPTIONS':
         return '', 200
     
-    time_entries = load_data(TIME_ENTRIES_FILE)
-    today = datetime.now().strftime('%Y-%m-%d')
-    today_entries = [e for e in time_entries if e.get('date') == today]
+    today = datetime.combine(datetime.now().date(), datetime.min.time())
+    today_entries = time_index.started_between(today, today + timedelta(days=1))
     
     return jsonify(today_entries)
 
+@app.route('/api/payroll/summary', methods=['GET', 'OPTIONS'])
+@token_required
+def payroll_summary():
+    """Hours worked per cashier: ?from=&to=&granularity=day|week&cashierId="""
+    if request.method == 'OPTIONS':
+        return '', 200
+    
+    granularity = request.args.get('granularity', 'day')
+    if granularity not in timetracking.GRANULARITIES:
+        return jsonify({'error': f'granularity must be one of {", ".join(timetracking.GRANULARITIES)}'}), 400
+    try:
+        start, end = report_range(default_days=13)
+        cashier_id = request.args.get('cashierId', type=int)
+    except ValueError:
+        return jsonify({'error': 'from/to must be ISO dates'}), 400
+    
+    # Cashiers only see their own hours
+    if request.user.get('role') not in ('admin', 'owner'):
+        cashier_id = request.user.get('id')
+    
+    # Admins see their own account's staff, not every tenant's
+    cashier_ids = account_cashier_ids(request.user['accountId'])
+    cashiers = [c for c in time_index.hours(start, end, granularity, cashier_id) if c['cashierId'] in cashier_ids]
+    return jsonify({
+        'from': start.isoformat(),
+        'to': end.isoformat(),
+        'granularity': granularity,
+        'cashiers': cashiers,
+        'totalHours': round(sum(c['totalHours'] for c in cashiers), 2),
+        'onShift': [e for e in time_index.clocked_in()
+                    if e.get('cashierId') in cashier_ids and (cashier_id is None or e.get('cashierId') == cashier_id)]
+    })
+
 @app.route('/api/clear-data', methods=['POST', 'OPTIONS'])
 @token_required
 def clear_data():
@@ -1564,6 +2146,7 @@ def clear_data():
         # Clear sales - just delete ALL sales
         if clear_type in ['sales', 'all']:
             save_data(SALES_FILE, [])
+            sales_rollups.reset()
             files_cleared.append('sales')
         
         # Clear expenses - just delete ALL expenses
@@ -1576,6 +2159,10 @@ def clear_data():
             save_data(USERS_FILE, [])
             files_cleared.append('users')
         
+        # Cleared collections invalidate the running totals; recount once
+        stats_aggregates.replace(aggregates.recount(
+            load_data(USERS_FILE), load_data(PRODUCTS_FILE), load_data(SALES_FILE), load_data(EXPENSES_FILE)))
+        
         # Broadcast update to all clients
         broadcast_update('data_cleared', {
             'type': clear_type,
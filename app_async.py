@@ -0,0 +1,224 @@
+"""Asyncio serving mode for the hot read endpoints of app_db.py.
+
+A plain ASGI application (no framework needed) on database_async.py. One
+worker process keeps many requests in flight while they wait on Postgres,
+instead of one per gunicorn worker. Serves:
+
+  GET /api/health
+  GET /api/auth/me
+  GET /api/products
+  GET /api/sales      (?afterId=&since=&limit=, streamed like app_db)
+  GET /api/stats
+  GET /api/settings
+
+Everything else stays on app_db.py; route /api/* reads here and the rest to
+gunicorn at the proxy. Run with any ASGI server; uvicorn is in
+requirements.txt:
+
+  uvicorn app_async:app --host 0.0.0.0 --port 5001
+
+One process already overlaps all in-flight queries; scale out with one
+such process per core.
+"""
+import json
+import os
+from datetime import date, datetime
+from urllib.parse import parse_qs
+
+import jwt
+
+import database_async as db
+
+SECRET_KEY = os.environ.get('SECRET_KEY', 'your-secret-key-change-in-production')
+STREAM_CHUNK_ROWS = 500
+
+CORS_HEADERS = [
+    (b'access-control-allow-origin', b'*'),
+    (b'access-control-allow-methods', b'GET, POST, PUT, DELETE, OPTIONS'),
+    (b'access-control-allow-headers', b'*'),
+]
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+def _default(o):
+    # timestamptz columns come back as datetimes; keep sending ISO strings
+    if isinstance(o, (date, datetime)):
+        return o.isoformat()
+    raise TypeError(f'Object of type {type(o).__name__} is not JSON serializable')
+
+
+def dumps(value):
+    return json.dumps(value, default=_default, sort_keys=True)
+
+
+async def send_json(send, value, status=200):
+    body = dumps(value).encode()
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': [(b'content-type', b'application/json'),
+                            (b'content-length', str(len(body)).encode())] + CORS_HEADERS})
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def next_chunk(rows):
+    """Up to STREAM_CHUNK_ROWS more encoded rows from an async iterator"""
+    batch = []
+    async for row in rows:
+        batch.append(dumps(row))
+        if len(batch) >= STREAM_CHUNK_ROWS:
+            break
+    return batch
+
+
+async def send_json_array(send, rows):
+    """Stream an async iterable of rows as one JSON array, chunk by chunk.
+
+    The first chunk is fetched before the headers are sent, so a query that
+    fails up front still gets a JSON error response.
+    """
+    rows = aiter(rows)
+    batch = await next_chunk(rows)
+    await send({'type': 'http.response.start', 'status': 200,
+                'headers': [(b'content-type', b'application/json')] + CORS_HEADERS})
+    prefix = '['
+    while batch:
+        await send({'type': 'http.response.body', 'body': (prefix + ','.join(batch)).encode(), 'more_body': True})
+        prefix = ','
+        batch = await next_chunk(rows)
+    await send({'type': 'http.response.body', 'body': b'[]' if prefix == '[' else b']'})
+
+
+def authenticate(scope):
+    headers = dict(scope['headers'])
+    token = headers.get(b'authorization', b'').decode().replace('Bearer ', '')
+    if not token:
+        raise HTTPError(401, 'Token missing')
+    try:
+        return jwt.decode(token, SECRET_KEY, algorithms=['HS256'])
+    except jwt.InvalidTokenError:
+        raise HTTPError(401, 'Invalid token')
+
+
+def page_args(query):
+    """(after_id, since, limit) from ?afterId=&since=&limit=, as in app_db.page_args"""
+    def integer(name):
+        try:
+            return int(query[name][0]) if name in query else None
+        except ValueError:
+            return None
+    after_id, limit = integer('afterId'), integer('limit')
+    since = query.get('since', [None])[0] or None
+    if limit is not None and limit < 1:
+        raise HTTPError(400, 'limit must be positive')
+    if since:
+        try:
+            datetime.fromisoformat(since)
+        except ValueError:
+            raise HTTPError(400, 'Invalid since timestamp')
+    return after_id, since, limit
+
+
+async def health(scope, send, user, query):
+    await send_json(send, {'status': 'ok', 'dbPool': db.pool_stats()})
+
+
+async def me(scope, send, user, query):
+    found = await db.get_user_by_id(user['id'])
+    if not found:
+        raise HTTPError(404, 'User not found')
+    await send_json(send, {k: v for k, v in found.items() if k != 'password'})
+
+
+async def products(scope, send, user, query):
+    await send_json(send, await db.get_products_by_account(user.get('accountId')))
+
+
+async def sales(scope, send, user, query):
+    after_id, since, limit = page_args(query)
+    await send_json_array(send, db.iter_sales(user.get('accountId'), after_id=after_id, since=since, limit=limit))
+
+
+async def stats(scope, send, user, query):
+    account_id = user.get('accountId')
+    product_list = await db.get_products_by_account(account_id)
+    total_sales = await db.sales_total(account_id)
+    await send_json(send, {
+        'totalSales': total_sales,
+        'totalExpenses': 0,
+        'profit': total_sales,
+        'productCount': len(product_list)
+    })
+
+
+async def settings(scope, send, user, query):
+    await send_json(send, await db.get_settings())
+
+
+# path -> (handler, needs a token)
+ROUTES = {
+    '/api/health': (health, False),
+    '/api/auth/me': (me, True),
+    '/api/products': (products, True),
+    '/api/sales': (sales, True),
+    '/api/stats': (stats, True),
+    '/api/settings': (settings, True),
+}
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            try:
+                await db.init_db()
+                await db.get_pool()
+            except Exception as e:
+                await send({'type': 'lifespan.startup.failed', 'message': str(e)})
+                return
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await db.close_pool()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        return await lifespan(receive, send)
+    if scope['type'] != 'http':
+        return
+    if scope['method'] == 'OPTIONS':
+        await send({'type': 'http.response.start', 'status': 200, 'headers': CORS_HEADERS})
+        await send({'type': 'http.response.body', 'body': b''})
+        return
+
+    started = False
+
+    async def tracked_send(message):
+        nonlocal started
+        started = started or message['type'] == 'http.response.start'
+        await send(message)
+
+    route = ROUTES.get(scope['path'].rstrip('/') or '/')
+    try:
+        if route is None:
+            raise HTTPError(404, 'Not found')
+        if scope['method'] != 'GET':
+            raise HTTPError(405, 'Method not allowed')
+        handler, protected = route
+        user = authenticate(scope) if protected else None
+        query = parse_qs(scope.get('query_string', b'').decode())
+        await handler(scope, tracked_send, user, query)
+    except HTTPError as e:
+        await send_json(send, {'error': e.message}, e.status)
+    except Exception as e:
+        print(f"Async request error on {scope['path']}: {str(e)}")
+        if started:
+            # Mid-stream: headers are out, so let the server abort the response
+            raise
+        await send_json(send, {'error': str(e)}, 500)
@@ -1,18 +1,53 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response, stream_with_context
 from flask_cors import CORS
 import jwt
 import os
 from datetime import datetime, timedelta
 from functools import wraps
 import database as db
+from jsonprovider import JSONProvider
 
 app = Flask(__name__)
+app.json = JSONProvider(app)
 CORS(app, origins=['*'], methods=['GET', 'POST', 'PUT', 'DELETE', 'OPTIONS'], allow_headers=['*'])
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'your-secret-key-change-in-production')
 
 # Initialize database
 db.init_db()
 
+STREAM_CHUNK_ROWS = 500
+
+def json_array_chunks(rows):
+    """Encode rows as one JSON array, yielded a few hundred rows at a time"""
+    yield '['
+    batch, first = [], True
+    for row in rows:
+        batch.append(app.json.dumps(row))
+        if len(batch) >= STREAM_CHUNK_ROWS:
+            yield ('' if first else ',') + ','.join(batch)
+            batch, first = [], False
+    if batch:
+        yield ('' if first else ',') + ','.join(batch)
+    yield ']'
+
+def page_args():
+    """(after_id, since, limit) from ?afterId=&since=&limit=; ValueError if invalid"""
+    after_id = request.args.get('afterId', type=int)
+    limit = request.args.get('limit', type=int)
+    since = request.args.get('since') or None
+    if limit is not None and limit < 1:
+        raise ValueError('limit must be positive')
+    if since:
+        try:
+            datetime.fromisoformat(since)
+        except ValueError:
+            raise ValueError('Invalid since timestamp')
+    return after_id, since, limit
+
+def stream_json(rows):
+    # Validation happens before this point: once streaming starts the status is 200
+    return Response(stream_with_context(json_array_chunks(rows)), mimetype='application/json')
+
 def token_required(f):
     @wraps(f)
     def decorated(*args, **kwargs):
@@ -38,7 +73,7 @@ def home():
 
 @app.route('/api/health')
 def health():
-    return jsonify({'status': 'ok'})
+    return jsonify({'status': 'ok', 'dbPool': db.pool_stats()})
 
 @app.route('/api/auth/signup', methods=['POST'])
 def signup():
@@ -62,15 +97,14 @@ def signup():
     role = 'admin' if plan == 'ultra' else 'cashier'
     
     # Create user
-    user_id = db.create_user(email, password, name, role, plan, account_id)
+    user = db.create_user(email, password, name, role, plan, account_id)
     
     # Log activity
-    db.create_activity('signup', user_id, email, name, plan)
+    db.create_activity('signup', user['id'], email, name, plan)
     
-    token = jwt.encode({'id': user_id, 'email': email, 'role': role, 'accountId': account_id}, 
+    token = jwt.encode({'id': user['id'], 'email': email, 'role': role, 'accountId': account_id}, 
                       app.config['SECRET_KEY'], algorithm='HS256')
     
-    user = db.get_user_by_id(user_id)
     return jsonify({
         'token': token,
         'user': {k: v for k, v in user.items() if k != 'password'}
@@ -121,7 +155,7 @@ def handle_products():
     data = request.get_json()
     account_id = request.user.get('accountId')
     
-    product_id = db.create_product(
+    product = db.create_product(
         account_id=account_id,
         name=data.get('name', ''),
         price=float(data.get('price', 0)),
@@ -134,25 +168,20 @@ def handle_products():
         is_composite=bool(data.get('recipe', [])),
         created_by=request.user.get('id')
     )
-    
-    # Return created product
-    products = db.get_products_by_account(account_id)
-    product = next((p for p in products if p['id'] == product_id), None)
     return jsonify(product)
 
 @app.route('/api/products/<int:product_id>', methods=['PUT', 'DELETE'])
 @token_required
 def handle_product(product_id):
     account_id = request.user.get('accountId')
-    products = db.get_products_by_account(account_id)
-    product = next((p for p in products if p['id'] == product_id), None)
+    product = db.get_product(account_id, product_id)
     
     if not product:
         return jsonify({'error': 'Product not found'}), 404
     
     if request.method == 'PUT':
         data = request.get_json()
-        db.update_product(
+        updated_product = db.update_product(
             product_id,
             name=data.get('name', product['name']),
             price=float(data.get('price', product['price'])),
@@ -160,10 +189,6 @@ def handle_product(product_id):
             image=data.get('image', product.get('image', '')),
             category=data.get('category', product.get('category', 'general'))
         )
-        
-        # Return updated product
-        products = db.get_products_by_account(account_id)
-        updated_product = next((p for p in products if p['id'] == product_id), None)
         return jsonify(updated_product)
     
     if request.method == 'DELETE':
@@ -176,32 +201,23 @@ def handle_sales():
     account_id = request.user.get('accountId')
     
     if request.method == 'GET':
-        sales = db.get_sales_by_account(account_id)
-        return jsonify(sales)
+        try:
+            after_id, since, limit = page_args()
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        return stream_json(db.iter_sales(account_id, after_id=after_id, since=since, limit=limit))
     
     data = request.get_json()
     
-    # Process stock deduction
-    products = db.get_products_by_account(account_id)
-    for item in data.get('items', []):
-        product = next((p for p in products if p['id'] == item['productId']), None)
-        if product:
-            new_quantity = max(0, product['quantity'] - item['quantity'])
-            db.update_product(product['id'], quantity=new_quantity)
-    
-    # Create sale
+    # Insert the sale and deduct its stock in one transaction
     user = db.get_user_by_id(request.user['id'])
-    sale_id = db.create_sale(
+    sale = db.record_sale(
         account_id=account_id,
         items=data.get('items', []),
         total=float(data.get('total', 0)),
         cashier_id=request.user['id'],
         cashier_name=user['name'] if user else 'Unknown'
     )
-    
-    # Return created sale
-    sales = db.get_sales_by_account(account_id)
-    sale = next((s for s in sales if s['id'] == sale_id), None)
     return jsonify(sale)
 
 @app.route('/api/expenses', methods=['GET', 'POST'])
@@ -214,10 +230,9 @@ def handle_expenses():
 @token_required
 def stats():
     account_id = request.user.get('accountId')
-    sales = db.get_sales_by_account(account_id)
     products = db.get_products_by_account(account_id)
     
-    total_sales = sum(s.get('total', 0) for s in sales)
+    total_sales = db.sales_total(account_id)
     
     return jsonify({
         'totalSales': total_sales,
@@ -226,6 +241,54 @@ def stats():
         'productCount': len(products)
     })
 
+def report_range(default_days=30):
+    """(start, end) datetimes from ?from=&to=; bare dates and defaults cover whole days"""
+    to_arg = request.args.get('to', '')
+    end = datetime.fromisoformat(to_arg) if to_arg else datetime.now()
+    if len(to_arg) in (0, 10):
+        end = datetime.combine(end.date(), datetime.max.time())
+    if request.args.get('from'):
+        start = datetime.fromisoformat(request.args['from'])
+    else:
+        start = datetime.combine(end.date() - timedelta(days=default_days), datetime.min.time())
+    return start, end
+
+@app.route('/api/reports/top-products')
+@token_required
+def reports_top_products():
+    """Best sellers in a date range: ?from=&to=&limit=10&metric=revenue|quantity"""
+    metric = request.args.get('metric', 'revenue')
+    if metric not in db.REPORT_METRICS:
+        return jsonify({'error': f'metric must be one of {", ".join(db.REPORT_METRICS)}'}), 400
+    try:
+        start, end = report_range()
+    except ValueError:
+        return jsonify({'error': 'from/to must be ISO dates'}), 400
+    limit = max(1, min(request.args.get('limit', 10, type=int), 500))
+    
+    return jsonify({
+        'from': start.isoformat(),
+        'to': end.isoformat(),
+        'metric': metric,
+        'products': db.top_products(request.user.get('accountId'), start, end, limit, metric)
+    })
+
+@app.route('/api/reports/products')
+@token_required
+def reports_products():
+    """Quantity and revenue of every product sold in a date range: ?from=&to=&productId="""
+    try:
+        start, end = report_range()
+    except ValueError:
+        return jsonify({'error': 'from/to must be ISO dates'}), 400
+    
+    return jsonify({
+        'from': start.isoformat(),
+        'to': end.isoformat(),
+        'products': db.product_sales(request.user.get('accountId'), start, end,
+                                     product_id=request.args.get('productId', type=int))
+    })
+
 @app.route('/api/users', methods=['GET', 'POST'])
 @token_required
 def handle_users():
@@ -240,7 +303,7 @@ def handle_users():
         return jsonify({'error': 'Ultra admin required'}), 403
     
     data = request.get_json()
-    user_id = db.create_user(
+    user = db.create_user(
         email=data.get('email', '').lower(),
         password=data.get('password', 'changeme123'),
         name=data.get('name', ''),
@@ -252,9 +315,8 @@ def handle_users():
     )
     
     # Log activity
-    db.create_activity('user_created', user_id, data.get('email', ''), data.get('name', ''), 'ultra', current_user['id'])
+    db.create_activity('user_created', user['id'], data.get('email', ''), data.get('name', ''), 'ultra', current_user['id'])
     
-    user = db.get_user_by_id(user_id)
     return jsonify({k: v for k, v in user.items() if k != 'password'})
 
 @app.route('/api/reminders', methods=['GET', 'POST'])
@@ -297,8 +359,11 @@ def main_admin_users():
 def main_admin_activities():
     if request.user.get('type') != 'main_admin':
         return jsonify({'error': 'Access denied'}), 403
-    activities = db.get_all_activities()
-    return jsonify(activities)
+    try:
+        after_id, since, limit = page_args()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return stream_json(db.iter_activities(after_id=after_id, since=since, limit=limit))
 
 @app.route('/api/main-admin/stats')
 @token_required
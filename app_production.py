@@ -7,11 +7,14 @@ from datetime import datetime, timedelta
 from functools import wraps
 import logging
 
+from jsonprovider import JSONProvider
+
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
+app.json = JSONProvider(app)
 
 # Complete CORS fix
 CORS(app, origins=['*'], methods=['*'], allow_headers=['*'])
@@ -112,10 +115,9 @@ def signup():
         trial_ends_at = (datetime.now() + timedelta(days=30)).isoformat()
         account_id = db.create_account(email, plan, trial_ends_at)
         role = 'admin' if plan == 'ultra' else 'cashier'
-        user_id = db.create_user(email, password, name, role, plan, account_id)
-        db.create_activity('signup', user_id, email, name, plan)
+        user = db.create_user(email, password, name, role, plan, account_id)
+        db.create_activity('signup', user['id'], email, name, plan)
         
-        user = db.get_user_by_id(user_id)
         user_data = {k: v for k, v in user.items() if k != 'password'}
     else:
         # File-based implementation
@@ -207,7 +209,7 @@ def handle_products():
     data = request.get_json()
     
     if USE_DATABASE:
-        product_id = db.create_product(
+        product = db.create_product(
             account_id=account_id,
             name=data.get('name', ''),
             price=float(data.get('price', 0)),
@@ -220,8 +222,6 @@ def handle_products():
             is_composite=bool(data.get('recipe', [])),
             created_by=request.user.get('id')
         )
-        products = db.get_products_by_account(account_id)
-        product = next((p for p in products if p['id'] == product_id), None)
     else:
         products = load_data(PRODUCTS_FILE)
         product = {
@@ -254,16 +254,15 @@ def handle_sales():
     data = request.get_json()
     
     if USE_DATABASE:
+        # Insert the sale and deduct its stock in one transaction
         user = db.get_user_by_id(request.user['id'])
-        sale_id = db.create_sale(
+        sale = db.record_sale(
             account_id=account_id,
             items=data.get('items', []),
             total=float(data.get('total', 0)),
             cashier_id=request.user['id'],
             cashier_name=user['name'] if user else 'Unknown'
         )
-        sales = db.get_sales_by_account(account_id)
-        sale = next((s for s in sales if s['id'] == sale_id), None)
     else:
         sales = load_data(SALES_FILE)
         sale = {
@@ -0,0 +1,114 @@
+"""First-expired-first-out batch consumption over batches.json.
+
+Open batches (remaining > 0) are kept in a heap per product keyed by
+expiryDate, plus one expiry-sorted list across all products, so a sale
+draws from the head of its product's heap and "expiring soon" is a bisect
+instead of a scan. Both are rebuilt only when batches.json changes.
+Writes hold a file lock shared by all workers from refresh to save.
+"""
+import heapq
+from bisect import bisect_left, bisect_right
+
+from filestore import FileLock, file_version
+
+NO_EXPIRY = '9999-12-31'
+
+
+def remaining(batch):
+    return float(batch.get('remaining', batch.get('quantity', 0)) or 0)
+
+
+class BatchIndex:
+    def __init__(self, batches_file, load, save):
+        self.batches_file = batches_file
+        self.load = load
+        self.save = save
+        self._lock = FileLock(batches_file + '.lock')
+        self._version = object()
+        self._batches = []
+        self._heaps = {}
+        self._by_expiry = []
+
+    def _refresh(self):
+        version = file_version(self.batches_file)
+        if version == self._version:
+            return
+        batches = self.load(self.batches_file)
+        heaps = {}
+        by_expiry = []
+        for index, batch in enumerate(batches):
+            if remaining(batch) <= 0:
+                continue
+            expiry = batch.get('expiryDate') or NO_EXPIRY
+            heaps.setdefault(batch['productId'], []).append((expiry, batch.get('createdAt', ''), index))
+            if batch.get('expiryDate'):
+                by_expiry.append((expiry, batch['id'], index))
+        for heap in heaps.values():
+            heapq.heapify(heap)
+        by_expiry.sort()
+        self._batches, self._heaps, self._by_expiry = batches, heaps, by_expiry
+        self._version = version
+
+    def add(self, batch):
+        """Append a new batch, numbered after the existing ones; returns it with its id."""
+        with self._lock:
+            batches = self.load(self.batches_file)
+            batch = dict(id=max([b.get('id', 0) for b in batches], default=0) + 1, **batch)
+            batches.append(batch)
+            self.save(self.batches_file, batches)
+        return batch
+
+    def consume(self, draws):
+        """Draw down batches FEFO for each (productId, amount) in `draws`.
+
+        Returns one allocation list per draw: [{batchId, batchNumber, quantity,
+        cost}]. Stock that was never received through a batch is simply left
+        unallocated. batches.json is saved once for the whole call.
+        """
+        allocations = []
+        with self._lock:
+            self._refresh()
+            changed = False
+            for product_id, amount in draws:
+                heap = self._heaps.get(product_id, [])
+                taken = []
+                while amount > 1e-9 and heap:
+                    expiry, _, index = heap[0]
+                    batch = self._batches[index]
+                    quantity = min(remaining(batch), amount)
+                    batch['remaining'] = round(remaining(batch) - quantity, 6)
+                    amount -= quantity
+                    changed = True
+                    taken.append({
+                        'batchId': batch['id'],
+                        'batchNumber': batch.get('batchNumber'),
+                        'expiryDate': batch.get('expiryDate'),
+                        'quantity': quantity,
+                        'cost': round(quantity * float(batch.get('cost', 0) or 0), 2)
+                    })
+                    if batch['remaining'] <= 0:
+                        heapq.heappop(heap)
+                        self._discard_expiry(expiry, batch['id'], index)
+                allocations.append(taken)
+            if changed:
+                self.save(self.batches_file, self._batches)
+                self._version = file_version(self.batches_file)
+        return allocations
+
+    def _discard_expiry(self, expiry, batch_id, index):
+        key = (expiry, batch_id, index)
+        position = bisect_left(self._by_expiry, key)
+        if position < len(self._by_expiry) and self._by_expiry[position] == key:
+            del self._by_expiry[position]
+
+    def expiring_before(self, cutoff, product_ids=None):
+        """Open batches whose expiryDate is <= cutoff (ISO timestamp), soonest first."""
+        with self._lock:
+            self._refresh()
+            end = bisect_right(self._by_expiry, (cutoff, float('inf'), 0))
+            result = []
+            for _, _, index in self._by_expiry[:end]:
+                batch = self._batches[index]
+                if product_ids is None or batch['productId'] in product_ids:
+                    result.append(dict(batch, remaining=remaining(batch)))
+            return result
@@ -0,0 +1,115 @@
+"""Password hashing with scrypt, run on a bounded worker pool.
+
+Hashes are stored as "scrypt$n$r$p$salt$hash" (base64 salt and hash).
+hashlib.scrypt releases the GIL, so a small thread pool bounds how many
+logins burn CPU at once. A queue limit rejects the overflow with
+CredentialsBusy (served as 503) instead of letting a shift-change stampede
+pile up behind it. Legacy plaintext passwords still verify; callers are
+told to rehash them.
+"""
+import base64
+import hashlib
+import hmac
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+SCRYPT_N = int(os.environ.get('SCRYPT_N', 2 ** 14))
+SCRYPT_R = int(os.environ.get('SCRYPT_R', 8))
+SCRYPT_P = int(os.environ.get('SCRYPT_P', 1))
+HASH_WORKERS = int(os.environ.get('HASH_WORKERS', 2))
+HASH_QUEUE_LIMIT = int(os.environ.get('HASH_QUEUE_LIMIT', 32))
+HASH_TIMEOUT_SECONDS = 10
+PREFIX = 'scrypt$'
+
+
+class CredentialsBusy(Exception):
+    """Too many hash/verify jobs already queued."""
+
+
+def _scrypt(password, salt, n, r, p):
+    return hashlib.scrypt(password.encode(), salt=salt, n=n, r=r, p=p,
+                          maxmem=256 * r * (n + p + 2), dklen=32)
+
+
+def hash_password(password, n=SCRYPT_N, r=SCRYPT_R, p=SCRYPT_P):
+    salt = os.urandom(16)
+    digest = _scrypt(password, salt, n, r, p)
+    return f"{PREFIX}{n}${r}${p}${base64.b64encode(salt).decode()}${base64.b64encode(digest).decode()}"
+
+
+def is_hashed(stored):
+    return isinstance(stored, str) and stored.startswith(PREFIX)
+
+
+def verify_password(password, stored, n=SCRYPT_N, r=SCRYPT_R, p=SCRYPT_P):
+    """(matches, needs_rehash); plaintext or weaker-cost hashes need a rehash."""
+    if not is_hashed(stored):
+        matches = stored is not None and hmac.compare_digest(str(stored).encode(), str(password).encode())
+        return matches, matches
+    try:
+        _, cost, block, parallel, salt, digest = stored.split('$')
+        cost, block, parallel = int(cost), int(block), int(parallel)
+        expected = base64.b64decode(digest)
+        actual = _scrypt(password, base64.b64decode(salt), cost, block, parallel)
+    except (ValueError, TypeError):
+        return False, False
+    matches = hmac.compare_digest(actual, expected)
+    return matches, matches and (cost, block, parallel) != (n, r, p)
+
+
+class CredentialService:
+    def __init__(self, workers=HASH_WORKERS, queue_limit=HASH_QUEUE_LIMIT):
+        self.workers = workers
+        self.queue_limit = queue_limit
+        self._slots = threading.BoundedSemaphore(workers + queue_limit)
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pid = None
+        self._counters = {'hashed': 0, 'verified': 0, 'rejected': 0, 'busyMs': 0.0}
+        # Verifying an unknown email against this keeps timing the same as a wrong password
+        self._dummy = None
+
+    def _pool(self):
+        # A pool created before gunicorn's fork has no threads in the worker
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='credentials')
+                    self._pid = os.getpid()
+        return self._executor
+
+    def _run(self, counter, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self._counters['rejected'] += 1
+            raise CredentialsBusy()
+        try:
+            started = time.perf_counter()
+            result = self._pool().submit(fn, *args).result(timeout=HASH_TIMEOUT_SECONDS)
+            with self._lock:
+                self._counters[counter] += 1
+                self._counters['busyMs'] += (time.perf_counter() - started) * 1000
+            return result
+        finally:
+            self._slots.release()
+
+    def hash(self, password):
+        return self._run('hashed', hash_password, password)
+
+    def verify(self, password, stored):
+        """(matches, needs_rehash); stored=None still costs one scrypt run."""
+        if stored is None:
+            if self._dummy is None:
+                self._dummy = hash_password(os.urandom(8).hex())
+            self._run('verified', verify_password, password, self._dummy)
+            return False, False
+        return self._run('verified', verify_password, password, stored)
+
+    def stats(self):
+        with self._lock:
+            done = self._counters['hashed'] + self._counters['verified']
+            return dict(self._counters, workers=self.workers, queueLimit=self.queue_limit,
+                        avgMs=round(self._counters['busyMs'] / done, 1) if done else None,
+                        cost={'n': SCRYPT_N, 'r': SCRYPT_R, 'p': SCRYPT_P})
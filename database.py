@@ -1,13 +1,29 @@
-import psycopg
 from psycopg.rows import dict_row
+from psycopg_pool import ConnectionPool
 import json
 import os
 import logging
+import threading
 from datetime import datetime
-from urllib.parse import urlparse
+
+import migrations
+from salelines import line_quantity, line_revenue
 
 logger = logging.getLogger(__name__)
 
+# Connection pool sizing; one pool per process
+POOL_MIN_SIZE = int(os.environ.get('DB_POOL_MIN', 1))
+POOL_MAX_SIZE = int(os.environ.get('DB_POOL_MAX', 10))
+POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', 10))
+POOL_MAX_IDLE = float(os.environ.get('DB_POOL_MAX_IDLE', 300))
+POOL_MAX_LIFETIME = float(os.environ.get('DB_POOL_MAX_LIFETIME', 3600))
+# Rows per round trip when streaming through a server-side cursor
+STREAM_ITERSIZE = int(os.environ.get('DB_STREAM_ITERSIZE', 2000))
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
 def get_db_url():
     database_url = os.environ.get('DATABASE_URL')
     if database_url:
@@ -16,9 +32,69 @@ def get_db_url():
         return database_url
     return 'postgresql://localhost/pos_db'
 
+def get_pool():
+    """This process's connection pool, created on first use.
+
+    gunicorn forks workers after importing the app (preload_app), and a pool
+    inherited from the master shares its sockets and has no worker threads.
+    Each process therefore opens its own; an inherited one is dropped
+    without closing it so the parent's connections are left alone.
+    """
+    global _pool, _pool_pid
+    if _pool is None or _pool_pid != os.getpid():
+        with _pool_lock:
+            if _pool is None or _pool_pid != os.getpid():
+                _pool = ConnectionPool(
+                    get_db_url(),
+                    min_size=POOL_MIN_SIZE,
+                    max_size=POOL_MAX_SIZE,
+                    timeout=POOL_TIMEOUT,
+                    max_idle=POOL_MAX_IDLE,
+                    max_lifetime=POOL_MAX_LIFETIME,
+                    kwargs={'row_factory': dict_row},
+                    check=ConnectionPool.check_connection,  # Health check on checkout
+                    name=f'pos-{os.getpid()}',
+                    open=True,
+                )
+                _pool_pid = os.getpid()
+    return _pool
+
+def close_pool():
+    """Close this process's pool (gunicorn's pre_fork hook calls it in the master)."""
+    global _pool, _pool_pid
+    with _pool_lock:
+        if _pool is not None and _pool_pid == os.getpid():
+            _pool.close()
+        _pool, _pool_pid = None, None
+
+def json_value(value, default):
+    """Decode a JSON column; JSONB already arrives decoded, legacy TEXT does not"""
+    if value is None or value == '':
+        return default
+    return json.loads(value) if isinstance(value, str) else value
+
+def decode_product(row):
+    if row is None:
+        return None
+    product = dict(row)
+    product['recipe'] = json_value(product['recipe'], [])
+    return product
+
+def decode_sale(row):
+    if row is None:
+        return None
+    sale = dict(row)
+    sale['items'] = json_value(sale['items'], [])
+    return sale
+
+def pool_stats():
+    if _pool is None or _pool_pid != os.getpid():
+        return {'open': False, 'pid': os.getpid()}
+    return dict(_pool.get_stats(), open=True, pid=os.getpid())
+
 def init_db():
     try:
-        with psycopg.connect(get_db_url()) as conn:
+        with get_db() as conn:
             with conn.cursor() as cursor:
                 cursor.execute('''
                     CREATE TABLE IF NOT EXISTS accounts (
@@ -99,23 +175,22 @@ def init_db():
                     );
                 ''')
                 
-                cursor.execute('SELECT COUNT(*) FROM settings')
-                if cursor.fetchone()[0] == 0:
+                cursor.execute('SELECT COUNT(*) AS count FROM settings')
+                if cursor.fetchone()['count'] == 0:
                     cursor.execute('INSERT INTO settings (screenlockpassword, businessname) VALUES (%s, %s)', 
                                   ('2005', 'My Business'))
-            conn.commit()
+        applied = migrations.migrate(get_db_url())
+        if applied:
+            logger.info(f"Applied migrations: {applied}")
         logger.info("Database initialized successfully")
     except Exception as e:
         logger.error(f"Database initialization failed: {e}")
         raise
 
 def get_db():
-    try:
-        conn = psycopg.connect(get_db_url(), row_factory=dict_row)
-        return conn
-    except Exception as e:
-        logger.error(f"Database connection failed: {e}")
-        raise
+    """Borrow a pooled connection: `with get_db() as conn:` commits on success,
+    rolls back on error and returns the connection to the pool."""
+    return get_pool().connection()
 
 def create_account(owner_email, plan, trial_ends_at):
     try:
@@ -141,14 +216,15 @@ def get_account(account_id):
         return None
 
 def create_user(email, password, name, role, plan, account_id, pin=None, created_by=None):
+    """Insert a user and return the new row (password included)"""
     try:
         with get_db() as conn:
             with conn.cursor() as cursor:
                 cursor.execute('''
                     INSERT INTO users (email, password, name, role, plan, accountid, pin, cashierpin, createdby, createdat)
-                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s) RETURNING id
+                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s) RETURNING *
                 ''', (email, password, name, role, plan, account_id, pin, pin, created_by, datetime.now().isoformat()))
-                return cursor.fetchone()['id']
+                return cursor.fetchone()
     except Exception as e:
         logger.error(f"Failed to create user: {e}")
         raise
@@ -195,116 +271,288 @@ def get_all_users():
 
 # Product operations
 def create_product(account_id, name, price, cost, quantity, image, category, unit, recipe, is_composite, created_by):
-    conn = get_db()
-    cursor = conn.cursor()
-    cursor.execute('''
-        INSERT INTO products (accountId, name, price, cost, quantity, image, category, unit, recipe, isComposite, createdAt, createdBy)
-        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s) RETURNING id
-    ''', (account_id, name, price, cost, quantity, image, category, unit, json.dumps(recipe), is_composite, datetime.now().isoformat(), created_by))
-    product_id = cursor.fetchone()[0]
-    conn.commit()
-    conn.close()
-    return product_id
+    with get_db() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute('''
+                INSERT INTO products (accountId, name, price, cost, quantity, image, category, unit, recipe, isComposite, createdAt, createdBy)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s) RETURNING *
+            ''', (account_id, name, price, cost, quantity, image, category, unit, json.dumps(recipe), is_composite, datetime.now().isoformat(), created_by))
+            return decode_product(cursor.fetchone())
 
 def get_products_by_account(account_id):
-    conn = get_db()
-    cursor = conn.cursor()
-    cursor.execute('SELECT * FROM products WHERE accountId = %s', (account_id,))
-    rows = cursor.fetchall()
-    products = []
-    for row in rows:
-        product = dict(row)
-        product['recipe'] = json.loads(product['recipe']) if product['recipe'] else []
-        products.append(product)
-    conn.close()
-    return products
+    with get_db() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute('SELECT * FROM products WHERE accountId = %s', (account_id,))
+            rows = cursor.fetchall()
+    return [decode_product(row) for row in rows]
+
+def get_product(account_id, product_id):
+    with get_db() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute('SELECT * FROM products WHERE id = %s AND accountId = %s', (product_id, account_id))
+            return decode_product(cursor.fetchone())
 
 def update_product(product_id, **kwargs):
-    conn = get_db()
-    cursor = conn.cursor()
-    
+    """Update the given columns and return the new row (None if it is gone)"""
     set_clause = []
     values = []
     for key, value in kwargs.items():
         set_clause.append(f"{key} = %s")
         values.append(value)
     
-    if set_clause:
-        values.append(datetime.now().isoformat())
-        values.append(product_id)
-        cursor.execute(f'''
-            UPDATE products SET {", ".join(set_clause)}, updatedAt = %s
-            WHERE id = %s
-        ''', values)
-        conn.commit()
-    
-    conn.close()
+    with get_db() as conn:
+        with conn.cursor() as cursor:
+            if not set_clause:
+                cursor.execute('SELECT * FROM products WHERE id = %s', (product_id,))
+                return decode_product(cursor.fetchone())
+            values.append(datetime.now().isoformat())
+            values.append(product_id)
+            cursor.execute(f'''
+                UPDATE products SET {", ".join(set_clause)}, updatedAt = %s
+                WHERE id = %s RETURNING *
+            ''', values)
+            return decode_product(cursor.fetchone())
 
 def delete_product(product_id):
-    conn = get_db()
-    cursor = conn.cursor()
-    cursor.execute('DELETE FROM products WHERE id = %s', (product_id,))
-    conn.commit()
-    conn.close()
+    with get_db() as conn:
+        conn.execute('DELETE FROM products WHERE id = %s', (product_id,))
 
 # Sales operations
+def item_rows(items):
+    """(product_ids, quantities, unit_prices), one entry per line, for sale_items.
+
+    Lines are read with salelines, as reports.py reads them; the unit price
+    already reflects lineTotal when the pricing engine set one.
+    """
+    product_ids, quantities, unit_prices = [], [], []
+    for item in items:
+        product_id = item.get('productId')
+        quantity = line_quantity(item)
+        product_ids.append(int(product_id) if str(product_id).isdigit() else None)
+        quantities.append(quantity)
+        unit_prices.append(line_revenue(item) / quantity if quantity else float(item.get('price', 0) or 0))
+    return product_ids, quantities, unit_prices
+
+# Writes the sale's lines; used as a CTE after `sale AS (INSERT ... RETURNING *)`
+SALE_ITEMS_CTE = '''
+    items_written AS (
+        INSERT INTO sale_items (sale_id, account_id, product_id, qty, unit_price, created_at)
+        SELECT sale.id, sale.accountId, i.product_id, i.qty, i.unit_price, sale.createdAt
+        FROM sale, unnest(%(item_products)s::int[], %(item_quantities)s::float8[], %(item_prices)s::float8[])
+            AS i(product_id, qty, unit_price)
+    )'''
+
+CREATE_SALE_SQL = '''
+    WITH sale AS (
+        INSERT INTO sales (accountId, items, total, cashierId, cashierName, createdAt)
+        VALUES (%(account_id)s, %(items)s, %(total)s, %(cashier_id)s, %(cashier_name)s, %(now)s)
+        RETURNING *
+    ),''' + SALE_ITEMS_CTE + '''
+    SELECT * FROM sale
+'''
+
+def sale_params(account_id, items, total, cashier_id, cashier_name):
+    item_products, item_quantities, item_prices = item_rows(items)
+    return {'account_id': account_id, 'items': json.dumps(items), 'total': total, 'cashier_id': cashier_id,
+            'cashier_name': cashier_name, 'now': datetime.now().isoformat(), 'item_products': item_products,
+            'item_quantities': item_quantities, 'item_prices': item_prices}
+
 def create_sale(account_id, items, total, cashier_id, cashier_name):
-    conn = get_db()
-    cursor = conn.cursor()
-    cursor.execute('''
+    """Insert a sale and its sale_items lines (no stock change; see record_sale)"""
+    with get_db() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(CREATE_SALE_SQL, sale_params(account_id, items, total, cashier_id, cashier_name))
+            return decode_sale(cursor.fetchone())
+
+def sale_lines(items):
+    """Collapse sale items into (product_ids, quantities), one entry per product.
+
+    A weighed line takes its weight out of stock, as line_quantity reads it.
+    """
+    quantities = {}
+    for item in items:
+        product_id = item.get('productId')
+        if product_id is None:
+            continue
+        quantities[int(product_id)] = quantities.get(int(product_id), 0) + line_quantity(item)
+    product_ids = sorted(quantities)
+    return product_ids, [quantities[pid] for pid in product_ids]
+
+# One statement per sale; see record_sale
+RECORD_SALE_SQL = '''
+    WITH lines AS (
+        SELECT product_id, qty FROM unnest(%(product_ids)s::int[], %(quantities)s::float8[]) AS l(product_id, qty)
+    ), locked AS MATERIALIZED (
+        SELECT p.id FROM products p JOIN lines l ON l.product_id = p.id
+        WHERE p.accountId = %(account_id)s
+        ORDER BY p.id
+        FOR UPDATE OF p
+    ), stock AS (
+        UPDATE products p
+        SET quantity = GREATEST(0, p.quantity - l.qty), updatedAt = %(now)s
+        FROM locked k JOIN lines l ON l.product_id = k.id
+        WHERE p.id = k.id
+        RETURNING p.id, p.quantity
+    ), sale AS (
         INSERT INTO sales (accountId, items, total, cashierId, cashierName, createdAt)
-        VALUES (%s, %s, %s, %s, %s, %s) RETURNING id
-    ''', (account_id, json.dumps(items), total, cashier_id, cashier_name, datetime.now().isoformat()))
-    sale_id = cursor.fetchone()[0]
-    conn.commit()
-    conn.close()
-    return sale_id
+        VALUES (%(account_id)s, %(items)s, %(total)s, %(cashier_id)s, %(cashier_name)s, %(now)s)
+        RETURNING *
+    ),''' + SALE_ITEMS_CTE + '''
+    SELECT sale.*,
+           (SELECT COALESCE(json_agg(json_build_object('id', id, 'quantity', quantity) ORDER BY id), '[]')
+            FROM stock) AS stock
+    FROM sale
+'''
+
+def record_sale_params(account_id, items, total, cashier_id, cashier_name):
+    product_ids, quantities = sale_lines(items)
+    return dict(sale_params(account_id, items, total, cashier_id, cashier_name),
+                product_ids=product_ids, quantities=quantities)
+
+def record_sale(account_id, items, total, cashier_id, cashier_name):
+    """Insert a sale and take its items out of stock in one statement.
+
+    One round trip whatever the number of lines: the lines are unnested
+    from two arrays, the account's product rows are locked in id order (so
+    concurrent sales cannot deadlock), quantities are decremented (never
+    below zero) and the sale row and its sale_items lines are inserted, all
+    in one transaction.
+    Products from other accounts are left untouched. Returns the sale with
+    its items decoded plus 'stock': the new [{id, quantity}] of each product.
+    """
+    params = record_sale_params(account_id, items, total, cashier_id, cashier_name)
+    with get_db() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(RECORD_SALE_SQL, params)
+            return decode_sale(cursor.fetchone())
+
+def stream_rows(name, query, params):
+    """Yield rows from a named (server-side) cursor, STREAM_ITERSIZE at a time.
+
+    Only one batch is held in memory however many rows match. The pooled
+    connection stays checked out until the generator is exhausted or closed.
+    """
+    with get_db() as conn:
+        with conn.cursor(name=name) as cursor:
+            cursor.itersize = STREAM_ITERSIZE
+            cursor.execute(query, params)
+            for row in cursor:
+                yield row
+
+def sales_query(account_id, after_id=None, since=None, limit=None):
+    """(query, params) for a keyset page of an account's sales in id order"""
+    query = 'SELECT * FROM sales WHERE accountId = %s'
+    params = [account_id]
+    if after_id is not None:
+        query += ' AND id > %s'
+        params.append(after_id)
+    if since is not None:
+        query += ' AND createdAt >= %s'
+        params.append(since)
+    query += ' ORDER BY id LIMIT %s'
+    params.append(limit)
+    return query, params
+
+def iter_sales(account_id, after_id=None, since=None, limit=None):
+    """Stream an account's sales in id order, items decoded.
+
+    Keyset pagination: pass the last id of the previous page as after_id.
+    since keeps sales created at or after that timestamp.
+    """
+    query, params = sales_query(account_id, after_id, since, limit)
+    for row in stream_rows('sales_stream', query, params):
+        yield decode_sale(row)
 
 def get_sales_by_account(account_id):
-    conn = get_db()
-    cursor = conn.cursor()
-    cursor.execute('SELECT * FROM sales WHERE accountId = %s', (account_id,))
-    rows = cursor.fetchall()
-    sales = []
-    for row in rows:
-        sale = dict(row)
-        sale['items'] = json.loads(sale['items']) if sale['items'] else []
-        sales.append(sale)
-    conn.close()
-    return sales
+    return list(iter_sales(account_id))
+
+SALES_TOTAL_SQL = 'SELECT COALESCE(sum(total), 0) AS total FROM sales WHERE accountId = %s'
+
+def sales_total(account_id):
+    """Sum of an account's sale totals, added up by Postgres"""
+    with get_db() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(SALES_TOTAL_SQL, (account_id,))
+            return cursor.fetchone()['total']
+
+# Sales reports: SQL aggregates over sale_items (same figures as reports.py)
+REPORT_METRICS = ('revenue', 'quantity')
+
+def product_sales_query(account_id, start, end, metric='revenue', limit=None, product_id=None):
+    """(query, params) for per-product totals in [start, end], best first by metric"""
+    if metric not in REPORT_METRICS:
+        raise ValueError(f'metric must be one of {", ".join(REPORT_METRICS)}')
+    query = '''
+        SELECT i.product_id AS "productId", p.name, COALESCE(p.category, 'general') AS category,
+               round(sum(i.qty)::numeric, 3)::float8 AS quantity,
+               round(sum(i.qty * i.unit_price)::numeric, 2)::float8 AS revenue,
+               count(*) AS "salesCount"
+        FROM sale_items i
+        LEFT JOIN products p ON p.id = i.product_id
+        WHERE i.account_id = %s AND i.created_at BETWEEN %s AND %s
+    '''
+    params = [account_id, start, end]
+    if product_id is not None:
+        query += ' AND i.product_id = %s'
+        params.append(product_id)
+    query += f' GROUP BY i.product_id, p.id ORDER BY {metric} DESC, i.product_id LIMIT %s'
+    params.append(limit)
+    return query, params
+
+def product_sales(account_id, start, end, metric='revenue', limit=None, product_id=None):
+    """[{productId, name, category, quantity, revenue, salesCount}] per product sold"""
+    query, params = product_sales_query(account_id, start, end, metric, limit, product_id)
+    with get_db() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(query, params)
+            return cursor.fetchall()
+
+def top_products(account_id, start, end, limit=10, metric='revenue'):
+    return product_sales(account_id, start, end, metric, limit)
 
 # Activity operations
 def create_activity(activity_type, user_id, email, name, plan, created_by=None):
-    conn = get_db()
-    cursor = conn.cursor()
-    cursor.execute('''
-        INSERT INTO activities (type, userId, email, name, plan, createdBy, timestamp)
-        VALUES (%s, %s, %s, %s, %s, %s, %s)
-    ''', (activity_type, user_id, email, name, plan, created_by, datetime.now().isoformat()))
-    conn.commit()
-    conn.close()
+    with get_db() as conn:
+        conn.execute('''
+            INSERT INTO activities (type, userId, email, name, plan, createdBy, timestamp)
+            VALUES (%s, %s, %s, %s, %s, %s, %s)
+        ''', (activity_type, user_id, email, name, plan, created_by, datetime.now().isoformat()))
+
+def activities_query(after_id=None, since=None, limit=None):
+    """(query, params) for a keyset page of activities, newest id first"""
+    query = 'SELECT * FROM activities WHERE TRUE'
+    params = []
+    if after_id is not None:
+        query += ' AND id < %s'
+        params.append(after_id)
+    if since is not None:
+        query += ' AND timestamp >= %s'
+        params.append(since)
+    query += ' ORDER BY id DESC LIMIT %s'
+    params.append(limit)
+    return query, params
+
+def iter_activities(after_id=None, since=None, limit=None):
+    """Stream activities newest first (by id).
+
+    Keyset pagination: pass the last id of the previous page as after_id to
+    continue with older ones. since keeps activities at or after that time.
+    """
+    query, params = activities_query(after_id, since, limit)
+    return stream_rows('activities_stream', query, params)
 
 def get_all_activities():
-    conn = get_db()
-    cursor = conn.cursor()
-    cursor.execute('SELECT * FROM activities ORDER BY timestamp DESC')
-    result = list_from_rows(cursor.fetchall())
-    conn.close()
-    return result
+    return list(iter_activities())
 
 # Settings operations
 def get_settings():
-    conn = get_db()
-    cursor = conn.cursor()
-    cursor.execute('SELECT * FROM settings LIMIT 1')
-    result = dict_from_row(cursor.fetchone())
-    conn.close()
+    with get_db() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute('SELECT * FROM settings LIMIT 1')
+            result = cursor.fetchone()
     return result or {'screenLockPassword': '2005', 'businessName': 'My Business'}
 
 def update_settings(**kwargs):
-    conn = get_db()
-    cursor = conn.cursor()
-    
     set_clause = []
     values = []
     for key, value in kwargs.items():
@@ -312,7 +560,5 @@ def update_settings(**kwargs):
         values.append(value)
     
     if set_clause:
-        cursor.execute(f'UPDATE settings SET {", ".join(set_clause)} WHERE id = 1', values)
-        conn.commit()
-    
-    conn.close()
\ No newline at end of file
+        with get_db() as conn:
+            conn.execute(f'UPDATE settings SET {", ".join(set_clause)} WHERE id = 1', values)
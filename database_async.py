@@ -0,0 +1,242 @@
+"""asyncio twin of database.py, on psycopg's AsyncConnectionPool.
+
+Same functions, same arguments, same rows; each one is a coroutine
+(iter_sales and iter_activities are async generators). SQL shared with the
+blocking module (record_sale, keyset queries) and the row decoding are
+imported from database.py so the two cannot drift. Used by app_async.py.
+"""
+import asyncio
+import json
+import logging
+import os
+from contextlib import asynccontextmanager
+from datetime import datetime
+
+from psycopg.rows import dict_row
+from psycopg_pool import AsyncConnectionPool
+
+import database
+from database import (
+    CREATE_SALE_SQL, POOL_MAX_IDLE, POOL_MAX_LIFETIME, POOL_MAX_SIZE, POOL_MIN_SIZE, POOL_TIMEOUT,
+    RECORD_SALE_SQL, SALES_TOTAL_SQL, STREAM_ITERSIZE, activities_query, decode_product, decode_sale,
+    get_db_url, product_sales_query, record_sale_params, sale_params, sales_query,
+)
+
+logger = logging.getLogger(__name__)
+
+_pool = None
+_pool_pid = None
+_pool_lock = None
+
+
+async def get_pool():
+    """This process's pool, opened on first use inside the running event loop."""
+    global _pool, _pool_pid, _pool_lock
+    if _pool is not None and _pool_pid == os.getpid():
+        return _pool
+    if _pool_lock is None or _pool_pid != os.getpid():
+        # Created here so it belongs to the serving loop, not the importing one
+        _pool_lock = asyncio.Lock()
+        _pool_pid = os.getpid()
+        _pool = None
+    async with _pool_lock:
+        if _pool is None:
+            pool = AsyncConnectionPool(
+                get_db_url(),
+                min_size=POOL_MIN_SIZE,
+                max_size=POOL_MAX_SIZE,
+                timeout=POOL_TIMEOUT,
+                max_idle=POOL_MAX_IDLE,
+                max_lifetime=POOL_MAX_LIFETIME,
+                kwargs={'row_factory': dict_row},
+                check=AsyncConnectionPool.check_connection,
+                name=f'pos-async-{os.getpid()}',
+                open=False,
+            )
+            await pool.open()
+            _pool = pool
+    return _pool
+
+
+async def close_pool():
+    global _pool, _pool_pid, _pool_lock
+    if _pool is not None and _pool_pid == os.getpid():
+        await _pool.close()
+    _pool, _pool_pid, _pool_lock = None, None, None
+
+
+def pool_stats():
+    if _pool is None or _pool_pid != os.getpid():
+        return {'open': False, 'pid': os.getpid()}
+    return dict(_pool.get_stats(), open=True, pid=os.getpid())
+
+
+async def init_db():
+    """Create tables and apply migrations (blocking code, run off the loop)."""
+    await asyncio.to_thread(database.init_db)
+    await asyncio.to_thread(database.close_pool)
+
+
+@asynccontextmanager
+async def get_db():
+    """`async with get_db() as conn:` commits on success, rolls back on error."""
+    pool = await get_pool()
+    async with pool.connection() as conn:
+        yield conn
+
+
+async def fetch_one(query, params=()):
+    async with get_db() as conn:
+        cursor = await conn.execute(query, params)
+        return await cursor.fetchone()
+
+
+async def fetch_all(query, params=()):
+    async with get_db() as conn:
+        cursor = await conn.execute(query, params)
+        return await cursor.fetchall()
+
+
+async def create_account(owner_email, plan, trial_ends_at):
+    row = await fetch_one('''
+        INSERT INTO accounts (owneremail, plan, trialendsat, createdat)
+        VALUES (%s, %s, %s, %s) RETURNING id
+    ''', (owner_email, plan, trial_ends_at, datetime.now().isoformat()))
+    return row['id']
+
+
+async def get_account(account_id):
+    return await fetch_one('SELECT * FROM accounts WHERE id = %s', (account_id,))
+
+
+async def create_user(email, password, name, role, plan, account_id, pin=None, created_by=None):
+    """Insert a user and return the new row (password included)"""
+    return await fetch_one('''
+        INSERT INTO users (email, password, name, role, plan, accountid, pin, cashierpin, createdby, createdat)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s) RETURNING *
+    ''', (email, password, name, role, plan, account_id, pin, pin, created_by, datetime.now().isoformat()))
+
+
+async def get_user_by_email(email):
+    return await fetch_one('SELECT * FROM users WHERE email = %s', (email,))
+
+
+async def get_user_by_id(user_id):
+    return await fetch_one('SELECT * FROM users WHERE id = %s', (user_id,))
+
+
+async def get_users_by_account(account_id):
+    return await fetch_all('SELECT * FROM users WHERE accountid = %s', (account_id,))
+
+
+async def get_all_users():
+    return await fetch_all('SELECT * FROM users')
+
+
+async def create_product(account_id, name, price, cost, quantity, image, category, unit, recipe, is_composite, created_by):
+    return decode_product(await fetch_one('''
+        INSERT INTO products (accountId, name, price, cost, quantity, image, category, unit, recipe, isComposite, createdAt, createdBy)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s) RETURNING *
+    ''', (account_id, name, price, cost, quantity, image, category, unit, json.dumps(recipe), is_composite,
+          datetime.now().isoformat(), created_by)))
+
+
+async def get_products_by_account(account_id):
+    rows = await fetch_all('SELECT * FROM products WHERE accountId = %s', (account_id,))
+    return [decode_product(row) for row in rows]
+
+
+async def get_product(account_id, product_id):
+    return decode_product(await fetch_one('SELECT * FROM products WHERE id = %s AND accountId = %s',
+                                          (product_id, account_id)))
+
+
+async def update_product(product_id, **kwargs):
+    """Update the given columns and return the new row (None if it is gone)"""
+    if not kwargs:
+        return decode_product(await fetch_one('SELECT * FROM products WHERE id = %s', (product_id,)))
+    set_clause = ', '.join(f"{key} = %s" for key in kwargs)
+    values = list(kwargs.values()) + [datetime.now().isoformat(), product_id]
+    return decode_product(await fetch_one(f'''
+        UPDATE products SET {set_clause}, updatedAt = %s
+        WHERE id = %s RETURNING *
+    ''', values))
+
+
+async def delete_product(product_id):
+    async with get_db() as conn:
+        await conn.execute('DELETE FROM products WHERE id = %s', (product_id,))
+
+
+async def create_sale(account_id, items, total, cashier_id, cashier_name):
+    params = sale_params(account_id, items, total, cashier_id, cashier_name)
+    return decode_sale(await fetch_one(CREATE_SALE_SQL, params))
+
+
+async def record_sale(account_id, items, total, cashier_id, cashier_name):
+    """See database.record_sale: one statement, one transaction."""
+    params = record_sale_params(account_id, items, total, cashier_id, cashier_name)
+    return decode_sale(await fetch_one(RECORD_SALE_SQL, params))
+
+
+async def stream_rows(name, query, params):
+    """Async-iterate a named (server-side) cursor, STREAM_ITERSIZE rows per fetch."""
+    async with get_db() as conn:
+        async with conn.cursor(name=name) as cursor:
+            cursor.itersize = STREAM_ITERSIZE
+            await cursor.execute(query, params)
+            async for row in cursor:
+                yield row
+
+
+async def iter_sales(account_id, after_id=None, since=None, limit=None):
+    query, params = sales_query(account_id, after_id, since, limit)
+    async for row in stream_rows('sales_stream', query, params):
+        yield decode_sale(row)
+
+
+async def get_sales_by_account(account_id):
+    return [sale async for sale in iter_sales(account_id)]
+
+
+async def sales_total(account_id):
+    return (await fetch_one(SALES_TOTAL_SQL, (account_id,)))['total']
+
+
+async def product_sales(account_id, start, end, metric='revenue', limit=None, product_id=None):
+    query, params = product_sales_query(account_id, start, end, metric, limit, product_id)
+    return await fetch_all(query, params)
+
+
+async def top_products(account_id, start, end, limit=10, metric='revenue'):
+    return await product_sales(account_id, start, end, metric, limit)
+
+
+async def create_activity(activity_type, user_id, email, name, plan, created_by=None):
+    async with get_db() as conn:
+        await conn.execute('''
+            INSERT INTO activities (type, userId, email, name, plan, createdBy, timestamp)
+            VALUES (%s, %s, %s, %s, %s, %s, %s)
+        ''', (activity_type, user_id, email, name, plan, created_by, datetime.now().isoformat()))
+
+
+async def iter_activities(after_id=None, since=None, limit=None):
+    query, params = activities_query(after_id, since, limit)
+    async for row in stream_rows('activities_stream', query, params):
+        yield row
+
+
+async def get_all_activities():
+    return [activity async for activity in iter_activities()]
+
+
+async def get_settings():
+    result = await fetch_one('SELECT * FROM settings LIMIT 1')
+    return result or {'screenLockPassword': '2005', 'businessName': 'My Business'}
+
+
+async def update_settings(**kwargs):
+    if kwargs:
+        set_clause = ', '.join(f"{key} = %s" for key in kwargs)
+        async with get_db() as conn:
+            await conn.execute(f'UPDATE settings SET {set_clause} WHERE id = 1', list(kwargs.values()))
@@ -0,0 +1,134 @@
+"""Streaming CSV / Parquet export of the file-backed collections.
+
+Records are read one at a time from the JSON file (filestore.iter_records),
+encoded in chunks of CHUNK_ROWS and handed to the response as they are
+produced, so memory stays flat however much history is exported. CSV is
+gzip-compressed on the fly. Parquet is written one row group per chunk
+when pyarrow is installed.
+"""
+import csv
+import io
+import json
+import tempfile
+import zlib
+
+from filestore import iter_records
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Parquet export is optional
+    pa = None
+    pq = None
+
+CHUNK_ROWS = 5000
+READ_BYTES = 256 * 1024
+
+# Column name -> type used for Parquet ('int', 'float' or 'str'); CSV ignores types
+COLLECTIONS = {
+    'sales': {
+        'timestamp': 'createdAt',
+        'columns': [('id', 'int'), ('createdAt', 'str'), ('accountId', 'str'), ('cashierId', 'int'),
+                    ('cashierName', 'str'), ('paymentMethod', 'str'), ('subtotal', 'float'),
+                    ('discount', 'float'), ('tax', 'float'), ('taxType', 'str'), ('total', 'float'),
+                    ('items', 'str')],
+    },
+    'expenses': {
+        'timestamp': 'createdAt',
+        'columns': [('id', 'int'), ('createdAt', 'str'), ('accountId', 'str'), ('category', 'str'),
+                    ('description', 'str'), ('amount', 'float'), ('addedBy', 'str')],
+    },
+    'time-entries': {
+        'timestamp': 'clockInTime',
+        'columns': [('id', 'int'), ('date', 'str'), ('cashierId', 'int'), ('cashierName', 'str'),
+                    ('cashierEmail', 'str'), ('clockInTime', 'str'), ('clockOutTime', 'str'),
+                    ('duration', 'int'), ('status', 'str')],
+    },
+}
+
+
+def parquet_available():
+    return pq is not None
+
+
+def iter_rows(path, collection, start=None, end=None, accept=None):
+    """Flat rows (lists in column order) for records in [start, end]."""
+    spec = COLLECTIONS[collection]
+    field = spec['timestamp']
+    for record in iter_records(path):
+        stamp = record.get(field) or record.get('createdAt') or ''
+        if (start and stamp < start) or (end and stamp > end):
+            continue
+        if accept is not None and not accept(record):
+            continue
+        row = []
+        for column, _ in spec['columns']:
+            value = record.get(column)
+            row.append(json.dumps(value) if isinstance(value, (dict, list)) else value)
+        yield row
+
+
+def _batches(rows, size):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def csv_chunks(rows, columns, chunk_rows=CHUNK_ROWS):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow([name for name, _ in columns])
+    for batch in _batches(rows, chunk_rows):
+        writer.writerows(batch)
+        yield buffer.getvalue().encode('utf-8')
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode('utf-8')
+
+
+def gzip_chunks(chunks, level=6):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)  # wbits=31 -> gzip container
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def _coerce(value, kind):
+    if value is None or value == '':
+        return None
+    try:
+        if kind == 'int':
+            return int(value)
+        if kind == 'float':
+            return float(value)
+    except (TypeError, ValueError):
+        return None
+    return str(value)
+
+
+def parquet_chunks(rows, columns, chunk_rows=CHUNK_ROWS):
+    """Write one row group per chunk to a temp file, then stream the file."""
+    if pq is None:
+        raise RuntimeError('Parquet export requires pyarrow')
+    types = {'int': pa.int64(), 'float': pa.float64(), 'str': pa.string()}
+    schema = pa.schema([(name, types[kind]) for name, kind in columns])
+    with tempfile.TemporaryFile() as spool:
+        with pq.ParquetWriter(spool, schema, compression='snappy') as writer:
+            for batch in _batches(rows, chunk_rows):
+                arrays = [pa.array([_coerce(row[i], kind) for row in batch], types[kind])
+                          for i, (_, kind) in enumerate(columns)]
+                writer.write_table(pa.Table.from_arrays(arrays, schema=schema))
+        spool.seek(0)
+        while True:
+            data = spool.read(READ_BYTES)
+            if not data:
+                break
+            yield data
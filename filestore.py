@@ -0,0 +1,166 @@
+"""Helpers shared by the file-backed stores in data/."""
+import json
+import os
+import tempfile
+import threading
+
+try:
+    import fcntl
+except ImportError:  # Not on Windows; FileLock then only orders threads of one process
+    fcntl = None
+
+
+class FileLock:
+    """Exclusive lock across the threads and gunicorn workers sharing `path`.
+
+    Use as `with lock:`. Not reentrant. A thread lock orders threads and an
+    flock orders processes; flock belongs to the open file, so each forked
+    worker opens its own descriptor on first use.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = None
+        self._pid = None
+
+    def _handle(self):
+        if self._pid != os.getpid():
+            self._file = open(self.path, 'a+b')
+            self._pid = os.getpid()
+        return self._file
+
+    def __enter__(self):
+        self._lock.acquire()
+        if fcntl is not None:
+            try:
+                fcntl.flock(self._handle(), fcntl.LOCK_EX)
+            except BaseException:
+                self._lock.release()
+                raise
+        return self
+
+    def __exit__(self, *exc):
+        try:
+            if fcntl is not None:
+                fcntl.flock(self._file, fcntl.LOCK_UN)
+        finally:
+            self._lock.release()
+
+
+def write_json_atomic(path, data):
+    """Replace `path` with `data` via a temp file unique to this writer."""
+    directory = os.path.dirname(path) or '.'
+    fd, tmp = tempfile.mkstemp(dir=directory, prefix=os.path.basename(path) + '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(data, f)
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+
+
+def file_version(path):
+    """Cheap change token for a data file: (mtime_ns, size), or None if missing.
+
+    Every gunicorn worker sees the same token, so caches keyed on it are
+    invalidated by writes from any worker without extra coordination.
+    """
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+
+def iter_records(path, chunk_size=64 * 1024):
+    """Yield the elements of a JSON array file one at a time.
+
+    Reads the file in chunks and decodes element by element, so memory stays
+    proportional to one record rather than the whole collection.
+    """
+    for record, _ in _scan(path, 0, chunk_size):
+        yield record
+
+
+def iter_records_after(path, offset, chunk_size=64 * 1024):
+    """Yield (record, end offset) for the elements of a JSON array file.
+
+    With a non-zero `offset` (an end offset yielded earlier), decoding starts
+    there, just past an element, so records appended since are read without
+    parsing the ones before them. Offsets are in characters, which match
+    bytes for the ASCII JSON that json.dump writes by default.
+    """
+    return _scan(path, offset, chunk_size)
+
+
+def tail_intact(path, tail):
+    """True if `tail` = (end offset, json.dumps text of a record) is still in place.
+
+    For collections that are only appended to or have records deleted, with
+    an id in every record, that means nothing up to the offset changed and
+    iter_records_after(path, offset) yields exactly what was added.
+    """
+    if tail is None:
+        return False
+    end, text = tail
+    raw = text.encode()
+    try:
+        with open(path, 'rb') as f:
+            f.seek(end - len(raw))
+            return f.read(len(raw)) == raw
+    except (OSError, ValueError):
+        return False
+
+
+def _scan(path, offset, chunk_size):
+    decoder = json.JSONDecoder()
+    try:
+        f = open(path, 'r')
+    except OSError:
+        return
+    with f:
+        if offset:
+            f.seek(offset)
+        buffer = ''
+        started = bool(offset)
+        eof = False
+        position = 0
+        consumed = offset  # characters dropped from the front of buffer
+        while True:
+            # Skip whitespace and separators between elements
+            while position < len(buffer) and buffer[position] in ' \t\r\n,':
+                position += 1
+            if not started and position < len(buffer):
+                if buffer[position] != '[':
+                    raise ValueError(f'{path} does not contain a JSON array')
+                started = True
+                position += 1
+                continue
+            if position < len(buffer) and buffer[position] == ']':
+                return
+            try:
+                if position >= len(buffer):
+                    raise ValueError('need more data')
+                record, end = decoder.raw_decode(buffer, position)
+                rest = buffer[end:].lstrip()
+                if (not rest and not eof) or (rest and rest[0] not in ',]'):
+                    # A scalar cut at the chunk boundary may decode short
+                    raise ValueError('need more data')
+            except ValueError:
+                if eof:
+                    if buffer[position:].strip():
+                        raise
+                    return
+                chunk = f.read(chunk_size)
+                eof = not chunk
+                consumed += position
+                buffer = buffer[position:] + chunk
+                position = 0
+                continue
+            position = end
+            yield record, consumed + end
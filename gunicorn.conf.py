@@ -4,4 +4,12 @@ timeout = 120
 keepalive = 2
 max_requests = 1000
 max_requests_jitter = 100
-preload_app = True
\ No newline at end of file
+preload_app = True
+
+def pre_fork(server, worker):
+    # Workers must not inherit the master's Postgres connections (app_db preloads
+    # database.py); each worker opens its own pool on first use.
+    import sys
+    database = sys.modules.get('database')
+    if database is not None:
+        database.close_pool()
@@ -0,0 +1,161 @@
+"""Append-only stock movement ledger with checkpointed on-hand snapshots.
+
+Every change to a product's quantity is recorded as one JSON line in
+stock_movements.jsonl. product['quantity'] stays the materialized on-hand
+figure; each movement also carries the resulting balance, so a
+point-in-time query only has to replay the ledger tail after the nearest
+checkpoint instead of the whole history.
+"""
+import json
+import os
+from bisect import bisect_right
+from datetime import datetime
+
+from filestore import FileLock, file_version
+
+MOVEMENT_TYPES = ('sale', 'receipt', 'adjustment', 'composite')
+CHECKPOINT_BYTES = int(os.environ.get('STOCK_CHECKPOINT_BYTES', 256 * 1024))
+
+
+class StockLedger:
+    def __init__(self, ledger_file, checkpoints_file, load, save, checkpoint_bytes=CHECKPOINT_BYTES):
+        self.ledger_file = ledger_file
+        self.checkpoints_file = checkpoints_file
+        self.load = load
+        self.save = save
+        self.checkpoint_bytes = checkpoint_bytes
+        self._lock = FileLock(ledger_file + '.lock')
+        self._checkpoints_version = object()
+        self._checkpoints = []
+
+    # -- writes ---------------------------------------------------------
+
+    def record(self, products, movements, account_id=None):
+        """Apply movements to the loaded products list and append them to the ledger.
+
+        movements: iterable of {productId, delta, type, ref?}. Quantities on
+        `products` are updated in place; the caller still saves products.json.
+        Returns the ledger entries that were written.
+        """
+        by_id = {p['id']: p for p in products}
+        entries = []
+        for movement in movements:
+            if movement['type'] not in MOVEMENT_TYPES:
+                raise ValueError(f"Unknown movement type: {movement['type']}")
+            product = by_id.get(movement['productId'])
+            if product is None or not movement['delta']:
+                continue
+            balance = float(product.get('quantity', 0)) + float(movement['delta'])
+            product['quantity'] = balance
+            entries.append({
+                'productId': product['id'],
+                'type': movement['type'],
+                'delta': float(movement['delta']),
+                'balance': balance,
+                'ref': movement.get('ref'),
+                'accountId': product.get('accountId', account_id),
+            })
+
+        if not entries:
+            return entries
+
+        with self._lock:
+            # Stamped under the lock so the ledger stays in time order across workers
+            at = datetime.now().isoformat()
+            for entry in entries:
+                entry['at'] = at
+            if not self.checkpoints():
+                # First movement ever: snapshot the pre-ledger stock as the base
+                self._write_checkpoint(products, entries, at)
+            payload = ''.join(json.dumps(e) + '\n' for e in entries).encode('utf-8')
+            fd = os.open(self.ledger_file, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(fd, payload)
+                offset = os.fstat(fd).st_size
+            finally:
+                os.close(fd)
+            last = self._checkpoints[-1]
+            if offset - last['offset'] >= self.checkpoint_bytes:
+                self._write_checkpoint(products, [], at, offset)
+        return entries
+
+    def _write_checkpoint(self, products, pending, at, offset=None):
+        on_hand = {str(p['id']): float(p.get('quantity', 0)) for p in products}
+        # Undo not-yet-written movements so the snapshot matches `offset`
+        for entry in pending:
+            key = str(entry['productId'])
+            on_hand[key] = on_hand.get(key, 0) - entry['delta']
+        if offset is None:
+            offset = os.path.getsize(self.ledger_file) if os.path.exists(self.ledger_file) else 0
+        checkpoints = self.load(self.checkpoints_file)
+        checkpoints.append({'at': at, 'offset': offset, 'onHand': on_hand})
+        self.save(self.checkpoints_file, checkpoints)
+        self._checkpoints = checkpoints
+        self._checkpoints_version = file_version(self.checkpoints_file)
+
+    # -- reads ----------------------------------------------------------
+
+    def checkpoints(self):
+        version = file_version(self.checkpoints_file)
+        if version != self._checkpoints_version:
+            self._checkpoints = self.load(self.checkpoints_file) if version else []
+            self._checkpoints_version = version
+        return self._checkpoints
+
+    def _read_from(self, offset):
+        if not os.path.exists(self.ledger_file):
+            return
+        with open(self.ledger_file, 'rb') as f:
+            f.seek(offset)
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+    def _read_backwards(self, block_size=64 * 1024):
+        if not os.path.exists(self.ledger_file):
+            return
+        with open(self.ledger_file, 'rb') as f:
+            f.seek(0, os.SEEK_END)
+            position = f.tell()
+            tail = b''
+            while position > 0:
+                step = min(block_size, position)
+                position -= step
+                f.seek(position)
+                lines = (f.read(step) + tail).split(b'\n')
+                tail = lines.pop(0)
+                for line in reversed(lines):
+                    if line.strip():
+                        yield json.loads(line)
+            if tail.strip():
+                yield json.loads(tail)
+
+    def movements(self, product_id=None, account_id=None, limit=100):
+        """Most recent movements first, optionally for one product/account."""
+        result = []
+        for entry in self._read_backwards():
+            if product_id is not None and entry['productId'] != product_id:
+                continue
+            if account_id is not None and entry.get('accountId') != account_id:
+                continue
+            result.append(entry)
+            if len(result) >= limit:
+                break
+        return result
+
+    def on_hand_at(self, at):
+        """On-hand quantity per product id as of the ISO timestamp `at`."""
+        checkpoints = self.checkpoints()
+        index = bisect_right([c['at'] for c in checkpoints], at) - 1
+        if index >= 0:
+            base = checkpoints[index]
+            on_hand = {int(k): v for k, v in base['onHand'].items()}
+            offset = base['offset']
+        else:
+            on_hand, offset = {}, 0
+        for entry in self._read_from(offset):
+            # Lines written before the lock stamped them can be out of order
+            if entry['at'] > at:
+                continue
+            on_hand[entry['productId']] = entry['balance']
+        return on_hand
@@ -0,0 +1,17 @@
+"""Flask JSON provider for the Postgres-backed apps (app_db.py, app_production.py).
+
+timestamptz columns come back from psycopg as datetimes; Flask's default
+would send them in RFC 822 form. This keeps sending the ISO strings the
+text columns used to hold.
+"""
+from datetime import date, datetime
+
+from flask.json.provider import DefaultJSONProvider
+
+
+class JSONProvider(DefaultJSONProvider):
+    @staticmethod
+    def default(o):
+        if isinstance(o, (date, datetime)):
+            return o.isoformat()
+        return DefaultJSONProvider.default(o)
@@ -0,0 +1,251 @@
+"""Versioned schema migrations for the Postgres backend (database.py).
+
+Applied versions are recorded in schema_migrations and each migration runs
+once, in order. A session advisory lock stops concurrent workers from
+racing. Migrations run on a dedicated autocommit connection, so large
+tables are converted without a long lock:
+
+  * type changes add a shadow column, backfill it in id-range batches of
+    BACKFILL_BATCH rows (each its own short transaction), then swap it in
+    under a brief ACCESS EXCLUSIVE lock. A trigger keeps the shadow column
+    in step with app writes until the swap;
+  * indexes are built with CREATE INDEX CONCURRENTLY.
+
+Run with `python init_db.py` before deploying, or let init_db() apply
+pending migrations on startup.
+"""
+import logging
+import os
+import time
+
+import psycopg
+
+logger = logging.getLogger(__name__)
+
+BACKFILL_BATCH = int(os.environ.get('MIGRATION_BATCH', 5000))
+LOCK_ID = 725_001  # pg_advisory_lock key for migrations
+
+TIMESTAMP_COLUMNS = [
+    ('accounts', 'createdat'), ('accounts', 'trialendsat'),
+    ('users', 'createdat'),
+    ('products', 'createdat'), ('products', 'updatedat'),
+    ('sales', 'createdat'),
+    ('expenses', 'createdat'),
+    ('activities', 'timestamp'),
+]
+JSON_COLUMNS = [
+    ('sales', 'items', "'[]'::jsonb"),
+    ('products', 'recipe', "'[]'::jsonb"),
+]
+INDEXES = [
+    ('idx_users_accountid', 'users (accountid)'),
+    ('idx_products_accountid', 'products (accountid)'),
+    ('idx_sales_accountid_createdat', 'sales (accountid, createdat)'),
+    ('idx_expenses_accountid_createdat', 'expenses (accountid, createdat)'),
+    ('idx_activities_timestamp', 'activities (timestamp)'),
+]
+# Keyset pagination walks an account's sales by id (database.iter_sales)
+KEYSET_INDEXES = [
+    ('idx_sales_accountid_id', 'sales (accountid, id)'),
+]
+# Per-product reports: the INCLUDE columns let aggregates run index-only
+SALE_ITEMS_INDEXES = [
+    ('idx_sale_items_account_created', 'sale_items (account_id, created_at) INCLUDE (product_id, qty, unit_price)'),
+    ('idx_sale_items_account_product_created', 'sale_items (account_id, product_id, created_at) INCLUDE (qty, unit_price)'),
+]
+
+# One sale_items row per element of sales.items, with the same reading of a
+# line as salelines.py: quantity (or weight), and a unit price that already
+# reflects lineTotal when the pricing engine set one.
+BACKFILL_SALE_ITEMS = '''
+    INSERT INTO sale_items (sale_id, account_id, product_id, qty, unit_price, created_at)
+    SELECT s.id, s.accountid, l.product_id, l.qty,
+           CASE WHEN l.qty <> 0 AND l.has_total THEN COALESCE(l.line_total, 0) / l.qty ELSE l.price END,
+           s.createdat
+    FROM sales s
+    CROSS JOIN LATERAL jsonb_array_elements(
+        CASE WHEN jsonb_typeof(s.items) = 'array' THEN s.items ELSE '[]'::jsonb END) AS e(item)
+    CROSS JOIN LATERAL (SELECT
+        CASE WHEN e.item->>'productId' ~ '^[0-9]+$' THEN (e.item->>'productId')::int END AS product_id,
+        COALESCE(NULLIF(CASE WHEN e.item ? 'quantity' THEN e.item->>'quantity' ELSE e.item->>'weight' END, '')::float8, 0) AS qty,
+        COALESCE(NULLIF(e.item->>'price', '')::float8, 0) AS price,
+        e.item ? 'lineTotal' AS has_total,
+        NULLIF(e.item->>'lineTotal', '')::float8 AS line_total
+    ) l
+    WHERE s.id >= %s AND s.id < %s
+      AND NOT EXISTS (SELECT 1 FROM sale_items i WHERE i.sale_id = s.id)
+'''
+
+
+def column_type(conn, table, column):
+    row = conn.execute('''
+        SELECT data_type FROM information_schema.columns
+        WHERE table_schema = current_schema() AND table_name = %s AND column_name = %s
+    ''', (table, column)).fetchone()
+    return row[0] if row else None
+
+
+def convert_column(conn, table, column, sql_type, expression, default=None):
+    """Change a column's type online: shadow column, batched backfill, quick swap.
+
+    `expression` converts the old value, written in terms of {col}. From the
+    moment the shadow column exists, a BEFORE INSERT OR UPDATE trigger fills
+    it for every row the app writes, so inserts and updates made during the
+    backfill are not lost. Re-running after an interruption resumes from the
+    existing shadow column.
+    """
+    if column_type(conn, table, column) in (None, sql_type):
+        return
+    shadow = f'{column}_new'
+    sync = f'{table}_{shadow}_sync'
+    convert = expression.format(col=column)
+    with conn.transaction():
+        conn.execute(f'ALTER TABLE {table} ADD COLUMN IF NOT EXISTS {shadow} {sql_type}')
+        conn.execute(f'''
+            CREATE OR REPLACE FUNCTION {sync}() RETURNS trigger AS $$
+            BEGIN
+                NEW.{shadow} := {expression.format(col='NEW.' + column)};
+                RETURN NEW;
+            END
+            $$ LANGUAGE plpgsql
+        ''')
+        conn.execute(f'DROP TRIGGER IF EXISTS {sync} ON {table}')
+        conn.execute(f'''
+            CREATE TRIGGER {sync} BEFORE INSERT OR UPDATE OF {column} ON {table}
+            FOR EACH ROW EXECUTE FUNCTION {sync}()
+        ''')
+
+    low, high = conn.execute(f'SELECT min(id), max(id) FROM {table}').fetchone()
+    started, rows = time.time(), 0
+    if low is not None:
+        for start in range(low, high + 1, BACKFILL_BATCH):
+            cursor = conn.execute(f'''
+                UPDATE {table} SET {shadow} = {convert}
+                WHERE id >= %s AND id < %s AND {shadow} IS NULL AND {column} IS NOT NULL
+            ''', (start, start + BACKFILL_BATCH))
+            rows += cursor.rowcount
+    logger.info(f"Backfilled {table}.{column} -> {sql_type}: {rows} rows in {time.time() - started:.1f}s")
+
+    with conn.transaction():
+        conn.execute(f'LOCK TABLE {table} IN ACCESS EXCLUSIVE MODE')
+        conn.execute(f'DROP TRIGGER {sync} ON {table}')
+        conn.execute(f'DROP FUNCTION {sync}()')
+        conn.execute(f'ALTER TABLE {table} DROP COLUMN {column}')
+        conn.execute(f'ALTER TABLE {table} RENAME COLUMN {shadow} TO {column}')
+        if default:
+            conn.execute(f'ALTER TABLE {table} ALTER COLUMN {column} SET DEFAULT {default}')
+
+
+def timestamps_to_timestamptz(conn):
+    for table, column in TIMESTAMP_COLUMNS:
+        convert_column(conn, table, column, 'timestamp with time zone',
+                       "NULLIF({col}, '')::timestamptz")
+
+
+def json_text_to_jsonb(conn):
+    for table, column, default in JSON_COLUMNS:
+        convert_column(conn, table, column, 'jsonb',
+                       "COALESCE(NULLIF({col}, '')::jsonb, " + default + ")", default)
+
+
+def fractional_stock(conn):
+    """Weighed lines take e.g. 0.3kg out of stock, which an INTEGER rounds away."""
+    convert_column(conn, 'products', 'quantity', 'double precision', '{col}::double precision', '0')
+
+
+def build_indexes(conn, indexes):
+    for name, target in indexes:
+        # A failed CONCURRENTLY build leaves an invalid index behind; rebuild it
+        invalid = conn.execute('''
+            SELECT 1 FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+            WHERE c.relname = %s AND NOT i.indisvalid
+        ''', (name,)).fetchone()
+        if invalid:
+            conn.execute(f'DROP INDEX CONCURRENTLY IF EXISTS {name}')
+        conn.execute(f'CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {target}')
+        conn.execute(f'ANALYZE {target.split()[0]}')
+
+
+def account_indexes(conn):
+    build_indexes(conn, INDEXES)
+
+
+def keyset_indexes(conn):
+    build_indexes(conn, KEYSET_INDEXES)
+
+
+def backfill_sale_items(conn, low, high):
+    started, rows = time.time(), 0
+    for start in range(low, high + 1, BACKFILL_BATCH):
+        rows += conn.execute(BACKFILL_SALE_ITEMS, (start, start + BACKFILL_BATCH)).rowcount
+    logger.info(f"Backfilled sale_items for sales {low}..{high}: {rows} lines in {time.time() - started:.1f}s")
+
+
+def sale_items_table(conn):
+    """Normalize sales.items into sale_items, backfilled in id-range batches."""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS sale_items (
+            id BIGSERIAL PRIMARY KEY,
+            sale_id INTEGER NOT NULL REFERENCES sales(id) ON DELETE CASCADE,
+            account_id INTEGER,
+            product_id INTEGER,
+            qty DOUBLE PRECISION NOT NULL,
+            unit_price DOUBLE PRECISION NOT NULL,
+            -- NULL for legacy sales without a timestamp; ranged reports skip them, as reports.py does
+            created_at TIMESTAMPTZ
+        )
+    ''')
+    # A run that failed on a NULL createdat left the table with NOT NULL here
+    conn.execute('ALTER TABLE sale_items ALTER COLUMN created_at DROP NOT NULL')
+    # Needed by the backfill's NOT EXISTS; the table is new, so no CONCURRENTLY
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_sale_items_sale_id ON sale_items (sale_id)')
+
+    low, high = conn.execute('SELECT min(id), max(id) FROM sales').fetchone()
+    if low is not None:
+        backfill_sale_items(conn, low, high)
+        # Sales another instance wrote meanwhile without lines
+        latest = conn.execute('SELECT max(id) FROM sales').fetchone()[0]
+        if latest > high:
+            backfill_sale_items(conn, high + 1, latest)
+    build_indexes(conn, SALE_ITEMS_INDEXES)
+
+
+# (version, name, migration); append only, never renumber
+MIGRATIONS = [
+    (1, 'timestamps to timestamptz', timestamps_to_timestamptz),
+    (2, 'json text to jsonb', json_text_to_jsonb),
+    (3, 'account and time indexes', account_indexes),
+    (4, 'keyset pagination indexes', keyset_indexes),
+    (5, 'sale_items table', sale_items_table),
+    (6, 'fractional product quantities', fractional_stock),
+]
+
+
+def applied_versions(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            applied_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        )
+    ''')
+    return {row[0] for row in conn.execute('SELECT version FROM schema_migrations')}
+
+
+def migrate(conninfo):
+    """Apply pending migrations; returns the versions applied."""
+    applied = []
+    with psycopg.connect(conninfo, autocommit=True) as conn:
+        conn.execute('SELECT pg_advisory_lock(%s)', (LOCK_ID,))
+        try:
+            done = applied_versions(conn)
+            for version, name, migration in MIGRATIONS:
+                if version in done:
+                    continue
+                logger.info(f"Applying migration {version}: {name}")
+                migration(conn)
+                conn.execute('INSERT INTO schema_migrations (version, name) VALUES (%s, %s)', (version, name))
+                applied.append(version)
+        finally:
+            conn.execute('SELECT pg_advisory_unlock(%s)', (LOCK_ID,))
+    return applied
@@ -0,0 +1,228 @@
+"""Persistent email outbox in data/emails.json, drained in batches.
+
+Emails are appended with status 'queued' and sent by a background worker.
+Each pass claims up to BATCH_SIZE due emails, sends them over one SMTP
+connection and marks them 'sent'. Failures are retried with exponential
+backoff and marked 'failed' after MAX_ATTEMPTS. The file is guarded by an
+flock so gunicorn workers can share it: claims are written back before
+sending, so no email is sent twice. Without SMTP_HOST, emails are only
+logged, as send_admin_email always did.
+"""
+import os
+import smtplib
+import threading
+import time
+from datetime import datetime, timedelta
+from email.message import EmailMessage
+
+from filestore import FileLock, file_version
+
+BATCH_SIZE = int(os.environ.get('EMAIL_BATCH_SIZE', 50))
+DRAIN_SECONDS = float(os.environ.get('EMAIL_DRAIN_SECONDS', 10))
+MAX_ATTEMPTS = int(os.environ.get('EMAIL_MAX_ATTEMPTS', 6))
+BACKOFF_SECONDS = 30
+BACKOFF_MAX_SECONDS = 3600
+CLAIM_TIMEOUT_SECONDS = 300
+
+
+class LogSender:
+    """Stand-in used when no SMTP server is configured."""
+
+    def send_batch(self, emails):
+        for email in emails:
+            print(f"[EMAIL] To: {email.get('userEmail')}, Subject: {email.get('subject')}")
+        return {email['id']: None for email in emails}
+
+
+class SmtpSender:
+    def __init__(self, host, port=25, username=None, password=None, sender=None, starttls=False, timeout=15):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.sender = sender or 'no-reply@localhost'
+        self.starttls = starttls
+        self.timeout = timeout
+
+    @classmethod
+    def from_env(cls):
+        """SmtpSender from SMTP_* variables, or a LogSender without SMTP_HOST."""
+        if not os.environ.get('SMTP_HOST'):
+            return LogSender()
+        return cls(os.environ['SMTP_HOST'], int(os.environ.get('SMTP_PORT', 25)),
+                   os.environ.get('SMTP_USER'), os.environ.get('SMTP_PASSWORD'),
+                   os.environ.get('SMTP_FROM'), os.environ.get('SMTP_STARTTLS') == '1')
+
+    def send_batch(self, emails):
+        """{email id: error or None}.
+
+        Errors before the first message (connect, STARTTLS, login) propagate
+        and fail the batch. A connection lost partway through marks only the
+        emails not yet accepted, so those already sent are not sent again.
+        """
+        results = {}
+        with smtplib.SMTP(self.host, self.port, timeout=self.timeout) as smtp:
+            if self.starttls:
+                smtp.starttls()
+            if self.username:
+                smtp.login(self.username, self.password)
+            for index, email in enumerate(emails):
+                message = EmailMessage()
+                message['From'] = self.sender
+                message['To'] = email['userEmail']
+                message['Subject'] = email['subject']
+                message.set_content(email['message'])
+                try:
+                    smtp.send_message(message)
+                    results[email['id']] = None
+                except (smtplib.SMTPRecipientsRefused, smtplib.SMTPDataError, smtplib.SMTPSenderRefused) as e:
+                    results[email['id']] = str(e)
+                except (OSError, smtplib.SMTPException) as e:
+                    print(f"Email batch interrupted after {index} of {len(emails)}: {e}")
+                    for unsent in emails[index:]:
+                        results[unsent['id']] = str(e)
+                    break
+        return results
+
+
+def backoff(attempts):
+    return min(BACKOFF_SECONDS * 2 ** (attempts - 1), BACKOFF_MAX_SECONDS)
+
+
+class EmailOutbox:
+    def __init__(self, emails_file, load, save, sender=None):
+        self.emails_file = emails_file
+        self.load = load
+        self.save = save
+        self.sender = sender or SmtpSender.from_env()
+        self._lock = threading.Lock()
+        self._file_lock = FileLock(emails_file + '.lock')
+        self._wake = threading.Event()
+        self._pid = None
+        self._keys = (None, set())
+        self._counters = {'queued': 0, 'sent': 0, 'retried': 0, 'failed': 0, 'batches': 0}
+
+    def _sent_keys(self, emails):
+        # Dedupe keys of everything already in the outbox, rebuilt per file version
+        version = file_version(self.emails_file)
+        if self._keys[0] != version:
+            self._keys = (version, {e['key'] for e in emails if e.get('key')})
+        return self._keys[1]
+
+    def enqueue(self, to, subject, message, user=None, kind=None, key=None):
+        """Queue an email; with `key`, an email already queued under it is not repeated."""
+        with self._file_lock:
+            emails = self.load(self.emails_file)
+            if key and key in self._sent_keys(emails):
+                return None
+            now = datetime.now().isoformat()
+            email = {
+                'id': max([e.get('id', 0) for e in emails] + [0]) + 1,
+                'type': kind,
+                'key': key,
+                'userId': (user or {}).get('id'),
+                'userEmail': to,
+                'userName': (user or {}).get('name'),
+                'subject': subject,
+                'message': message,
+                'status': 'queued',
+                'attempts': 0,
+                'nextAttemptAt': now,
+                'createdAt': now,
+            }
+            emails.append(email)
+            self.save(self.emails_file, emails)
+            if key:
+                self._keys[1].add(key)
+            self._counters['queued'] += 1
+        self._wake.set()
+        return email
+
+    def _claim(self, now, batch_size):
+        stale = (now - timedelta(seconds=CLAIM_TIMEOUT_SECONDS)).isoformat()
+        with self._file_lock:
+            emails = self.load(self.emails_file)
+            batch = []
+            for email in emails:
+                due = (email.get('status') == 'queued' and email.get('nextAttemptAt', '') <= now.isoformat()) or \
+                      (email.get('status') == 'sending' and email.get('claimedAt', '') < stale)
+                if due:
+                    email['status'] = 'sending'
+                    email['claimedAt'] = now.isoformat()
+                    batch.append(dict(email))
+                    if len(batch) >= batch_size:
+                        break
+            if batch:
+                self.save(self.emails_file, emails)
+            return batch
+
+    def _settle(self, results, batch_error):
+        now = datetime.now()
+        with self._file_lock:
+            emails = self.load(self.emails_file)
+            for email in emails:
+                if email.get('id') not in results or email.get('status') != 'sending':
+                    continue
+                error = results[email['id']] or None
+                email.pop('claimedAt', None)
+                email['attempts'] = email.get('attempts', 0) + 1
+                if error is None and batch_error is None:
+                    email['status'] = 'sent'
+                    email['sentAt'] = now.isoformat()
+                    self._counters['sent'] += 1
+                elif email['attempts'] >= MAX_ATTEMPTS:
+                    email['status'] = 'failed'
+                    email['lastError'] = error or batch_error
+                    self._counters['failed'] += 1
+                else:
+                    email['status'] = 'queued'
+                    email['lastError'] = error or batch_error
+                    email['nextAttemptAt'] = (now + timedelta(seconds=backoff(email['attempts']))).isoformat()
+                    self._counters['retried'] += 1
+            self.save(self.emails_file, emails)
+
+    def drain(self, batch_size=BATCH_SIZE):
+        """Send every due email, batch by batch; returns how many were attempted."""
+        attempted = 0
+        while True:
+            batch = self._claim(datetime.now(), batch_size)
+            if not batch:
+                return attempted
+            try:
+                results, batch_error = self.sender.send_batch(batch), None
+            except (OSError, smtplib.SMTPException) as e:
+                results, batch_error = {email['id']: None for email in batch}, str(e)
+                print(f"Email batch failed: {e}")
+            self._counters['batches'] += 1
+            self._settle(results, batch_error)
+            attempted += len(batch)
+            if batch_error:
+                return attempted
+
+    def _run(self):
+        pid = os.getpid()
+        while self._pid == pid:
+            self._wake.wait(DRAIN_SECONDS)
+            self._wake.clear()
+            try:
+                self.drain()
+            except Exception as e:
+                print(f"Email outbox error: {e}")
+                time.sleep(DRAIN_SECONDS)
+
+    def start(self):
+        """Start the drain worker in this process (again after a fork)."""
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            threading.Thread(target=self._run, name='email-outbox', daemon=True).start()
+
+    def stats(self):
+        emails = self.load(self.emails_file)
+        by_status = {}
+        for email in emails:
+            by_status[email.get('status')] = by_status.get(email.get('status'), 0) + 1
+        return {'statuses': by_status, 'worker': dict(self._counters)}
@@ -0,0 +1,109 @@
+"""In-process scheduler that keeps expensive owner views precomputed.
+
+Each view is refreshed on a small thread pool every `interval` seconds and,
+at most every `min_interval` seconds, when one of its source files changes
+(from any worker), so bursts of writes coalesce into one recompute. Results are
+stored pre-serialized with a generation number, so requests answer with
+the last result immediately and report its age and staleness in headers.
+"""
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from filestore import file_version
+
+POOL_SIZE = int(os.environ.get('PRECOMPUTE_WORKERS', 2))
+TICK_SECONDS = 1.0
+
+
+class ViewScheduler:
+    def __init__(self, pool_size=POOL_SIZE):
+        self.pool_size = pool_size
+        self._lock = threading.Lock()
+        self._views = {}
+        self._results = {}
+        self._pending = set()
+        self._pid = None
+        self._executor = None
+
+    def register(self, name, compute, sources=(), interval=60, min_interval=5):
+        """compute() -> JSON-serializable value; sources are files that invalidate it."""
+        self._views[name] = {'compute': compute, 'sources': tuple(sources),
+                             'interval': interval, 'min_interval': min_interval}
+
+    def _ensure_started(self):
+        # Threads do not survive gunicorn's fork (preload_app), so start per process
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._executor = ThreadPoolExecutor(max_workers=self.pool_size, thread_name_prefix='precompute')
+            self._pending = set()
+            self._pid = os.getpid()
+            threading.Thread(target=self._run, name='precompute-timer', daemon=True).start()
+
+    def _versions(self, name):
+        return tuple(file_version(path) for path in self._views[name]['sources'])
+
+    def _is_stale(self, name, result):
+        return result['versions'] != self._versions(name)
+
+    def _refresh(self, name):
+        try:
+            versions = self._versions(name)
+            value = self._views[name]['compute']()
+            body = json.dumps(value)
+            with self._lock:
+                previous = self._results.get(name)
+                self._results[name] = {
+                    'generation': (previous['generation'] + 1) if previous else 1,
+                    'body': body,
+                    'computedAt': time.time(),
+                    'versions': versions,
+                }
+        except Exception as e:
+            print(f"Precompute {name} failed: {e}")
+        finally:
+            with self._lock:
+                self._pending.discard(name)
+
+    def _submit(self, name):
+        with self._lock:
+            if name in self._pending:
+                return
+            self._pending.add(name)
+        self._executor.submit(self._refresh, name)
+
+    def _run(self):
+        pid = os.getpid()
+        while self._pid == pid:
+            now = time.time()
+            for name, view in list(self._views.items()):
+                result = self._results.get(name)
+                if result is None:
+                    self._submit(name)
+                    continue
+                age = now - result['computedAt']
+                if age >= view['interval'] or (age >= view['min_interval'] and self._is_stale(name, result)):
+                    self._submit(name)
+            time.sleep(TICK_SECONDS)
+
+    def get(self, name):
+        """(json body, headers) for the latest result; computes inline only on a cold start."""
+        self._ensure_started()
+        result = self._results.get(name)
+        if result is None:
+            self._refresh(name)
+            result = self._results.get(name)
+            if result is None:
+                raise RuntimeError(f'View {name} is unavailable')
+        stale = self._is_stale(name, result)
+        headers = {
+            'X-View-Generation': str(result['generation']),
+            'X-View-Age': f"{time.time() - result['computedAt']:.1f}",
+            'X-View-Stale': 'true' if stale else 'false',
+        }
+        return result['body'], headers
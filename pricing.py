@@ -0,0 +1,198 @@
+"""Server-side cart pricing: line prices, discount rules and tax.
+
+Per-product price tables, compiled discount rules and the tax settings are
+cached against the version of products.json / discounts.json /
+settings.json, so pricing a sale is a handful of dict lookups until the
+catalog changes. Nothing price-bearing is taken from the cart: the tax rate
+and type come from the account's record in settings.json, and only the
+discounts the cart selects by id from the caller's own account are applied.
+"""
+import os
+import threading
+
+from filestore import file_version
+
+DEFAULT_TAX_RATE = float(os.environ.get('TAX_RATE', 0))
+DEFAULT_TAX_TYPE = os.environ.get('TAX_TYPE', 'exclusive')
+TAX_TYPES = ('inclusive', 'exclusive')
+WEIGHT_UNITS = ('kg', 'kgs', 'kilogram', 'kilograms')
+
+
+def _money(value):
+    return round(value + 0.0, 2)
+
+
+def _tenths(weight):
+    """Weight in kg -> integer number of 0.1kg steps."""
+    return int(round(float(weight) * 10))
+
+
+def build_price_table(product):
+    """Flatten a product into the fields pricing needs.
+
+    weightPricing keys ("0.1", "0.5", "1.0", ...) are normalised to integer
+    0.1kg steps so lookups never depend on how the weight was formatted.
+    """
+    price = float(product.get('price', 0) or 0)
+    tiers = {}
+    for weight, tier_price in (product.get('weightPricing') or {}).items():
+        try:
+            tiers[_tenths(weight)] = float(tier_price)
+        except (TypeError, ValueError):
+            continue
+    return {
+        'id': product['id'],
+        'name': product.get('name'),
+        'price': price,
+        'unitPrice': float(product.get('unitPrice', price) or 0),
+        'byWeight': str(product.get('unit', 'pcs')).lower() in WEIGHT_UNITS or bool(tiers),
+        'tiers': tiers,
+        'category': product.get('category', 'general'),
+    }
+
+
+def compile_discount(discount):
+    """Turn a discounts.json record into (id, name, fn(subtotal) -> amount)."""
+    value = float(discount.get('value', 0) or 0)
+    if discount.get('type') == 'fixed':
+        def apply(subtotal):
+            return min(value, subtotal)
+    else:
+        rate = value / 100.0
+
+        def apply(subtotal):
+            return subtotal * rate
+    return discount.get('id'), discount.get('name', ''), apply
+
+
+def tax_settings(settings):
+    """(taxType, taxRate) from an account's settings, falling back to TAX_TYPE/TAX_RATE."""
+    if not isinstance(settings, dict):
+        settings = {}
+    tax_type = settings.get('taxType', DEFAULT_TAX_TYPE)
+    if tax_type not in TAX_TYPES:
+        tax_type = 'exclusive'
+    try:
+        tax_rate = float(settings.get('taxRate', DEFAULT_TAX_RATE) or 0)
+    except (TypeError, ValueError):
+        tax_rate = DEFAULT_TAX_RATE
+    return tax_type, tax_rate
+
+
+class PricingEngine:
+    """Prices carts against the current catalog and discount rules."""
+
+    def __init__(self, products_file, discounts_file, settings_file, load):
+        self.products_file = products_file
+        self.discounts_file = discounts_file
+        self.settings_file = settings_file
+        self.load = load
+        self._lock = threading.Lock()
+        self._tables_version = object()
+        self._tables = {}
+        self._rules_version = object()
+        self._rules = {}
+        self._tax_version = object()
+        self._tax = {}
+
+    def price_tables(self):
+        version = file_version(self.products_file)
+        if version != self._tables_version:
+            with self._lock:
+                if version != self._tables_version:
+                    self._tables = {p['id']: build_price_table(p) for p in self.load(self.products_file) if 'id' in p}
+                    self._tables_version = version
+        return self._tables
+
+    def discount_rules(self):
+        """Active rules by accountId, each account's in discounts.json order."""
+        version = file_version(self.discounts_file)
+        if version != self._rules_version:
+            with self._lock:
+                if version != self._rules_version:
+                    rules = {}
+                    for d in self.load(self.discounts_file):
+                        if d.get('active', True):
+                            rules.setdefault(d.get('accountId'), []).append(compile_discount(d))
+                    self._rules = rules
+                    self._rules_version = version
+        return self._rules
+
+    def tax(self, account_id):
+        """(taxType, taxRate) for an account, from its record in settings.json."""
+        version = file_version(self.settings_file)
+        if version != self._tax_version:
+            with self._lock:
+                if version != self._tax_version:
+                    settings = self.load(self.settings_file)
+                    if not isinstance(settings, list):
+                        settings = []
+                    self._tax = {s.get('accountId'): tax_settings(s) for s in settings if isinstance(s, dict)}
+                    self._tax_version = version
+        return self._tax.get(account_id) or tax_settings(None)
+
+    def price_line(self, item, tables):
+        product_id = item.get('productId')
+        table = tables.get(product_id)
+        if table is None:
+            raise ValueError(f'Unknown product: {product_id}')
+
+        amount = float(item.get('quantity', item.get('weight', 0)) or 0)
+        if amount <= 0:
+            raise ValueError(f'Invalid quantity for product {product_id}')
+
+        if table['byWeight']:
+            tier_price = table['tiers'].get(_tenths(amount))
+            line_total = tier_price if tier_price is not None else table['unitPrice'] * amount
+        else:
+            line_total = table['price'] * amount
+
+        line = dict(item)
+        line.update({
+            'name': item.get('name', table['name']),
+            'price': table['unitPrice'] if table['byWeight'] else table['price'],
+            'lineTotal': _money(line_total),
+        })
+        return line
+
+    def quote(self, cart, account_id):
+        """Price a cart: {items, discountIds?} for the given account."""
+        items = cart.get('items') or []
+        if not items:
+            raise ValueError('Cart has no items')
+
+        tables = self.price_tables()
+        lines = [self.price_line(item, tables) for item in items]
+        subtotal = _money(sum(line['lineTotal'] for line in lines))
+
+        # Selected rules apply in order, each to what is left of the subtotal
+        wanted = cart.get('discountIds') or []
+        applied = []
+        remaining = subtotal
+        for rule_id, name, apply in self.discount_rules().get(account_id, []):
+            if rule_id not in wanted:
+                continue
+            amount = _money(min(apply(remaining), remaining))
+            if amount > 0:
+                applied.append({'id': rule_id, 'name': name, 'amount': amount})
+                remaining = _money(remaining - amount)
+        discount = _money(subtotal - remaining)
+
+        tax_type, tax_rate = self.tax(account_id)
+        if tax_type == 'inclusive':
+            tax = _money(remaining - remaining / (1 + tax_rate / 100.0))
+            total = remaining
+        else:
+            tax = _money(remaining * tax_rate / 100.0)
+            total = _money(remaining + tax)
+
+        return {
+            'items': lines,
+            'subtotal': subtotal,
+            'discount': discount,
+            'discounts': applied,
+            'taxType': tax_type,
+            'taxRate': tax_rate,
+            'tax': tax,
+            'total': total,
+        }
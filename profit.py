@@ -0,0 +1,188 @@
+"""Vectorized gross-margin reporting over sales lines.
+
+Sales lines are flattened into NumPy columns (productId, quantity,
+revenue, recorded batch cost, timestamp, account). When sales.json has
+only grown since the last build, just the appended sales are flattened
+and concatenated on; any other change rebuilds the columns.
+Each report is then a mask and a bincount per group, with no per-line
+Python loop. Line cost is the batch cost recorded at sale time (FEFO
+allocation). Any quantity not covered by a batch is costed at the
+product's weighted average batch cost, or else at its own `cost` field.
+"""
+import json
+import threading
+from array import array
+
+import numpy as np
+
+from filestore import file_version, iter_records_after, tail_intact
+
+GROUPS = ('product', 'day', 'account')
+
+
+def build_columns(sales, accounts=()):
+    """Flatten sales into columnar arrays; `sales` may be any iterable.
+
+    `accounts` are the account labels of columns these will be appended to,
+    so existing account codes keep their meaning.
+    """
+    product, quantity, revenue = array('q'), array('d'), array('d')
+    cost, costed = array('d'), array('d')
+    stamps, account = [], array('q')
+    account_codes = {label: code for code, label in enumerate(accounts)}
+    for sale in sales:
+        code = account_codes.setdefault(str(sale.get('accountId')), len(account_codes))
+        stamp = (sale.get('createdAt') or '1970-01-01T00:00:00')[:19]
+        for item in sale.get('items', []):
+            qty = float(item.get('quantity', item.get('weight', 0)) or 0)
+            product_id = int(item.get('productId') or 0)
+            product.append(product_id)
+            quantity.append(qty)
+            if 'lineTotal' in item:
+                revenue.append(float(item['lineTotal'] or 0))
+            else:
+                revenue.append(float(item.get('price', 0) or 0) * qty)
+            # Batch cost covers ingredients too; only the product's own batches count as costed quantity
+            allocations = item.get('batches') or []
+            cost.append(float(item.get('cost', 0) or 0) if allocations else 0.0)
+            costed.append(sum(float(a.get('quantity', 0)) for a in allocations
+                              if a.get('productId', product_id) == product_id))
+            stamps.append(stamp)
+            account.append(code)
+    return {
+        'product': np.frombuffer(product, dtype=np.int64),
+        'quantity': np.frombuffer(quantity, dtype=np.float64),
+        'revenue': np.frombuffer(revenue, dtype=np.float64),
+        'cost': np.frombuffer(cost, dtype=np.float64),
+        'costed': np.frombuffer(costed, dtype=np.float64),
+        'timestamp': np.array(stamps, dtype='datetime64[s]'),
+        'account': np.frombuffer(account, dtype=np.int64),
+        'accounts': sorted(account_codes, key=account_codes.get),
+    }
+
+
+def append_columns(columns, more):
+    """`columns` followed by `more` (built with columns['accounts'])."""
+    joined = {name: np.concatenate((values, more[name])) for name, values in columns.items() if name != 'accounts'}
+    joined['accounts'] = more['accounts']
+    return joined
+
+
+def unit_costs(batches, products):
+    """(sorted product ids, unit cost) from weighted batch costs, else product cost."""
+    received = {}
+    for batch in batches:
+        totals = received.setdefault(batch.get('productId'), [0.0, 0.0])
+        quantity = float(batch.get('quantity', 0) or 0)
+        totals[0] += quantity * float(batch.get('cost', 0) or 0)
+        totals[1] += quantity
+    costs = {p['id']: float(p.get('cost', 0) or 0) for p in products if 'id' in p}
+    for product_id, (value, quantity) in received.items():
+        if quantity > 0:
+            costs[product_id] = value / quantity
+    ids = np.array(sorted(costs), dtype=np.int64)
+    return ids, np.array([costs[i] for i in ids.tolist()], dtype=np.float64)
+
+
+def line_cogs(columns, cost_ids, cost_values):
+    """Recorded batch cost plus unit cost for any quantity no batch covered."""
+    product = columns['product']
+    if len(cost_ids):
+        index = np.clip(np.searchsorted(cost_ids, product), 0, len(cost_ids) - 1)
+        unit = np.where(cost_ids[index] == product, cost_values[index], 0.0)
+    else:
+        unit = np.zeros(len(product))
+    uncovered = np.maximum(columns['quantity'] - columns['costed'], 0.0)
+    return columns['cost'] + uncovered * unit
+
+
+def gross_margin(columns, cogs, group_by='product', start=None, end=None, account=None):
+    """Revenue, COGS and margin per group for lines in [start, end]."""
+    mask = np.ones(len(columns['product']), dtype=bool)
+    if start:
+        mask &= columns['timestamp'] >= np.datetime64(start[:19], 's')
+    if end:
+        mask &= columns['timestamp'] <= np.datetime64(end[:19], 's')
+    if account is not None:
+        if str(account) not in columns['accounts']:
+            return []
+        mask &= columns['account'] == columns['accounts'].index(str(account))
+
+    if group_by == 'day':
+        keys = columns['timestamp'][mask].astype('datetime64[D]').astype(np.int64)
+    else:
+        keys = columns[group_by][mask]
+    groups, inverse = np.unique(keys, return_inverse=True)
+    revenue = np.bincount(inverse, weights=columns['revenue'][mask], minlength=len(groups))
+    cost = np.bincount(inverse, weights=cogs[mask], minlength=len(groups))
+    quantity = np.bincount(inverse, weights=columns['quantity'][mask], minlength=len(groups))
+    margin = revenue - cost
+
+    if group_by == 'day':
+        labels = [str(d) for d in groups.astype('datetime64[D]')]
+    elif group_by == 'account':
+        labels = [columns['accounts'][g] for g in groups.tolist()]
+    else:
+        labels = groups.tolist()
+    rows = []
+    for label, qty, rev, cogs_total, gross in zip(labels, quantity.tolist(), revenue.tolist(), cost.tolist(), margin.tolist()):
+        rows.append({
+            group_by: label,
+            'quantity': round(qty, 3),
+            'revenue': round(rev, 2),
+            'cogs': round(cogs_total, 2),
+            'grossMargin': round(gross, 2),
+            'marginPct': round(gross / rev * 100, 2) if rev else None,
+        })
+    return rows
+
+
+class ProfitReports:
+    def __init__(self, sales_file, batches_file, products_file, load):
+        self.sales_file = sales_file
+        self.batches_file = batches_file
+        self.products_file = products_file
+        self.load = load
+        self._lock = threading.Lock()
+        self._version = None
+        self._columns = None
+        self._cogs = None
+        self._tail = None  # (end offset, JSON text) of the last sale in the columns
+
+    def _prepare(self):
+        version = tuple(file_version(p) for p in (self.sales_file, self.batches_file, self.products_file))
+        with self._lock:
+            if version != self._version:
+                columns = self._columns
+                if self._version is None or version[0] != self._version[0]:
+                    columns = self._sales_columns()
+                cost_ids, cost_values = unit_costs(self.load(self.batches_file), self.load(self.products_file))
+                self._columns, self._cogs = columns, line_cogs(columns, cost_ids, cost_values)
+                self._version = version
+            return self._columns, self._cogs
+
+    def _sales_columns(self):
+        """Columns for sales.json, flattening only sales appended since the last call.
+
+        Sales are only ever appended or deleted, so an unchanged last sale
+        means the columns still cover everything before it.
+        """
+        offset = self._tail[0] if self._columns is not None and tail_intact(self.sales_file, self._tail) else 0
+        last = []
+
+        def sales():
+            for sale, end in iter_records_after(self.sales_file, offset):
+                last[:] = [end, sale]
+                yield sale
+
+        if offset:
+            columns = append_columns(self._columns, build_columns(sales(), self._columns['accounts']))
+        else:
+            columns, self._tail = build_columns(sales()), None
+        if last:
+            self._tail = (last[0], json.dumps(last[1]))
+        return columns
+
+    def report(self, group_by='product', start=None, end=None, account=None):
+        columns, cogs = self._prepare()
+        return gross_margin(columns, cogs, group_by, start, end, account)
@@ -0,0 +1,153 @@
+"""Token-bucket rate limiting shared by all gunicorn workers.
+
+Buckets live in a small fixed-size hash table in an mmap'd file, so every
+worker on the host sees the same counts. Slots are (key, tokens, updated).
+A key hashes the route group, the scope ('account' or 'ip') and the id,
+with linear probing; when a probe window is full, the least recently used
+slot is reused. Per-group allowed/limited counters sit in the file header.
+Updates take an flock, which is held for microseconds.
+
+Limits per route group come from RATE_LIMIT_<GROUP>="<requests>/<seconds>",
+e.g. RATE_LIMIT_AUTH=10/60: a bucket holds 10 tokens and refills over 60s.
+"""
+import hashlib
+import mmap
+import os
+import struct
+import threading
+import time
+
+from filestore import FileLock
+
+# Group -> (requests, seconds); overridable via RATE_LIMIT_<GROUP>
+DEFAULT_LIMITS = {
+    'auth': (10, 60),
+    'write': (120, 60),
+}
+SLOTS = int(os.environ.get('RATE_LIMIT_SLOTS', 8192))
+PROBES = 16
+MAX_GROUPS = 16
+
+MAGIC = b'PRL1'
+HEADER = struct.Struct('<4sII8s')  # magic, slots, groups, group-name fingerprint
+COUNTERS = struct.Struct('<QQ')    # allowed, limited
+SLOT = struct.Struct('<Qdd')       # key, tokens, updated
+HEADER_SIZE = 512
+
+
+def load_limits(defaults=DEFAULT_LIMITS):
+    limits = {}
+    for group, (requests, seconds) in defaults.items():
+        value = os.environ.get(f'RATE_LIMIT_{group.upper()}')
+        if value:
+            requests, seconds = value.split('/')
+        limits[group] = (float(requests), float(seconds))
+    return limits
+
+
+def _key(group, scope, ident):
+    digest = hashlib.blake2b(f'{group}|{scope}|{ident}'.encode(), digest_size=8).digest()
+    return int.from_bytes(digest, 'little') or 1  # 0 marks an empty slot
+
+
+class RateLimiter:
+    def __init__(self, path, limits=None, slots=SLOTS):
+        self.path = path
+        self.limits = limits or load_limits()
+        self.groups = sorted(self.limits)[:MAX_GROUPS]
+        self.slots = slots
+        self._fingerprint = hashlib.blake2b('|'.join(self.groups).encode(), digest_size=8).digest()
+        self._lock = threading.Lock()
+        self._file_lock = FileLock(path)
+        self._pid = None
+        self._file = None
+        self._map = None
+
+    def _open(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                self._open_file()
+
+    def _open_file(self):
+        size = HEADER_SIZE + self.slots * SLOT.size
+        handle = open(self.path, 'a+b')
+        with self._file_lock:
+            handle.seek(0)
+            header = handle.read(HEADER.size)
+            if len(header) < HEADER.size or HEADER.unpack(header) != (MAGIC, self.slots, len(self.groups), self._fingerprint):
+                # New file, or the table layout / groups changed: start empty
+                handle.truncate(0)
+                handle.write(HEADER.pack(MAGIC, self.slots, len(self.groups), self._fingerprint))
+                handle.truncate(size)
+                handle.flush()
+        self._file = handle
+        self._map = mmap.mmap(handle.fileno(), size)
+        self._pid = os.getpid()
+
+    def _counter_offset(self, group):
+        return HEADER.size + self.groups.index(group) * COUNTERS.size
+
+    def _bump(self, group, allowed):
+        offset = self._counter_offset(group)
+        counts = list(COUNTERS.unpack_from(self._map, offset))
+        counts[0 if allowed else 1] += 1
+        COUNTERS.pack_into(self._map, offset, *counts)
+
+    def _take(self, key, capacity, rate, now):
+        """(allowed, tokens left, seconds until a token) for one bucket."""
+        start = key % self.slots
+        found, free, oldest, oldest_time = None, None, None, None
+        for probe in range(PROBES):
+            offset = HEADER_SIZE + ((start + probe) % self.slots) * SLOT.size
+            slot_key, tokens, updated = SLOT.unpack_from(self._map, offset)
+            if slot_key == key:
+                found = (offset, min(capacity, tokens + (now - updated) * rate))
+                break
+            if free is None and (slot_key == 0 or updated < now - capacity / rate):
+                # Empty, or idle long enough to have refilled: reusable
+                free = offset
+            if oldest is None or updated < oldest_time:
+                oldest, oldest_time = offset, updated
+        offset, tokens = found or (free if free is not None else oldest, capacity)
+        allowed = tokens >= 1
+        if allowed:
+            tokens -= 1
+        SLOT.pack_into(self._map, offset, key, tokens, now)
+        return allowed, tokens, 0.0 if allowed else (1 - tokens) / rate
+
+    def hit(self, group, identities):
+        """Charge one request to every (scope, id) bucket of `group`.
+
+        Returns (allowed, remaining, retry_after_seconds). All buckets are
+        charged even when one is empty, so a flood from one IP drains it
+        for every account behind that IP.
+        """
+        if group not in self.limits:
+            return True, None, 0
+        self._open()
+        capacity, seconds = self.limits[group]
+        rate = capacity / seconds
+        now = time.time()
+        allowed, remaining, retry_after = True, capacity, 0.0
+        with self._file_lock:
+            for scope, ident in identities:
+                ok, left, wait = self._take(_key(group, scope, ident), capacity, rate, now)
+                allowed = allowed and ok
+                remaining = min(remaining, left)
+                retry_after = max(retry_after, wait)
+            self._bump(group, allowed)
+        return allowed, int(remaining), retry_after
+
+    def stats(self):
+        self._open()
+        groups = {}
+        with self._file_lock:
+            for group in self.groups:
+                allowed, limited = COUNTERS.unpack_from(self._map, self._counter_offset(group))
+                requests, seconds = self.limits[group]
+                groups[group] = {'limit': requests, 'perSeconds': seconds, 'allowed': allowed, 'limited': limited}
+            used = sum(1 for index in range(self.slots)
+                       if SLOT.unpack_from(self._map, HEADER_SIZE + index * SLOT.size)[0])
+        return {'groups': groups, 'slots': self.slots, 'slotsUsed': used}
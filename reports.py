@@ -0,0 +1,99 @@
+"""Best-seller and category performance reports.
+
+Sales are streamed record by record from sales.json into one small counter
+per product (bounded by the catalog, not by history) and the top N are
+picked with heapq. Results are cached per (account, range, N) until
+sales.json or products.json change.
+"""
+import heapq
+import threading
+from collections import OrderedDict
+
+from filestore import file_version, iter_records
+from salelines import line_quantity, line_revenue
+
+CACHE_SIZE = 128
+METRICS = ('revenue', 'quantity')
+
+
+class SalesReports:
+    def __init__(self, sales_file, products_file, load):
+        self.sales_file = sales_file
+        self.products_file = products_file
+        self.load = load
+        self._lock = threading.Lock()
+        self._version = None
+        self._cache = OrderedDict()
+
+    def _cached(self, key, compute):
+        version = (file_version(self.sales_file), file_version(self.products_file))
+        with self._lock:
+            if version != self._version:
+                self._cache.clear()
+                self._version = version
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                return self._cache[key]
+        result = compute()
+        with self._lock:
+            if version == self._version:
+                self._cache[key] = result
+                if len(self._cache) > CACHE_SIZE:
+                    self._cache.popitem(last=False)
+        return result
+
+    def _product_totals(self, account_id, start, end):
+        """Stream sales once into {productId: [quantity, revenue, salesCount]}."""
+        totals = {}
+        for sale in iter_records(self.sales_file):
+            if account_id is not None and str(sale.get('accountId')) != str(account_id):
+                continue
+            created_at = sale.get('createdAt', '')
+            if created_at < start or created_at > end:
+                continue
+            for item in sale.get('items', []):
+                counters = totals.get(item.get('productId'))
+                if counters is None:
+                    counters = totals[item.get('productId')] = [0.0, 0.0, 0]
+                counters[0] += line_quantity(item)
+                counters[1] += line_revenue(item)
+                counters[2] += 1
+        return totals
+
+    def top_products(self, account_id, start, end, n=10, metric='revenue'):
+        def compute():
+            products = {p['id']: p for p in self.load(self.products_file)}
+            totals = self._product_totals(account_id, start, end)
+            column = 1 if metric == 'revenue' else 0
+            best = heapq.nlargest(n, totals.items(), key=lambda entry: entry[1][column])
+            return [{
+                'productId': product_id,
+                'name': products.get(product_id, {}).get('name'),
+                'category': products.get(product_id, {}).get('category', 'general'),
+                'quantity': round(quantity, 3),
+                'revenue': round(revenue, 2),
+                'salesCount': count,
+            } for product_id, (quantity, revenue, count) in best]
+        return self._cached(('products', str(account_id), start, end, n, metric), compute)
+
+    def categories(self, account_id, start, end, n=None):
+        def compute():
+            category_of = {p['id']: p.get('category', 'general') for p in self.load(self.products_file)}
+            by_category = {}
+            for product_id, (quantity, revenue, count) in self._product_totals(account_id, start, end).items():
+                counters = by_category.setdefault(category_of.get(product_id, 'unknown'), [0.0, 0.0, 0, 0])
+                counters[0] += quantity
+                counters[1] += revenue
+                counters[2] += count
+                counters[3] += 1
+            total_revenue = sum(c[1] for c in by_category.values()) or 1.0
+            ranked = heapq.nlargest(n or len(by_category), by_category.items(), key=lambda entry: entry[1][1])
+            return [{
+                'category': category,
+                'quantity': round(quantity, 3),
+                'revenue': round(revenue, 2),
+                'share': round(revenue / total_revenue, 4),
+                'salesCount': count,
+                'productsSold': products_sold,
+            } for category, (quantity, revenue, count, products_sold) in ranked]
+        return self._cached(('categories', str(account_id), start, end, n), compute)
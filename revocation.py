@@ -0,0 +1,105 @@
+"""Locked users and revoked tokens, checked by token_required without I/O.
+
+Each worker keeps two in-memory sets: ids of locked/inactive users and
+digests of revoked tokens. Every membership test is O(1). Workers stay in
+sync through a generation counter in a tiny mmap'd file. Anyone who locks a
+user or revokes a token bumps it. A check reads the counter from shared
+memory, with no syscall, and reloads the sets from users.json and
+revoked_tokens.json only when it moved.
+"""
+import hashlib
+import mmap
+import os
+import struct
+import threading
+import time
+
+from filestore import FileLock
+
+GENERATION = struct.Struct('<Q')
+
+
+def is_locked(user):
+    return bool(user.get('locked')) or user.get('active', True) is False
+
+
+def token_digest(token):
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+class RevocationSet:
+    def __init__(self, users_file, revoked_file, generation_file, load, save):
+        self.users_file = users_file
+        self.revoked_file = revoked_file
+        self.generation_file = generation_file
+        self.load = load
+        self.save = save
+        self._lock = threading.Lock()
+        self._file_lock = FileLock(generation_file)
+        self._pid = None
+        self._file = None
+        self._map = None
+        self._seen = None
+        self._locked_users = frozenset()
+        self._revoked = frozenset()
+
+    def _open(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            handle = open(self.generation_file, 'a+b')
+            if os.fstat(handle.fileno()).st_size < GENERATION.size:
+                handle.truncate(GENERATION.size)
+            self._file = handle
+            self._map = mmap.mmap(handle.fileno(), GENERATION.size)
+            self._seen = None
+            self._pid = os.getpid()
+
+    def _bump(self):
+        self._open()
+        with self._file_lock:
+            generation = GENERATION.unpack_from(self._map, 0)[0] + 1
+            GENERATION.pack_into(self._map, 0, generation)
+
+    def _refresh(self):
+        self._open()
+        generation = GENERATION.unpack_from(self._map, 0)[0]
+        if generation == self._seen:
+            return
+        locked_users = frozenset(u.get('id') for u in self.load(self.users_file) if is_locked(u))
+        now = time.time()
+        revoked = frozenset(r['digest'] for r in self.load(self.revoked_file)
+                            if not r.get('expiresAt') or r['expiresAt'] > now)
+        with self._lock:
+            self._locked_users, self._revoked, self._seen = locked_users, revoked, generation
+
+    def check(self, token, claims):
+        """None if the token may be used, else 'locked' or 'revoked'."""
+        self._refresh()
+        if claims.get('id') in self._locked_users:
+            return 'locked'
+        if self._revoked and token_digest(token) in self._revoked:
+            return 'revoked'
+        return None
+
+    def users_changed(self):
+        """Call after saving users.json with a lock/unlock (or deletion)."""
+        self._bump()
+
+    def revoke(self, token, claims):
+        """Reject this token from now on, e.g. on logout."""
+        self._open()
+        now = time.time()
+        with self._file_lock:
+            # Drop entries for tokens that have expired anyway
+            revoked = [r for r in self.load(self.revoked_file) if not r.get('expiresAt') or r['expiresAt'] > now]
+            revoked.append({'digest': token_digest(token), 'userId': claims.get('id'),
+                            'expiresAt': claims.get('exp'), 'revokedAt': now})
+            self.save(self.revoked_file, revoked)
+            GENERATION.pack_into(self._map, 0, GENERATION.unpack_from(self._map, 0)[0] + 1)
+
+    def stats(self):
+        self._refresh()
+        return {'generation': self._seen, 'lockedUsers': len(self._locked_users), 'revokedTokens': len(self._revoked)}
@@ -0,0 +1,171 @@
+"""Hourly and daily sales rollups per account, cashier and payment method.
+
+Each sale updates a handful of counters in data/rollups/<account>/<YYYY-MM>.json
+(hour and day buckets for that month), so a dashboard chart reads at most a
+few small month files instead of every raw sale. They are built from
+sales.json on first start; run `python rollups.py --rebuild` to rebuild
+them by hand.
+"""
+import json
+import os
+import shutil
+import sys
+
+from filestore import FileLock, file_version, iter_records, write_json_atomic
+
+GRANULARITIES = {'hour': 13, 'day': 10}  # Prefix length of the ISO timestamp
+GROUPS = ('cashier', 'paymentMethod')
+FIELDS = ('count', 'gross', 'discount', 'tax', 'items')
+
+
+def empty_bucket():
+    return {name: 0 for name in FIELDS}
+
+
+def sale_deltas(sale, sign=1):
+    return {
+        'count': sign,
+        'gross': sign * float(sale.get('total', 0) or 0),
+        'discount': sign * float(sale.get('discount', 0) or 0),
+        'tax': sign * float(sale.get('tax', 0) or 0),
+        'items': sign * sum(float(i.get('quantity', i.get('weight', 0)) or 0) for i in sale.get('items', [])),
+    }
+
+
+def _bump(bucket, deltas):
+    for name, delta in deltas.items():
+        bucket[name] = round(bucket.get(name, 0) + delta, 2)
+
+
+def _fold(data, sale, sign=1):
+    created_at = sale.get('createdAt') or ''
+    deltas = sale_deltas(sale, sign)
+    groups = {
+        'cashier': str(sale.get('cashierId')),
+        'paymentMethod': str(sale.get('paymentMethod', 'cash')),
+    }
+    for granularity, width in GRANULARITIES.items():
+        entry = data[granularity].setdefault(created_at[:width], {'all': empty_bucket()})
+        _bump(entry['all'], deltas)
+        for group, key in groups.items():
+            _bump(entry.setdefault(group, {}).setdefault(key, empty_bucket()), deltas)
+
+
+def _months(start, end):
+    """YYYY-MM strings from start to end inclusive."""
+    year, month = int(start[:4]), int(start[5:7])
+    while f'{year:04d}-{month:02d}' <= end[:7]:
+        yield f'{year:04d}-{month:02d}'
+        month += 1
+        if month > 12:
+            year, month = year + 1, 1
+
+
+class SalesRollups:
+    def __init__(self, rollups_dir):
+        self.rollups_dir = rollups_dir
+        # Beside the directory, so reset() cannot delete it from under a holder
+        self._lock = FileLock(rollups_dir.rstrip('/\\') + '.lock')
+        self._cache = {}
+
+    def _path(self, account_id, month):
+        return os.path.join(self.rollups_dir, str(account_id), f'{month}.json')
+
+    def _read(self, path, fresh=False):
+        version = file_version(path)
+        if version is None:
+            return {'hour': {}, 'day': {}}
+        cached = self._cache.get(path)
+        if cached and cached[0] == version and not fresh:
+            return cached[1]
+        with open(path, 'r') as f:
+            data = json.load(f)
+        self._cache[path] = (version, data)
+        return data
+
+    def _write(self, path, data):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        write_json_atomic(path, data)
+        self._cache[path] = (file_version(path), data)
+
+    def add_sale(self, sale, sign=1):
+        """Fold a sale into its hour/day buckets; sign=-1 removes it again."""
+        created_at = sale.get('createdAt') or ''
+        if len(created_at) < GRANULARITIES['hour']:
+            return
+        path = self._path(sale.get('accountId'), created_at[:7])
+        with self._lock:
+            # Re-read under the lock: another worker may have written since
+            data = self._read(path, fresh=True)
+            _fold(data, sale, sign)
+            self._write(path, data)
+
+    def remove_sales(self, sales):
+        for sale in sales:
+            self.add_sale(sale, -1)
+
+    def reset(self):
+        with self._lock:
+            shutil.rmtree(self.rollups_dir, ignore_errors=True)
+            os.makedirs(self.rollups_dir, exist_ok=True)
+            self._cache.clear()
+
+    def rebuild(self, sales_file):
+        """Recompute every month file from sales.json in one streaming pass.
+
+        The lock is held from the scan to the last write, so a sale added
+        meanwhile cannot be overwritten. Returns the number of month files.
+        """
+        with self._lock:
+            months = {}
+            for sale in iter_records(sales_file):
+                created_at = sale.get('createdAt') or ''
+                if len(created_at) < GRANULARITIES['hour']:
+                    continue
+                path = self._path(sale.get('accountId'), created_at[:7])
+                _fold(months.setdefault(path, {'hour': {}, 'day': {}}), sale)
+            shutil.rmtree(self.rollups_dir, ignore_errors=True)
+            os.makedirs(self.rollups_dir, exist_ok=True)
+            self._cache.clear()
+            for path, data in months.items():
+                self._write(path, data)
+        return len(months)
+
+    def ensure(self, sales_file):
+        """Build the rollups from sales.json if they were never built."""
+        if not os.path.isdir(self.rollups_dir):
+            self.rebuild(sales_file)
+
+    def series(self, account_id, start, end, granularity='day', group_by=None):
+        """Bucketed rows between the ISO timestamps start and end, oldest first."""
+        width = GRANULARITIES[granularity]
+        low, high = start[:width], end[:width]
+        rows = []
+        for month in _months(start, end):
+            buckets = self._read(self._path(account_id, month))[granularity]
+            for bucket in sorted(buckets):
+                if bucket < low or bucket > high:
+                    continue
+                entry = buckets[bucket]
+                if group_by is None:
+                    if entry['all']['count']:
+                        rows.append(dict(entry['all'], bucket=bucket))
+                else:
+                    for key, counters in sorted(entry.get(group_by, {}).items()):
+                        if counters['count']:
+                            rows.append(dict(counters, bucket=bucket, **{group_by: key}))
+        return rows
+
+
+def main(argv):
+    data_dir = os.environ.get('DATA_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data'))
+    if '--rebuild' not in argv:
+        print("Usage: python rollups.py --rebuild")
+        return 1
+    months = SalesRollups(f'{data_dir}/rollups').rebuild(f'{data_dir}/sales.json')
+    print(f"✅ Rollups rebuilt: {months} month files")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,17 @@
+"""How much of a product a sale line moved, and for how much.
+
+Shared by the file-backed reports (reports.py) and the Postgres backend
+(database.py), so a weighed line counts the same everywhere: `weight`
+stands in for `quantity`, and `lineTotal`, when the pricing engine set
+one, wins over price x quantity.
+"""
+
+
+def line_quantity(item):
+    return float(item.get('quantity', item.get('weight', 0)) or 0)
+
+
+def line_revenue(item):
+    if 'lineTotal' in item:
+        return float(item['lineTotal'] or 0)
+    return float(item.get('price', 0) or 0) * line_quantity(item)
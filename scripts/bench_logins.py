@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+Benchmark of password verification throughput (not a pytest test file).
+
+Simulates a shift-change stampede: `clients` threads each log in repeatedly
+through credentials.CredentialService and the script reports logins per
+second, latency percentiles and how many attempts the queue limit turned
+away with 503.
+
+Usage: python scripts/bench_logins.py [--logins 200] [--clients 16] [--n 16384]
+                                      [--workers 2] [--queue 32]
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import credentials
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--logins', type=int, default=200)
+    parser.add_argument('--clients', type=int, default=16)
+    parser.add_argument('--n', type=int, default=credentials.SCRYPT_N, help='scrypt cost (power of two)')
+    parser.add_argument('--workers', type=int, default=credentials.HASH_WORKERS)
+    parser.add_argument('--queue', type=int, default=credentials.HASH_QUEUE_LIMIT)
+    args = parser.parse_args()
+
+    credentials.SCRYPT_N = args.n
+    stored = credentials.hash_password('correct horse', n=args.n)
+    service = credentials.CredentialService(args.workers, args.queue)
+    latencies, rejected = [], [0]
+    lock = threading.Lock()
+    remaining = [args.logins]
+
+    def client():
+        while True:
+            with lock:
+                if remaining[0] <= 0:
+                    return
+                remaining[0] -= 1
+            started = time.perf_counter()
+            try:
+                matches, _ = service.verify('correct horse', stored)
+                assert matches
+                with lock:
+                    latencies.append(time.perf_counter() - started)
+            except credentials.CredentialsBusy:
+                with lock:
+                    rejected[0] += 1
+
+    print(f"{args.logins} logins, {args.clients} clients, scrypt n={args.n}, "
+          f"{args.workers} workers, queue limit {args.queue}, {os.cpu_count()} CPUs")
+    began = time.perf_counter()
+    threads = [threading.Thread(target=client) for _ in range(args.clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - began
+
+    latencies.sort()
+    if latencies:
+        pick = lambda q: latencies[min(len(latencies) - 1, int(q * len(latencies)))] * 1000
+        print(f"logins/s   {len(latencies) / elapsed:8.1f}")
+        print(f"p50 ms     {pick(0.50):8.1f}")
+        print(f"p95 ms     {pick(0.95):8.1f}")
+    print(f"rejected   {rejected[0]:8d}  (would be 503 + Retry-After)")
+
+
+if __name__ == '__main__':
+    main()
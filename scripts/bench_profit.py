@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+"""
+Benchmark for profit.py on a synthetic sales history (not a pytest test file).
+
+Usage: python scripts/bench_profit.py [lines]   (default 1,000,000 lines)
+"""
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import profit
+
+
+def synthetic_sales(lines, products=500, accounts=20, lines_per_sale=4):
+    rng = random.Random(42)
+    start = datetime(2025, 1, 1)
+    for sale_id in range(lines // lines_per_sale):
+        items = []
+        for _ in range(lines_per_sale):
+            product_id = rng.randint(1, products)
+            quantity = rng.randint(1, 5)
+            line = {'productId': product_id, 'quantity': quantity, 'price': 10 + product_id % 90,
+                    'lineTotal': quantity * (10 + product_id % 90)}
+            if rng.random() < 0.5:
+                line['batches'] = [{'batchId': product_id, 'quantity': quantity}]
+                line['cost'] = quantity * (5 + product_id % 40)
+            items.append(line)
+        yield {
+            'id': sale_id + 1,
+            'accountId': sale_id % accounts + 1,
+            'items': items,
+            'createdAt': (start + timedelta(seconds=sale_id * 30)).isoformat(),
+        }
+
+
+def timed(label, fn):
+    began = time.perf_counter()
+    result = fn()
+    print(f"{label:<32} {time.perf_counter() - began:8.3f}s")
+    return result
+
+
+def main():
+    lines = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    batches = [{'productId': p, 'quantity': 100, 'cost': 5 + p % 40} for p in range(1, 501)]
+
+    print(f"Profit report benchmark: {lines:,} sales lines")
+    columns = timed('build columns', lambda: profit.build_columns(synthetic_sales(lines)))
+    cost_ids, cost_values = profit.unit_costs(batches, [])
+    cogs = timed('line COGS', lambda: profit.line_cogs(columns, cost_ids, cost_values))
+    for group_by in profit.GROUPS:
+        rows = timed(f'margin by {group_by}', lambda: profit.gross_margin(columns, cogs, group_by))
+        print(f"{'':<32} {len(rows)} groups")
+    timed('margin by product, one account', lambda: profit.gross_margin(columns, cogs, 'product', account=3))
+    timed('margin by day, 90-day range', lambda: profit.gross_margin(
+        columns, cogs, 'day', start='2025-02-01T00:00:00', end='2025-05-01T23:59:59'))
+
+
+if __name__ == '__main__':
+    main()
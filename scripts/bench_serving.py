@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+HTTP load benchmark for the read endpoints (not a pytest test file).
+
+Runs `clients` threads, each with its own keep-alive connection, cycling
+through `paths` for `seconds`, and reports requests per second and latency
+percentiles. Point it at the sync server and the async one in turn, with
+the same DATABASE_URL and SECRET_KEY:
+
+  gunicorn -c gunicorn.conf.py -b 127.0.0.1:5000 app_db:app
+  uvicorn app_async:app --port 5001
+  python scripts/bench_serving.py --url http://127.0.0.1:5000 --account-id 1 --user-id 1
+  python scripts/bench_serving.py --url http://127.0.0.1:5001 --account-id 1 --user-id 1
+
+A token is minted from SECRET_KEY (or pass --token).
+
+Usage: python scripts/bench_serving.py [--url http://127.0.0.1:5000] [--clients 32]
+                                       [--seconds 10] [--paths /api/products,/api/sales?limit=50]
+"""
+import argparse
+import http.client
+import os
+import threading
+import time
+from urllib.parse import urlparse
+
+import jwt
+
+DEFAULT_PATHS = '/api/products,/api/sales?limit=50,/api/auth/me,/api/settings'
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--url', default='http://127.0.0.1:5000')
+    parser.add_argument('--clients', type=int, default=32)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--paths', default=DEFAULT_PATHS)
+    parser.add_argument('--token')
+    parser.add_argument('--user-id', type=int, default=1)
+    parser.add_argument('--account-id', type=int, default=1)
+    args = parser.parse_args()
+
+    token = args.token or jwt.encode(
+        {'id': args.user_id, 'accountId': args.account_id, 'role': 'admin'},
+        os.environ.get('SECRET_KEY', 'your-secret-key-change-in-production'), algorithm='HS256')
+    headers = {'Authorization': f'Bearer {token}'}
+    target = urlparse(args.url)
+    paths = args.paths.split(',')
+    latencies, errors = [], [0]
+    lock = threading.Lock()
+    deadline = time.perf_counter() + args.seconds
+
+    def client(offset):
+        conn = http.client.HTTPConnection(target.hostname, target.port or 80, timeout=30)
+        mine, failed, index = [], 0, offset
+        while time.perf_counter() < deadline:
+            path = paths[index % len(paths)]
+            index += 1
+            started = time.perf_counter()
+            try:
+                conn.request('GET', path, headers=headers)
+                response = conn.getresponse()
+                response.read()
+                if response.status != 200:
+                    failed += 1
+                    continue
+            except (OSError, http.client.HTTPException):
+                failed += 1
+                conn.close()
+                conn = http.client.HTTPConnection(target.hostname, target.port or 80, timeout=30)
+                continue
+            mine.append(time.perf_counter() - started)
+        conn.close()
+        with lock:
+            latencies.extend(mine)
+            errors[0] += failed
+
+    print(f"{args.url}: {args.clients} clients for {args.seconds:g}s over {', '.join(paths)}")
+    began = time.perf_counter()
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(args.clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - began
+
+    latencies.sort()
+    if latencies:
+        pick = lambda q: latencies[min(len(latencies) - 1, int(q * len(latencies)))] * 1000
+        print(f"requests/s {len(latencies) / elapsed:8.1f}")
+        print(f"p50 ms     {pick(0.50):8.1f}")
+        print(f"p95 ms     {pick(0.95):8.1f}")
+    print(f"errors     {errors[0]:8d}")
+
+
+if __name__ == '__main__':
+    main()
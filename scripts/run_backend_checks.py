@@ -2,8 +2,17 @@
 """
 Script runner for manual backend checks (not a pytest test file).
 """
+import json
+import os
+import sys
+import tempfile
+
 import requests
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pricing import PricingEngine, tax_settings
+
 BASE_URL = "http://localhost:5002/api"
 
 def health_check():
@@ -13,5 +22,71 @@ def health_check():
     except Exception as e:
         print('health failed', e)
 
+def pricing_checks():
+    """Price carts with PricingEngine against a throwaway data dir."""
+    failures = []
+
+    def check(name, got, expected):
+        if got != expected:
+            failures.append(f'{name}: expected {expected!r}, got {got!r}')
+
+    def load(path):
+        with open(path) as f:
+            return json.load(f)
+
+    with tempfile.TemporaryDirectory() as data_dir:
+        files = {name: os.path.join(data_dir, f'{name}.json') for name in ('products', 'discounts', 'settings')}
+
+        def write(name, data):
+            with open(files[name], 'w') as f:
+                json.dump(data, f)
+
+        write('products', [
+            {'id': 1, 'name': 'Soda', 'price': 0.1, 'unit': 'pcs'},
+            {'id': 2, 'name': 'Bread', 'price': 33.33, 'unit': 'pcs'},
+        ])
+        write('discounts', [
+            {'id': 1, 'name': '10% off', 'type': 'percentage', 'value': 10, 'accountId': 'a'},
+            {'id': 2, 'name': '5 off', 'type': 'fixed', 'value': 5, 'accountId': 'a'},
+            {'id': 3, 'name': 'Other shop', 'type': 'percentage', 'value': 50, 'accountId': 'b'},
+        ])
+        write('settings', [{'accountId': 'a', 'taxType': 'exclusive', 'taxRate': 16}])
+        engine = PricingEngine(files['products'], files['discounts'], files['settings'], load)
+        bread = [{'productId': 2, 'quantity': 3}]
+
+        # Rounding: 3 x 0.1 is 0.3, not 0.30000000000000004
+        quote = engine.quote({'items': [{'productId': 1, 'quantity': 3}]}, 'a')
+        check('rounded subtotal', quote['subtotal'], 0.3)
+
+        # Exclusive tax is added on top; the cart cannot pick its own rate
+        quote = engine.quote({'items': bread, 'taxRate': 0, 'taxType': 'inclusive'}, 'a')
+        check('exclusive tax', (quote['taxType'], quote['taxRate'], quote['tax'], quote['total']),
+              ('exclusive', 16.0, 16.0, 115.99))
+
+        # Only selected discounts apply, in discounts.json order, each to what is left
+        check('no discount unless selected', engine.quote({'items': bread}, 'a')['discount'], 0)
+        quote = engine.quote({'items': bread, 'discountIds': [2, 1]}, 'a')
+        check('ordered discounts', [d['amount'] for d in quote['discounts']], [10.0, 5.0])
+        check('discounted total', quote['total'], 98.59)
+
+        # Another account's discount is never applied
+        quote = engine.quote({'items': bread, 'discountIds': [3]}, 'a')
+        check('foreign discount', quote['discount'], 0)
+
+        # An account without settings gets the TAX_TYPE/TAX_RATE defaults, not another account's
+        quote = engine.quote({'items': bread}, 'b')
+        check('default tax', (quote['taxType'], quote['taxRate']), tax_settings(None))
+
+        # Inclusive tax is carved out of the total
+        write('settings', [{'accountId': 'a', 'taxType': 'inclusive', 'taxRate': 8}])
+        quote = engine.quote({'items': bread}, 'a')
+        check('inclusive tax', (quote['taxType'], quote['tax'], quote['total']), ('inclusive', 7.41, 99.99))
+
+    for failure in failures:
+        print('pricing failed', failure)
+    print('pricing', 'ok' if not failures else f'{len(failures)} failed')
+    return not failures
+
 if __name__ == '__main__':
     health_check()
+    pricing_checks()
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+Local SMTP stand-in for testing the email outbox (not a pytest test file).
+
+Accepts every message and prints its headers. With --fail-rate, it rejects
+that share of DATA commands with a 451 so the outbox retries and backs off.
+
+Usage: python scripts/smtp_sink.py [--port 8025] [--fail-rate 0.3]
+Then run the app with SMTP_HOST=localhost SMTP_PORT=8025.
+"""
+import argparse
+import random
+import socketserver
+from email import message_from_bytes
+
+
+class SMTPHandler(socketserver.StreamRequestHandler):
+    fail_rate = 0.0
+
+    def reply(self, line):
+        self.wfile.write((line + '\r\n').encode())
+
+    def handle(self):
+        self.reply('220 smtp-sink ready')
+        recipients = []
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode(errors='replace').strip()
+            verb = command[:4].upper()
+            if verb in ('HELO', 'EHLO'):
+                self.reply('250 smtp-sink')
+            elif verb == 'MAIL':
+                recipients = []
+                self.reply('250 OK')
+            elif verb == 'RCPT':
+                recipients.append(command[8:].strip('<> '))
+                self.reply('250 OK')
+            elif verb == 'DATA':
+                self.reply('354 End data with <CR><LF>.<CR><LF>')
+                body = []
+                while True:
+                    data = self.rfile.readline()
+                    if data in (b'.\r\n', b'.\n', b''):
+                        break
+                    body.append(data[1:] if data.startswith(b'..') else data)
+                if random.random() < self.fail_rate:
+                    self.reply('451 Temporary failure, try again later')
+                    continue
+                message = message_from_bytes(b''.join(body))
+                print(f"To: {', '.join(recipients)} | Subject: {message['Subject']}", flush=True)
+                self.reply('250 OK: queued')
+            elif verb == 'RSET':
+                recipients = []
+                self.reply('250 OK')
+            elif verb == 'NOOP':
+                self.reply('250 OK')
+            elif verb == 'QUIT':
+                self.reply('221 Bye')
+                return
+            else:
+                self.reply('502 Command not implemented')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8025)
+    parser.add_argument('--fail-rate', type=float, default=0.0)
+    args = parser.parse_args()
+
+    SMTPHandler.fail_rate = args.fail_rate
+    socketserver.ThreadingTCPServer.allow_reuse_address = True
+    with socketserver.ThreadingTCPServer((args.host, args.port), SMTPHandler) as server:
+        print(f"SMTP sink listening on {args.host}:{args.port}", flush=True)
+        server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+"""Subscription / free-trial status per user, for the owner console.
+
+Enriching every user means parsing createdAt and working out trial state.
+That is done once per (users.json version, calendar date) and the result is
+kept with the users grouped by status. Requests only filter and slice it.
+Days are counted in calendar days so the cached result is valid for the
+whole day.
+"""
+import threading
+from datetime import date, datetime, timedelta
+
+from filestore import file_version
+
+TRIAL_DAYS = 30
+PAID_PLAN_PRICE = 99  # Default price - adjust as needed
+STATUSES = ('free_trial', 'trial_expired', 'paid')
+
+
+def is_free_trial(user):
+    return user.get('plan') in [None, 'free', '']
+
+
+def enrich(user, today):
+    """Copy of the user (without password) with trial/subscription fields."""
+    try:
+        created_at = datetime.fromisoformat(user['createdAt'])
+    except (KeyError, TypeError, ValueError):
+        # Very old records have no createdAt; treat them as created today
+        created_at = datetime.combine(today, datetime.min.time())
+
+    days_active = (today - created_at.date()).days
+    free_trial = is_free_trial(user)
+    reached_limit = free_trial and days_active >= TRIAL_DAYS
+    if free_trial:
+        status = 'trial_expired' if reached_limit else 'free_trial'
+    else:
+        status = 'paid'
+
+    enriched = {k: v for k, v in user.items() if k != 'password'}
+    enriched.setdefault('createdAt', created_at.isoformat())
+    enriched.update({
+        'daysActive': days_active,
+        'isFreeTrial': free_trial,
+        'hasReachedTrialLimit': reached_limit,
+        'daysUntilExpiry': max(0, TRIAL_DAYS - days_active) if free_trial else 0,
+        'subscriptionStatus': status,
+        'trialExpireDate': (created_at + timedelta(days=TRIAL_DAYS)).isoformat() if free_trial else None,
+        'planPrice': 0 if free_trial else PAID_PLAN_PRICE,
+    })
+    return enriched
+
+
+class SubscriptionStatus:
+    def __init__(self, users_file, load):
+        self.users_file = users_file
+        self.load = load
+        self._lock = threading.Lock()
+        self._key = None
+        self._users = []
+        self._by_status = {}
+
+    def _snapshot(self):
+        key = (file_version(self.users_file), date.today())
+        with self._lock:
+            if key == self._key:
+                return self._users, self._by_status
+        today = key[1]
+        users = [enrich(user, today) for user in self.load(self.users_file)]
+        by_status = {status: [] for status in STATUSES}
+        for user in users:
+            by_status[user['subscriptionStatus']].append(user)
+        with self._lock:
+            self._key, self._users, self._by_status = key, users, by_status
+        return users, by_status
+
+    def users(self, status=None):
+        """Enriched users, optionally only those with `status`; treat as read-only."""
+        users, by_status = self._snapshot()
+        return by_status.get(status, []) if status else users
+
+    def page(self, status=None, offset=0, limit=None):
+        """(users[offset:offset + limit], total matching)."""
+        users = self.users(status)
+        end = None if limit is None else offset + limit
+        return users[offset:end], len(users)
+
+    def counts(self):
+        _, by_status = self._snapshot()
+        return {status: len(users) for status, users in by_status.items()}
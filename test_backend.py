@@ -119,6 +119,38 @@ def test_create_product(token):
         print(f"❌ Product creation failed: {e}")
         return False
 
+def test_cart_quote(token):
+    """Test that the server prices carts itself"""
+    print("\nTesting cart quote...")
+    try:
+        headers = {"Authorization": f"Bearer {token}"}
+        product = requests.post(f"{BASE_URL}/products", json={
+            "name": "Quote Product",
+            "price": 33.33,
+            "quantity": 10,
+            "unit": "pcs"
+        }, headers=headers).json()
+        cart = {"items": [{"productId": product.get("id"), "quantity": 3}]}
+        quote = requests.post(f"{BASE_URL}/cart/quote", json=cart, headers=headers).json()
+        # Client-supplied tax settings and unselected discounts must not change the price
+        tampered = requests.post(f"{BASE_URL}/cart/quote", json=dict(cart, taxRate=0, taxType="inclusive"),
+                                 headers=headers).json()
+        if quote.get("subtotal") != 99.99:
+            print(f"❌ Cart quote failed: subtotal {quote.get('subtotal')}, expected 99.99")
+            return False
+        if quote.get("discount") != 0:
+            print(f"❌ Cart quote failed: discount {quote.get('discount')} applied without discountIds")
+            return False
+        if tampered != quote:
+            print("❌ Cart quote failed: request body changed the tax")
+            return False
+        print("✅ Cart quote priced server-side")
+        print(f"   Total: {quote.get('total')} ({quote.get('taxType')} tax {quote.get('taxRate')}%)")
+        return True
+    except Exception as e:
+        print(f"❌ Cart quote failed: {e}")
+        return False
+
 def main():
     """Run all tests"""
     print("=" * 60)
@@ -148,6 +180,9 @@ def main():
     # Test 5: Create product
     test_create_product(token)
     
+    # Test 6: Price a cart
+    test_cart_quote(token)
+    
     print("\n" + "=" * 60)
     print("✅ All tests completed!")
     print("=" * 60)
@@ -0,0 +1,264 @@
+"""Interval index over clock in/out time entries for attendance and payroll.
+
+Closed shifts are kept sorted by clock-in, globally and per cashier, together
+with the longest closed shift. Shifts overlapping [start, end] therefore
+begin in [start - longest, end], found by bisect. Open shifts (still
+clocked in) are kept in their own small list and run until now. A query
+costs O(log n + k) and the index is rebuilt only when time_entries.json
+changes.
+"""
+import threading
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timedelta
+
+from filestore import FileLock, file_version
+
+GRANULARITIES = ('day', 'week')
+
+
+def _parse(value):
+    try:
+        return datetime.fromisoformat(value) if value else None
+    except (TypeError, ValueError):
+        return None
+
+
+def period_key(moment, granularity):
+    """Bucket label: the date, or the Monday starting the ISO week."""
+    day = moment.date()
+    if granularity == 'week':
+        day -= timedelta(days=day.weekday())
+    return day.isoformat()
+
+
+def _period_end(moment, granularity):
+    day = datetime.combine(moment.date(), datetime.min.time())
+    if granularity == 'week':
+        day -= timedelta(days=moment.weekday())
+        return day + timedelta(days=7)
+    return day + timedelta(days=1)
+
+
+class _Intervals:
+    """Closed shifts sorted by start, plus the longest one to bound searches."""
+
+    def __init__(self):
+        self.starts = []
+        self.shifts = []  # (start, end, entry)
+        self.longest = timedelta(0)
+
+    def add(self, start, end, entry):
+        self.starts.append(start)
+        self.shifts.append((start, end, entry))
+        self.longest = max(self.longest, end - start)
+
+    def sort(self):
+        self.shifts.sort(key=lambda shift: (shift[0], shift[2].get('id', 0)))
+        self.starts = [shift[0] for shift in self.shifts]
+
+    def overlapping(self, start, end):
+        low = bisect_left(self.starts, start - self.longest)
+        high = bisect_right(self.starts, end)
+        return [shift for shift in self.shifts[low:high] if shift[1] >= start]
+
+    def started(self, start, end):
+        return self.shifts[bisect_left(self.starts, start):bisect_left(self.starts, end)]
+
+
+class TimeIndex:
+    def __init__(self, time_entries_file, load):
+        self.time_entries_file = time_entries_file
+        self.load = load
+        self._lock = threading.Lock()
+        self._version = None
+        self._all = None
+        self._by_cashier = None
+        self._open = None
+
+    def _index(self):
+        version = file_version(self.time_entries_file)
+        with self._lock:
+            if version != self._version:
+                closed, by_cashier, open_shifts = _Intervals(), {}, []
+                for entry in self.load(self.time_entries_file):
+                    start = _parse(entry.get('clockInTime'))
+                    if start is None:
+                        continue
+                    end = _parse(entry.get('clockOutTime'))
+                    if entry.get('status') == 'clocked_in' or end is None:
+                        open_shifts.append((start, None, entry))
+                        continue
+                    end = max(end, start)
+                    closed.add(start, end, entry)
+                    by_cashier.setdefault(entry.get('cashierId'), _Intervals()).add(start, end, entry)
+                closed.sort()
+                for intervals in by_cashier.values():
+                    intervals.sort()
+                open_shifts.sort(key=lambda shift: shift[0])
+                self._all, self._by_cashier, self._open = closed, by_cashier, open_shifts
+                self._version = version
+            return self._all, self._by_cashier, self._open
+
+    def _shifts(self, start, end, cashier_id=None):
+        """(start, end, entry) overlapping [start, end]; open shifts end now."""
+        closed, by_cashier, open_shifts = self._index()
+        if cashier_id is not None:
+            closed = by_cashier.get(cashier_id)
+        shifts = closed.overlapping(start, end) if closed else []
+        now = datetime.now()
+        for shift_start, _, entry in open_shifts:
+            if shift_start <= end and now >= start and (cashier_id is None or entry.get('cashierId') == cashier_id):
+                shifts.append((shift_start, now, entry))
+        shifts.sort(key=lambda shift: shift[0])
+        return shifts
+
+    def shifts_between(self, start, end, cashier_id=None):
+        """Entries whose shift overlaps [start, end], by clock-in time."""
+        return [entry for _, _, entry in self._shifts(start, end, cashier_id)]
+
+    def started_between(self, start, end):
+        """Entries clocked in within [start, end)."""
+        closed, _, open_shifts = self._index()
+        shifts = closed.started(start, end) + [s for s in open_shifts if start <= s[0] < end]
+        shifts.sort(key=lambda shift: shift[0])
+        return [entry for _, _, entry in shifts]
+
+    def clocked_in(self):
+        """Entries of staff currently clocked in."""
+        return [entry for _, _, entry in self._index()[2]]
+
+    def hours(self, start, end, granularity='day', cashier_id=None):
+        """Hours per cashier per day/week within [start, end].
+
+        Overlapping shifts of the same cashier (e.g. a double clock-in) are
+        merged before summing so the time is only paid once, and counted.
+        """
+        per_cashier = {}
+        for shift_start, shift_end, entry in self._shifts(start, end, cashier_id):
+            per_cashier.setdefault(entry.get('cashierId'), []).append((shift_start, shift_end, entry))
+
+        summary = []
+        for cashier, shifts in per_cashier.items():
+            merged, overlaps = [], 0
+            for shift_start, shift_end, _ in shifts:
+                shift_start, shift_end = max(shift_start, start), min(shift_end, end)
+                if merged and shift_start < merged[-1][1]:
+                    overlaps += 1
+                    merged[-1][1] = max(merged[-1][1], shift_end)
+                else:
+                    merged.append([shift_start, shift_end])
+
+            buckets = {}
+            for piece_start, piece_end in merged:
+                while piece_start < piece_end:
+                    boundary = min(_period_end(piece_start, granularity), piece_end)
+                    key = period_key(piece_start, granularity)
+                    buckets[key] = buckets.get(key, 0) + (boundary - piece_start).total_seconds()
+                    piece_start = boundary
+
+            summary.append({
+                'cashierId': cashier,
+                'cashierName': shifts[-1][2].get('cashierName'),
+                'shifts': len(shifts),
+                'overlappingShifts': overlaps,
+                'openShifts': sum(1 for _, _, entry in shifts if entry.get('status') == 'clocked_in'),
+                'totalHours': round(sum(buckets.values()) / 3600, 2),
+                'periods': {key: round(seconds / 3600, 2) for key, seconds in sorted(buckets.items())},
+            })
+        summary.sort(key=lambda row: -row['totalHours'])
+        return summary
+
+
+def find_entry(entries, entry_id):
+    """Entry by id in O(log n); ids are assigned increasingly so the file is id-ordered."""
+    low, high = 0, len(entries)
+    while low < high:
+        middle = (low + high) // 2
+        if entries[middle].get('id', 0) < entry_id:
+            low = middle + 1
+        else:
+            high = middle
+    if low < len(entries) and entries[low].get('id') == entry_id:
+        return entries[low]
+    # Hand-edited or imported files may be out of order
+    return next((e for e in entries if e.get('id') == entry_id), None)
+
+
+class OpenShifts:
+    """cashierId -> open entry, persisted in data/open_shifts.json.
+
+    Invariant: at most one open shift per cashier. The file records the
+    time_entries.json version it was written against. opened()/closed()
+    update the map and stamp it with the version after the caller's save;
+    a reader that finds the entries changed any other way rebuilds the map
+    with one scan.
+    """
+
+    def __init__(self, open_shifts_file, time_entries_file, load, save):
+        self.open_shifts_file = open_shifts_file
+        self.time_entries_file = time_entries_file
+        self.load = load
+        self.save = save
+        self._lock = FileLock(open_shifts_file + '.lock')
+
+    @staticmethod
+    def _summary(entry):
+        return {
+            'entryId': entry['id'],
+            'cashierId': entry.get('cashierId'),
+            'cashierName': entry.get('cashierName'),
+            'cashierEmail': entry.get('cashierEmail'),
+            'clockInTime': entry.get('clockInTime'),
+        }
+
+    def rebuild(self, entries):
+        """Recompute the map from the entries (the latest open entry per cashier wins)."""
+        shifts = {}
+        for entry in entries:
+            if entry.get('status') == 'clocked_in':
+                shifts[str(entry.get('cashierId'))] = self._summary(entry)
+        self._write(shifts)
+        return shifts
+
+    def _write(self, shifts):
+        version = file_version(self.time_entries_file)
+        self.save(self.open_shifts_file, {'entriesVersion': list(version) if version else None, 'shifts': shifts})
+
+    def _shifts(self):
+        stored = self.load(self.open_shifts_file)
+        version = file_version(self.time_entries_file)
+        if isinstance(stored, dict) and stored.get('entriesVersion') == (list(version) if version else None):
+            return stored.get('shifts', {})
+        with self._lock:
+            return self.rebuild(self.load(self.time_entries_file))
+
+    def _stored(self):
+        """The map as last written, or None if it has to be rebuilt."""
+        stored = self.load(self.open_shifts_file)
+        return stored.get('shifts') if isinstance(stored, dict) and 'entriesVersion' in stored else None
+
+    def get(self, cashier_id):
+        return self._shifts().get(str(cashier_id))
+
+    def on_shift(self):
+        return sorted(self._shifts().values(), key=lambda shift: shift.get('clockInTime') or '')
+
+    def opened(self, entry):
+        """Call after saving a clock-in."""
+        with self._lock:
+            shifts = self._stored()
+            if shifts is None:
+                self.rebuild(self.load(self.time_entries_file))
+                return
+            shifts[str(entry.get('cashierId'))] = self._summary(entry)
+            self._write(shifts)
+
+    def closed(self, cashier_id):
+        """Call after saving a clock-out."""
+        with self._lock:
+            shifts = self._stored()
+            if shifts is None:
+                self.rebuild(self.load(self.time_entries_file))
+                return
+            shifts.pop(str(cashier_id), None)
+            self._write(shifts)
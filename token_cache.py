@@ -0,0 +1,82 @@
+"""Bounded LRU cache of decoded JWT claims for token_required.
+
+Tills present the same token on every request, so the HMAC check is done
+once per token and its claims reused until the token's exp or TTL_SECONDS,
+whichever is first. Entries are keyed by a SHA-256 digest of the token
+(the raw token is never kept). The whole cache is dropped when the
+signing secret changes, and a user's entries when that user is locked.
+"""
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import jwt
+
+MAX_ENTRIES = int(os.environ.get('TOKEN_CACHE_SIZE', 10000))
+TTL_SECONDS = int(os.environ.get('TOKEN_CACHE_TTL', 300))
+
+
+class TokenCache:
+    def __init__(self, max_entries=MAX_ENTRIES, ttl=TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # digest -> (claims, expires_at)
+        self._secret = None
+        self._counters = {'hits': 0, 'misses': 0, 'expired': 0, 'evicted': 0, 'flushes': 0}
+
+    def decode(self, token, secret):
+        """Claims of a valid token, as jwt.decode would return; raises jwt errors."""
+        digest = hashlib.sha256(token.encode()).digest()
+        secret_digest = hashlib.sha256(secret.encode()).digest()
+        now = time.time()
+        with self._lock:
+            if secret_digest != self._secret:
+                # Secret rotated: nothing signed with the old one may be served from cache
+                if self._secret is not None:
+                    self._entries.clear()
+                    self._counters['flushes'] += 1
+                self._secret = secret_digest
+            entry = self._entries.get(digest)
+            if entry is not None:
+                if entry[1] > now:
+                    self._entries.move_to_end(digest)
+                    self._counters['hits'] += 1
+                    return dict(entry[0])
+                del self._entries[digest]
+                self._counters['expired'] += 1
+            self._counters['misses'] += 1
+
+        claims = jwt.decode(token, secret, algorithms=['HS256'])
+        expires_at = now + self.ttl
+        if isinstance(claims.get('exp'), (int, float)):
+            expires_at = min(expires_at, claims['exp'])
+        with self._lock:
+            if secret_digest == self._secret:
+                self._entries[digest] = (claims, expires_at)
+                self._entries.move_to_end(digest)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+                    self._counters['evicted'] += 1
+        return dict(claims)
+
+    def forget_user(self, user_id):
+        """Drop cached tokens of one user, e.g. when the account is locked."""
+        with self._lock:
+            stale = [digest for digest, (claims, _) in self._entries.items() if claims.get('id') == user_id]
+            for digest in stale:
+                del self._entries[digest]
+        return len(stale)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._counters['flushes'] += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self._counters['hits'] + self._counters['misses']
+            return dict(self._counters, size=len(self._entries), maxEntries=self.max_entries,
+                        ttlSeconds=self.ttl, hitRate=round(self._counters['hits'] / lookups, 4) if lookups else None)
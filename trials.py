@@ -0,0 +1,114 @@
+"""Trial-expiry sweeper: reminder and upgrade emails at the right moment.
+
+Free-trial users are kept in a min-heap of upcoming events: a reminder
+REMINDER_DAYS before the trial ends and an upgrade email when it ends. The
+heap is rebuilt only when users.json changes. The sweeper thread sleeps
+until the next event is due, so it does not poll every user. Emails go
+through the outbox with a per-user/per-trial dedupe key, so restarts and
+multiple workers never send one twice.
+"""
+import heapq
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+from filestore import file_version
+from subscriptions import TRIAL_DAYS, is_free_trial
+
+REMINDER_DAYS = int(os.environ.get('TRIAL_REMINDER_DAYS', 5))
+UPGRADE_GRACE_DAYS = 3  # Don't email users whose trial ended long before the sweeper saw it
+RESCAN_SECONDS = 60
+
+
+def trial_email(user, kind, days_left=None):
+    """(subject, message) for an 'upgrade' or 'reminder' email."""
+    name = user.get('name', 'User')
+    if kind == 'upgrade':
+        return ('Your free trial has expired - Upgrade now!',
+                f"Hi {name}, your {TRIAL_DAYS}-day free trial has ended. Please upgrade to continue using our service.")
+    if kind == 'reminder':
+        return (f'Your free trial expires in {days_left} days',
+                f"Hi {name}, your free trial expires in {days_left} days. Upgrade now to avoid losing access.")
+    raise ValueError(f'Unknown email type: {kind}')
+
+
+def trial_expiry(user):
+    if not is_free_trial(user) or not user.get('email'):
+        return None
+    try:
+        return datetime.fromisoformat(user['createdAt']) + timedelta(days=TRIAL_DAYS)
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+class TrialSweeper:
+    def __init__(self, users_file, load, outbox, reminder_days=REMINDER_DAYS):
+        self.users_file = users_file
+        self.load = load
+        self.outbox = outbox
+        self.reminder_days = reminder_days
+        self._lock = threading.Lock()
+        self._version = None
+        self._heap = []
+        self._users = {}
+        self._pid = None
+
+    def _rebuild(self):
+        users = {u['id']: u for u in self.load(self.users_file) if 'id' in u}
+        heap = []
+        for user in users.values():
+            expiry = trial_expiry(user)
+            if expiry is None:
+                continue
+            heap.append((expiry - timedelta(days=self.reminder_days), 'reminder', user['id'], expiry))
+            heap.append((expiry, 'upgrade', user['id'], expiry))
+        heapq.heapify(heap)
+        self._heap, self._users = heap, users
+
+    def sweep(self, now=None):
+        """Enqueue every event due by `now`; returns seconds until the next one."""
+        now = now or datetime.now()
+        with self._lock:
+            version = file_version(self.users_file)
+            if version != self._version:
+                self._rebuild()
+                self._version = version
+            while self._heap and self._heap[0][0] <= now:
+                _, kind, user_id, expiry = heapq.heappop(self._heap)
+                user = self._users.get(user_id)
+                # Skip events that no longer apply (upgraded, or too late to matter)
+                if user is None or trial_expiry(user) != expiry:
+                    continue
+                if kind == 'reminder' and now >= expiry:
+                    continue
+                if kind == 'upgrade' and now - expiry > timedelta(days=UPGRADE_GRACE_DAYS):
+                    continue
+                days_left = -((now - expiry) // timedelta(days=1)) if kind == 'reminder' else None  # Rounded up
+                subject, message = trial_email(user, kind, days_left)
+                self.outbox.enqueue(user['email'], subject, message, user=user, kind=kind,
+                                    key=f"trial-{kind}:{user_id}:{expiry.date().isoformat()}")
+            if not self._heap:
+                return RESCAN_SECONDS
+            return max(0.0, (self._heap[0][0] - now).total_seconds())
+
+    def _run(self):
+        pid = os.getpid()
+        while self._pid == pid:
+            try:
+                delay = self.sweep()
+            except Exception as e:
+                print(f"Trial sweeper error: {e}")
+                delay = RESCAN_SECONDS
+            # Wake for the next event, or rescan in case users.json changed
+            time.sleep(min(delay, RESCAN_SECONDS))
+
+    def start(self):
+        """Start the sweeper thread in this process (again after a fork)."""
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            threading.Thread(target=self._run, name='trial-sweeper', daemon=True).start()